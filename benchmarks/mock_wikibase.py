@@ -0,0 +1,482 @@
+"""
+A local stand-in for a wikibase (mediawiki api + query service), for benchmarking without the network
+
+One server hosts two sites: /wikidata (pre-filled with synthetic properties and items) and /local
+(empty, like a fresh wikibase-docker). Each has an api at /<site>/w/api.php and a SPARQL endpoint at
+/<site>/sparql.
+
+Api actions: login (and meta=tokens), wbeditentity, wbgetentities, wbsearchentities, query&meta=wikibase.
+/<site>/w/index.php?title=Special:EntityData/<id>.nt serves an entity as N-Triples, in the (unmunged) form
+Wikibase does, for the value types the mock has (strings, urls, entities, monolingual text).
+The SPARQL endpoint only answers the queries wikibase_tools sends (plus ASK queries and a generic
+"?item" query used for make_entities_from_sparql); anything else gets an empty result.
+
+Every request is counted, and a latency and error rate can be set.
+
+Usage:
+
+server = MockServer(n_props=100, n_items=1000, latency=0.01, error_rate=0.01)
+server.start()
+server.url("local")  # http://127.0.0.1:<port>/local/w/api.php
+server.sparql_url("local")
+server.counts  # Counter of requests by site and action
+server.stop()
+
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WIKIBASE_ONTOLOGY = "http://wikiba.se/ontology#"
+DATATYPES = {
+    'commonsMedia': 'CommonsMedia', 'external-id': 'ExternalId', 'geo-shape': 'GeoShape',
+    'globe-coordinate': 'GlobeCoordinate', 'math': 'Math', 'monolingualtext': 'Monolingualtext',
+    'quantity': 'Quantity', 'string': 'String', 'tabular-data': 'TabularData', 'time': 'Time', 'url': 'Url',
+    'wikibase-item': 'WikibaseItem', 'wikibase-property': 'WikibaseProperty',
+}
+
+
+def now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class Site:
+    def __init__(self, name, concept_base_uri):
+        self.name = name
+        self.concept_base_uri = concept_base_uri
+        self.entities = dict()
+        self.next_id = {'item': 1, 'property': 1}
+        self.revision = 0
+        self.lock = threading.Lock()
+
+    def new_id(self, entity_type):
+        n = self.next_id[entity_type]
+        self.next_id[entity_type] += 1
+        return ("P" if entity_type == 'property' else "Q") + str(n)
+
+    def save(self, data, entity_id=None, entity_type=None):
+        # create (entity_type given) or edit an entity from wbeditentity data
+        with self.lock:
+            if entity_type is not None:
+                entity_id = entity_id if entity_id else self.new_id(entity_type)
+                entity = {'id': entity_id, 'type': entity_type, 'labels': {}, 'descriptions': {}, 'aliases': {},
+                          'claims': {}, 'sitelinks': {}}
+                if entity_type == 'property':
+                    entity['datatype'] = data.get('datatype', 'string')
+            else:
+                entity = self.entities[entity_id]
+            for key in ('labels', 'descriptions'):
+                for lang, value in data.get(key, dict()).items():
+                    entity[key][lang] = {'language': lang, 'value': value['value']}
+            for lang, values in data.get('aliases', dict()).items():
+                entity['aliases'][lang] = [{'language': lang, 'value': x['value']} for x in values]
+            claims = data.get('claims', dict())
+            if isinstance(claims, list):
+                by_prop = dict()
+                for c in claims:
+                    by_prop.setdefault(c['mainsnak']['property'], []).append(c)
+                claims = by_prop
+            for prop, statements in claims.items():
+                for statement in statements:
+                    self._save_claim(entity, prop, statement)
+            self.revision += 1
+            entity['lastrevid'] = self.revision
+            entity['modified'] = now()
+            self.entities[entity_id] = entity
+            return entity
+
+    def _save_claim(self, entity, prop, statement):
+        existing = entity['claims'].setdefault(prop, [])
+        if 'remove' in statement:
+            entity['claims'][prop] = [x for x in existing if x['id'] != statement['id']]
+            return
+        statement = dict(statement, type='statement', rank=statement.get('rank', 'normal'))
+        snak = statement['mainsnak']
+        snak['property'] = prop
+        if prop in self.entities:
+            snak['datatype'] = self.entities[prop]['datatype']
+        else:
+            snak.setdefault('datatype', 'string')
+        for i, x in enumerate(existing):
+            if x['id'] == statement.get('id'):
+                existing[i] = statement
+                return
+        statement['id'] = "{}${}".format(entity['id'], uuid.uuid4())
+        existing.append(statement)
+
+    def claim_values(self, entity, prop):
+        return [c['mainsnak']['datavalue']['value'] for c in entity['claims'].get(prop, [])
+                if c['mainsnak'].get('snaktype', 'value') == 'value' and 'datavalue' in c['mainsnak']]
+
+    def label(self, entity):
+        return entity['labels'].get('en', dict()).get('value', "")
+
+    def uri(self, entity_id):
+        return self.concept_base_uri + entity_id
+
+
+def populate_wikidata(site, n_props, n_items, seed=0):
+    # synthetic properties and items, shaped like wikidata's
+    rng = random.Random(seed)
+    datatypes = list(DATATYPES)
+    for n in range(1, n_props + 1):
+        data = {'labels': {'en': {'value': "property {}".format(n)}},
+                'descriptions': {'en': {'value': "description of property {}".format(n)}},
+                'aliases': {'en': [{'value': "prop {}".format(n)}]},
+                'datatype': 'url' if n in {1628, 1709} else rng.choice(datatypes)}
+        site.save(data, entity_type='property')
+    # the equivalent property / class properties, with their wikidata ids
+    for pid, label in (("P1628", "equivalent property"), ("P1709", "equivalent class")):
+        if pid not in site.entities:
+            site.save({'labels': {'en': {'value': label}}, 'datatype': 'url'}, entity_id=pid, entity_type='property')
+    for n in range(1, n_props + 1):
+        pid = "P{}".format(n)
+        if rng.random() < 0.3:
+            site.save({'claims': {'P1628': [{'mainsnak': {'snaktype': 'value', 'datavalue': {
+                'value': "http://example.org/ontology/prop{}".format(n), 'type': 'string'}}}]}}, entity_id=pid)
+    for n in range(1, n_items + 1):
+        claims = {}
+        if rng.random() < 0.5:
+            claims['P1709'] = [{'mainsnak': {'snaktype': 'value', 'datavalue': {
+                'value': "http://example.org/ontology/Class{}".format(n), 'type': 'string'}}}]
+        data = {'labels': {'en': {'value': "item {}".format(n)}},
+                'descriptions': {'en': {'value': "description of item {}".format(n)}},
+                'claims': claims}
+        site.save(data, entity_type='item')
+
+
+class MockServer:
+    def __init__(self, n_props=50, n_items=500, latency=0.0, error_rate=0.0, seed=0):
+        """
+
+        :param n_props: number of properties on the mock wikidata
+        :param n_items: number of items on the mock wikidata
+        :param latency: seconds added to every request
+        :param error_rate: fraction of api requests answered with a maxlag error or an HTTP 503
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.counts = Counter()
+        self.counts_lock = threading.Lock()
+        self.sites = {'wikidata': Site('wikidata', "http://www.wikidata.org/entity/"),
+                      'local': Site('local', "http://wikibase.svc/entity/")}
+        populate_wikidata(self.sites['wikidata'], n_props, n_items)
+        self.httpd = None
+        self.thread = None
+
+    def reset_local(self):
+        self.sites['local'] = Site('local', "http://wikibase.svc/entity/")
+
+    def reset_counts(self):
+        with self.counts_lock:
+            self.counts.clear()
+
+    def count(self, key):
+        with self.counts_lock:
+            self.counts[key] += 1
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, parse_qs(urlparse(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                params = parse_qs(urlparse(self.path).query)
+                params.update(parse_qs(self.rfile.read(length).decode()))
+                server.handle(self, params)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+
+    def url(self, site):
+        return "{}/{}/w/api.php".format(self.base_url, site)
+
+    def sparql_url(self, site):
+        return "{}/{}/sparql".format(self.base_url, site)
+
+    def handle(self, request, params):
+        params = {k: v[-1] for k, v in params.items()}
+        path = urlparse(request.path).path.strip("/").split("/")
+        site = self.sites.get(path[0])
+        if self.latency:
+            time.sleep(self.latency)
+        if site is None:
+            return self.send(request, {'error': 'not found'}, status=404)
+        if path[-1] == "sparql":
+            self.count("{}:sparql".format(site.name))
+            results = sparql(site, params.get('query', ""))
+            if request.headers.get('Accept') == "text/tab-separated-values":
+                return self.send_text(request, to_tsv(results))
+            return self.send(request, results)
+
+        if path[-1] == "index.php":
+            self.count("{}:index".format(site.name))
+            m = re.match(r"Special:EntityData/(\w+)\.nt$", params.get('title', ""))
+            entity = site.entities.get(m.group(1)) if m else None
+            if entity is None:
+                return self.send(request, {'error': 'not found'}, status=404)
+            return self.send_text(request, entity_ntriples(site, entity), content_type="application/n-triples")
+
+        action = params.get('action', "")
+        self.count("{}:{}".format(site.name, action))
+        if action in {'wbeditentity', 'wbgetentities', 'wbsearchentities'} and self.rng.random() < self.error_rate:
+            self.count("{}:injected_error".format(site.name))
+            if self.rng.random() < 0.5:
+                return self.send(request, {'error': {'code': 'maxlag', 'info': "Waiting for a database server",
+                                                     'lag': 0.1}}, headers={'Retry-After': '0'})
+            return self.send(request, {'error': 'unavailable'}, status=503)
+        try:
+            response = api(site, action, params)
+        except KeyError as e:
+            response = {'error': {'code': 'no-such-entity', 'info': "Could not find {}".format(e)}}
+        return self.send(request, response)
+
+    def send_text(self, request, text, content_type="text/tab-separated-values"):
+        self.send(request, text, content_type=content_type)
+
+    def send(self, request, data, status=200, headers=None, content_type="application/json"):
+        body = data.encode() if isinstance(data, str) else json.dumps(data).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or dict()).items():
+            request.send_header(k, v)
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def api(site, action, params):
+    if action == 'query' and params.get('meta') == 'tokens':
+        if params.get('type') == 'login':
+            return {'query': {'tokens': {'logintoken': "logintoken+\\"}}}
+        return {'query': {'tokens': {'csrftoken': "csrftoken+\\"}}}
+    if action == 'query' and params.get('meta') == 'wikibase':
+        return {'query': {'wikibase': {'conceptbaseuri': site.concept_base_uri}}}
+    if action == 'login':
+        if not params.get('lgtoken'):
+            # old style login: the first request asks for a token
+            return {'login': {'result': "NeedToken", 'token': "logintoken+\\"}}
+        return {'login': {'result': "Success", 'lgusername': params.get('lgname')}}
+    if action == 'wbeditentity':
+        data = json.loads(params['data'])
+        if 'new' in params:
+            entity = site.save(data, entity_type=params['new'])
+        else:
+            entity = site.save(data, entity_id=params['id'])
+        return {'success': 1, 'entity': entity}
+    if action == 'wbgetentities':
+        return {'success': 1, 'entities': get_entities(site, params)}
+    if action == 'wbsearchentities':
+        search = params.get('search', "").lower()
+        entity_type = params.get('type', 'item')
+        limit = int(params.get('limit', 7))
+        hits = [{'id': e['id'], 'label': site.label(e)} for e in site.entities.values()
+                if e['type'] == entity_type and site.label(e).lower().startswith(search)]
+        return {'success': 1, 'search': hits[:limit]}
+    return {'error': {'code': 'badvalue', 'info': "Unsupported action: {}".format(action)}}
+
+
+def get_entities(site, params):
+    props = set(params.get('props', "info|sitelinks|aliases|labels|descriptions|claims|datatype").split("|"))
+    languages = set(params['languages'].split("|")) if 'languages' in params else None
+    entities = dict()
+    for entity_id in params.get('ids', "").split("|"):
+        entity = site.entities.get(entity_id)
+        if entity is None:
+            entities[entity_id] = {'id': entity_id, 'missing': ""}
+            continue
+        out = {'id': entity_id, 'type': entity['type']}
+        if 'info' in props:
+            out.update({'lastrevid': entity['lastrevid'], 'modified': entity['modified'], 'pageid': 1,
+                        'ns': 120 if entity['type'] == 'property' else 0,
+                        'title': ("Property:" if entity['type'] == 'property' else "") + entity_id})
+        if 'datatype' in props and 'datatype' in entity:
+            out['datatype'] = entity['datatype']
+        for key in ('labels', 'descriptions', 'aliases', 'claims', 'sitelinks'):
+            if key in props:
+                value = entity[key]
+                if languages is not None and key in {'labels', 'descriptions', 'aliases'}:
+                    value = {k: v for k, v in value.items() if k in languages}
+                out[key] = value
+        entities[entity_id] = out
+    return entities
+
+
+def entity_ntriples(site, entity):
+    # what Special:EntityData/<id>.nt?flavor=dump returns, for the parts of an entity the mock has
+    root = site.concept_base_uri[:-len("entity/")]
+    rdf, schema, xsd = ("http://www.w3.org/1999/02/22-rdf-syntax-ns#", "http://schema.org/",
+                        "http://www.w3.org/2001/XMLSchema#")
+
+    def lit(value, language=None, datatype=None):
+        # non-ascii characters are written as \u escapes
+        value = "".join(c if 32 <= ord(c) < 127 and c not in '"\\' else
+                        {'"': '\\"', '\\': '\\\\', '\n': '\\n'}.get(c, "\\u{:04X}".format(ord(c)))
+                        for c in value)
+        return '"{}"'.format(value) + ("@" + language if language else "^^<{}>".format(datatype) if datatype else "")
+
+    subject = "<{}entity/{}>".format(root, entity['id'])
+    data = "<{}wiki/Special:EntityData/{}>".format(root, entity['id'])
+    triples = [(data, "<{}type>".format(rdf), "<{}Dataset>".format(schema)),
+               (data, "<{}about>".format(schema), subject),
+               (data, "<{}version>".format(schema), lit(str(entity['lastrevid']), datatype=xsd + "integer")),
+               (data, "<{}dateModified>".format(schema), lit(entity['modified'], datatype=xsd + "dateTime")),
+               (subject, "<{}type>".format(rdf), "<{}{}>".format(WIKIBASE_ONTOLOGY, entity['type'].title()))]
+    for x in entity['labels'].values():
+        for predicate in ("http://www.w3.org/2000/01/rdf-schema#label", "http://www.w3.org/2004/02/skos/core#prefLabel",
+                          schema + "name"):
+            triples.append((subject, "<{}>".format(predicate), lit(x['value'], language=x['language'])))
+    for x in entity['descriptions'].values():
+        triples.append((subject, "<{}description>".format(schema), lit(x['value'], language=x['language'])))
+    for aliases in entity['aliases'].values():
+        for x in aliases:
+            triples.append((subject, "<http://www.w3.org/2004/02/skos/core#altLabel>",
+                            lit(x['value'], language=x['language'])))
+    if entity['type'] == 'property':
+        triples.append((subject, "<{}propertyType>".format(WIKIBASE_ONTOLOGY),
+                        "<{}{}>".format(WIKIBASE_ONTOLOGY, DATATYPES[entity['datatype']])))
+        for predicate, namespace in (("directClaim", "prop/direct/"), ("claim", "prop/"),
+                                     ("statementProperty", "prop/statement/"), ("qualifier", "prop/qualifier/")):
+            triples.append((subject, "<{}{}>".format(WIKIBASE_ONTOLOGY, predicate),
+                            "<{}{}{}>".format(root, namespace, entity['id'])))
+    for pid, claims in entity['claims'].items():
+        for claim in claims:
+            # every statement of the mock has normal rank
+            statement = "<{}entity/statement/{}>".format(root, claim['id'].replace("$", "-"))
+            triples += [(subject, "<{}prop/{}>".format(root, pid), statement),
+                        (statement, "<{}type>".format(rdf), "<{}Statement>".format(WIKIBASE_ONTOLOGY)),
+                        (statement, "<{}type>".format(rdf), "<{}BestRank>".format(WIKIBASE_ONTOLOGY)),
+                        (statement, "<{}rank>".format(WIKIBASE_ONTOLOGY), "<{}NormalRank>".format(WIKIBASE_ONTOLOGY))]
+            snak = claim['mainsnak']
+            datatype = snak.get('datatype') or site.entities.get(pid, {}).get('datatype')
+            value = snak.get('datavalue', {}).get('value')
+            if isinstance(value, dict) and 'id' in value:
+                term = "<{}entity/{}>".format(root, value['id'])
+            elif isinstance(value, dict) and 'text' in value:
+                term = lit(value['text'], language=value['language'])
+            elif isinstance(value, str):
+                term = "<{}>".format(value) if datatype == 'url' else lit(value)
+            else:
+                continue
+            triples += [(statement, "<{}prop/statement/{}>".format(root, pid), term),
+                        (subject, "<{}prop/direct/{}>".format(root, pid), term)]
+    return "".join("{} {} {} .\n".format(*x) for x in triples)
+
+
+def bindings(rows):
+    # rows: list of dict var -> value
+    def binding(value):
+        if isinstance(value, str) and value.startswith("http"):
+            return {'type': 'uri', 'value': value}
+        return {'type': 'literal', 'value': str(value)}
+
+    variables = sorted({k for row in rows for k in row})
+    return {'head': {'vars': variables},
+            'results': {'bindings': [{k: binding(v) for k, v in row.items()} for row in rows]}}
+
+
+def sparql(site, query):
+    ask = re.search(r"ASK\s*\{\s*wd:(\w+)", query)
+    if ask:
+        entity = site.entities.get(ask.group(1))
+        revision = re.search(r"\?v >= (\d+)", query)
+        visible = entity is not None and (not revision or entity['lastrevid'] >= int(revision.group(1)))
+        return {'head': {}, 'boolean': visible}
+
+    entities = sorted(site.entities.values(), key=lambda e: (e['id'][0], int(e['id'][1:])))
+    props = [e for e in entities if e['type'] == 'property']
+
+    if "owl#equivalentProperty>" in query and "directClaim" in query:
+        # equivalent property: the property with an equiv prop statement on itself
+        return bindings([{'item': site.uri(e['id']), 'prop': site.concept_base_uri.replace("entity/", "prop/direct/")
+                          + e['id']} for e in props
+                         if "http://www.w3.org/2002/07/owl#equivalentProperty" in site.claim_values(e, e['id'])])
+
+    m = re.search(r"\?prop wdt:(P\d+) <(\S+)>", query)
+    if m:
+        return bindings([{'prop': site.uri(e['id'])} for e in entities if m.group(2) in site.claim_values(e, m.group(1))])
+
+    m = re.search(r"\{ \?entity wdt:(P\d+) \?uri \} UNION \{ \?entity wdt:(P\d+) \?uri \}", query)
+    if m:
+        limit, offset = re.search(r"LIMIT (\d+) OFFSET (\d+)", query).groups()
+        rows = [{'entity': site.uri(e['id']), 'uri': v} for e in entities for p in m.groups()
+                for v in site.claim_values(e, p)]
+        return bindings(rows[int(offset):int(offset) + int(limit)])
+
+    if "GROUP_CONCAT(DISTINCT ?alias" in query:
+        since = re.search(r'\?modified > "([^"]+)"', query)
+        rows = []
+        for e in props:
+            if since and e['modified'] <= since.group(1):
+                continue
+            row = {'p': site.uri(e['id']), 'pt': WIKIBASE_ONTOLOGY + DATATYPES[e['datatype']],
+                   'pLabel': site.label(e), 'modified': e['modified']}
+            if 'en' in e['descriptions']:
+                row['d'] = e['descriptions']['en']['value']
+            aliases = [x['value'] for x in e['aliases'].get('en', [])]
+            if aliases:
+                row['aliases'] = "|".join(aliases)
+            rows.append(row)
+        return bindings(rows)
+
+    if "wdt:P1628 ?equiv" in query:
+        since = re.search(r'\?modified > "([^"]+)"', query)
+        return bindings([{'p': site.uri(e['id']), 'equivs': "|".join(site.claim_values(e, 'P1628'))} for e in props
+                         if site.claim_values(e, 'P1628') and not (since and e['modified'] <= since.group(1))])
+
+    if re.search(r"SELECT .*\?item", query, re.S):
+        # stand-in for a user query: all items. supports the keyset paging of sparql_stream.page_query
+        rows = [{'item': site.uri(e['id'])} for e in entities if e['type'] == 'item']
+        after = re.search(r'FILTER \(STR\(\?item\) > "([^"]+)"\)', query)
+        limit = re.search(r"ORDER BY STR\(\?item\) LIMIT (\d+)\s*$", query)
+        if limit:
+            rows = sorted(rows, key=lambda x: x['item'])
+            rows = [x for x in rows if not after or x['item'] > after.group(1)][:int(limit.group(1))]
+        return bindings(rows)
+
+    return bindings([])
+
+
+def to_tsv(results):
+    # SPARQL TSV results format
+    variables = results['head']['vars']
+    lines = ["\t".join("?" + v for v in variables)]
+    for row in results['results']['bindings']:
+        terms = []
+        for v in variables:
+            x = row.get(v)
+            if x is None:
+                terms.append("")
+            elif x['type'] == 'uri':
+                terms.append("<{}>".format(x['value']))
+            else:
+                terms.append('"{}"'.format(x['value'].replace("\\", "\\\\").replace('"', '\\"')))
+        lines.append("\t".join(terms))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Benchmark wikibase_tools end to end against a local mock wikibase (see mock_wikibase.py)
+
+Runs initial_setup, EntityMaker.create_all_props, EntityMaker.make_entities and
+EntityMaker.make_entities_from_sparql, and reports wall time, entities/sec and the number of HTTP
+requests per created entity. Exits with status 1 if a scenario needs more requests per entity than its
+budget, so an extra per-entity query shows up as a failure, or if any entity failed (the failures are
+reported as the scenario's error).
+
+Usage:
+
+./benchmarks/run_benchmarks.py
+./benchmarks/run_benchmarks.py --props 500 --items 2000 --latency 0.005 --error-rate 0.01 --concurrency 8
+./benchmarks/run_benchmarks.py --fast-create
+./benchmarks/run_benchmarks.py --json results.json
+
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_wikibase import MockServer
+
+# max http requests per created entity
+BUDGETS = {
+    'setup': 20,
+    'props': 3,
+    'entities': 3,
+    'sparql': 3,
+}
+
+USER = "benchbot"
+PASS = "password"
+
+
+def point_wdi_at(server):
+    # so nothing in wikidataintegrator falls back to the real wikidata
+    from wikidataintegrator.wdi_config import config
+    config['MEDIAWIKI_API_URL'] = server.url("wikidata")
+    config['SPARQL_ENDPOINT_URL'] = server.sparql_url("wikidata")
+    config['WIKIBASE_URL'] = server.base_url + "/wikidata"
+
+
+def run_setup(server):
+    from wikibase_tools import initial_setup
+    initial_setup.configure(server.url("local"), server.sparql_url("local"))
+    initial_setup.run_setup(initial_setup.get_login(USER, PASS))
+
+
+def get_maker(server, concurrency, fast_create=False):
+    from wikibase_tools import EntityMaker
+    return EntityMaker(server.url("local"), server.sparql_url("local"), USER, PASS, concurrency=concurrency,
+                       wikidata_api_url=server.url("wikidata"), wikidata_sparql_url=server.sparql_url("wikidata"),
+                       fast_create=fast_create)
+
+
+def format_failures(failures, n=3):
+    # "2 failed: Q1: ValueError: ..., Q2: ..."
+    shown = ", ".join("{}: {}: {}".format(k, type(e).__name__, e) for k, e in sorted(failures.items())[:n])
+    return "{} failed: {}{}".format(len(failures), shown, ", ..." if len(failures) > n else "")
+
+
+def run_scenario(server, name, func):
+    n_before = len(server.sites['local'].entities)
+    server.reset_counts()
+    start = time.perf_counter()
+    error = None
+    try:
+        out = func()
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    else:
+        # EntityMaker methods return (results, failures) and don't raise for a failed entity
+        failures = out[1] if isinstance(out, tuple) else None
+        if failures:
+            error = format_failures(failures)
+    wall = time.perf_counter() - start
+    created = len(server.sites['local'].entities) - n_before
+    requests = sum(server.counts.values())
+    result = {'scenario': name,
+              'wall_time': round(wall, 3),
+              'created': created,
+              'entities_per_sec': round(created / wall, 2) if wall else None,
+              'requests': requests,
+              'requests_per_entity': round(requests / created, 2) if created else None,
+              'requests_by_endpoint': dict(sorted(server.counts.items())),
+              'budget': BUDGETS[name],
+              'error': error}
+    result['ok'] = error is None and created > 0 and result['requests_per_entity'] <= BUDGETS[name]
+    return result
+
+
+def main(args):
+    os.environ['WIKIBASE_TOOLS_CACHE'] = tempfile.mkdtemp(prefix="wikibase_tools_bench_")
+    server = MockServer(n_props=args.props, n_items=args.items, latency=args.latency,
+                        error_rate=args.error_rate).start()
+    point_wdi_at(server)
+    wikidata = server.sites['wikidata']
+    qids = sorted(x for x in wikidata.entities if x.startswith("Q"))
+    sample = qids[:len(qids) // 2]
+
+    results = [run_scenario(server, 'setup', lambda: run_setup(server))]
+    maker = get_maker(server, args.concurrency, fast_create=args.fast_create)
+    results.append(run_scenario(server, 'props', maker.create_all_props))
+    results.append(run_scenario(server, 'entities', lambda: maker.make_entities(sample)))
+    results.append(run_scenario(server, 'sparql', lambda: maker.make_entities_from_sparql(
+        "SELECT ?item WHERE { ?item wdt:P31 wd:Q5 }", page_size=args.sparql_page_size)))
+    server.stop()
+
+    print()
+    print("{:<10} {:>8} {:>8} {:>10} {:>9} {:>8} {:>7}  {}".format(
+        "scenario", "wall(s)", "created", "entities/s", "requests", "req/ent", "budget", "status"))
+    for r in results:
+        print("{:<10} {:>8} {:>8} {:>10} {:>9} {:>8} {:>7}  {}".format(
+            r['scenario'], r['wall_time'], r['created'], str(r['entities_per_sec']), r['requests'],
+            str(r['requests_per_entity']), r['budget'], "ok" if r['ok'] else "FAIL " + (r['error'] or "")))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="benchmark wikibase_tools against a mock wikibase")
+    parser.add_argument("--props", type=int, default=50, help="properties on the mock wikidata")
+    parser.add_argument("--items", type=int, default=200, help="items on the mock wikidata")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of api requests that fail")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--fast-create", action="store_true", help="create entities with EntityMaker(fast_create=True)")
+    parser.add_argument("--sparql-page-size", type=int, help="stream the sparql scenario's query in pages of this size")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(main(get_parser().parse_args()))
@@ -0,0 +1,33 @@
+"""
+Smoke test: run the benchmark harness on a small mock wikibase, with and without fast_create
+
+No network needed. Run with:
+
+python -m pytest benchmarks
+
+"""
+import inspect
+import json
+
+import pytest
+from wikidataintegrator.wdi_core import WDItemEngine
+
+from run_benchmarks import get_parser, main
+
+# the WDItemEngine path uses the item_name / domain API of the wikidataintegrator version in requirements.txt
+old_wdi = 'item_name' in inspect.signature(WDItemEngine.__init__).parameters
+wdi_engine = pytest.mark.skipif(not old_wdi, reason="needs the wikidataintegrator version in requirements.txt")
+
+
+@pytest.mark.parametrize("options", [pytest.param([], marks=wdi_engine), ["--fast-create"],
+                                     ["--fast-create", "--sparql-page-size", "30"]])
+def test_scenarios(tmp_path, options):
+    path = str(tmp_path / "results.json")
+    status = main(get_parser().parse_args(["--props", "20", "--items", "60", "--json", path] + options))
+    with open(path) as f:
+        results = json.load(f)
+    assert [r['scenario'] for r in results] == ['setup', 'props', 'entities', 'sparql']
+    for r in results:
+        assert r['error'] is None, r
+        assert r['created'] > 0, r
+    assert status == 0
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='wikibase-tools',
@@ -17,4 +17,7 @@ setup(
         'Programming Language :: Python :: 3',
     ],
     packages=['wikibase_tools'],
+    entry_points={
+        'console_scripts': ['wikibase-tools = wikibase_tools.cli:main'],
+    },
 )
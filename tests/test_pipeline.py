@@ -0,0 +1,27 @@
+import pytest
+
+from wikibase_tools.pipeline import prefetch
+
+
+def test_prefetch():
+    def func(x):
+        if x == 3:
+            raise ValueError(x)
+        return x * 2
+
+    results = list(prefetch(func, range(5)))
+    assert [(item, result) for item, result, _ in results] == [(0, 0), (1, 2), (2, 4), (3, None), (4, 8)]
+    assert isinstance(results[3][2], ValueError)
+
+
+def test_prefetch_items_raise():
+    # e.g. a page of a query that can't be fetched: the results before it, then the error
+    def items():
+        yield from range(3)
+        raise TimeoutError("page 2")
+
+    seen = []
+    with pytest.raises(TimeoutError):
+        for item, _, _ in prefetch(lambda x: x, items(), size=1):
+            seen.append(item)
+    assert seen == [0, 1, 2]
@@ -0,0 +1,36 @@
+import time
+
+from wikibase_tools.plan import get_levels
+
+
+def refs(*ids):
+    # select_statements snaks referring to ids
+    return [{'property': "P31", 'datatype': 'wikibase-item',
+             'datavalue': {'type': 'wikibase-entityid', 'value': {'entity-type': 'item', 'id': x}}} for x in ids]
+
+
+def test_levels():
+    items = {'Q1': refs('Q2', 'Q3'), 'Q2': refs('Q3', 'Q99'), 'Q3': None, 'Q4': [], 'Q5': refs('Q5', 'Q1')}
+    assert get_levels(items) == {'Q1': 2, 'Q2': 1, 'Q3': 0, 'Q4': 0, 'Q5': 3}
+
+
+def test_cycles():
+    # Q1 <-> Q2 is a cycle, Q3 refers to it, Q4 is on its own
+    items = {'Q1': refs('Q2'), 'Q2': refs('Q1'), 'Q3': refs('Q1'), 'Q4': refs('Q5'), 'Q5': None}
+    assert get_levels(items) == {'Q1': 2, 'Q2': 2, 'Q3': 2, 'Q4': 1, 'Q5': 0}
+
+
+def test_many():
+    n = 5000
+    # a chain, independent items, items referring to the whole chain, and a cycle
+    items = {"Q{}".format(i): refs("Q{}".format(i - 1)) if i else None for i in range(n)}
+    items.update({"Q{}".format(i): refs("Q100000000") for i in range(n, 2 * n)})
+    items.update({"Q{}".format(i): refs(*("Q{}".format(j) for j in range(0, n, 50))) for i in range(2 * n, 3 * n)})
+    items.update({"Q{}".format(i): refs("Q{}".format(i + 1 if i + 1 < 4 * n else 3 * n)) for i in range(3 * n, 4 * n)})
+    start = time.perf_counter()
+    levels = get_levels(items)
+    assert time.perf_counter() - start < 5
+    assert [levels["Q{}".format(i)] for i in range(n)] == list(range(n))
+    assert all(levels["Q{}".format(i)] == 0 for i in range(n, 2 * n))
+    assert all(levels["Q{}".format(i)] == n - 50 + 1 for i in range(2 * n, 3 * n))
+    assert all(levels["Q{}".format(i)] == n for i in range(3 * n, 4 * n))
@@ -1 +1,9 @@
-from .make_entities import EntityMaker
\ No newline at end of file
+__all__ = ["EntityMaker"]
+
+
+def __getattr__(name):
+    # imported on first use, so importing the package (e.g. for the command line) stays fast
+    if name == "EntityMaker":
+        from .make_entities import EntityMaker
+        return EntityMaker
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
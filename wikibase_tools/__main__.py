@@ -0,0 +1,5 @@
+import sys
+
+from wikibase_tools.cli import main
+
+sys.exit(main())
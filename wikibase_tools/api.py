@@ -0,0 +1,141 @@
+"""
+Small helpers for calling a mediawiki / wikibase api directly, without going through WDItemEngine
+"""
+import json
+import time
+
+import requests
+
+WIKIDATA_API_URL = "https://www.wikidata.org/w/api.php"
+
+
+class MWApiError(Exception):
+    def __init__(self, error):
+        """
+        :param error: the 'error' dict of a mediawiki api response
+        """
+        self.error = error
+        super().__init__(error.get('info', error))
+
+    @property
+    def code(self):
+        return self.error.get('code')
+
+
+def mediawiki_api_call(mediawiki_api_url, params, method="GET", session=None, **kwargs):
+    """
+    Make a call to the mediawiki api, raising MWApiError if the response contains an error
+    :param mediawiki_api_url:
+    :param params: dict of api parameters. format=json is added
+    :param method: "GET" or "POST"
+    :param session: a requests session. If not given, requests is used directly
+    :param kwargs: passed to requests
+    :return: the decoded json response
+    """
+    session = session if session else requests
+    params = dict(params, format='json')
+    if method == "GET":
+        response = session.get(mediawiki_api_url, params=params, **kwargs)
+    else:
+        response = session.post(mediawiki_api_url, data=params, **kwargs)
+    response.raise_for_status()
+    json_data = response.json()
+    if 'error' in json_data:
+        raise MWApiError(json_data['error'])
+    return json_data
+
+
+def edit_entity(mediawiki_api_url, data, login, new=None, entity_id=None, summary=None, maxlag=None, bot=True):
+    """
+    wbeditentity. Creates a new entity if `new` is given, otherwise edits entity_id
+    :param data: entity json (labels, descriptions, aliases, claims, datatype)
+    :param login: a wdi_login.WDLogin. Its session and edit token are used
+    :param new: "item" or "property"
+    :param maxlag: seconds. the edit is refused with a 'maxlag' error if the replication lag is higher
+    :return: the entity json returned by the api (includes 'id' and 'lastrevid')
+    """
+    params = {'action': 'wbeditentity', 'data': json.dumps(data), 'token': login.get_edit_token()}
+    if new:
+        params['new'] = new
+    else:
+        params['id'] = entity_id
+    if summary:
+        params['summary'] = summary
+    if maxlag:
+        params['maxlag'] = maxlag
+    if bot:
+        params['bot'] = 1
+    return mediawiki_api_call(mediawiki_api_url, params, method="POST", session=login.get_session())['entity']
+
+
+def sparql_query(sparql_endpoint_url, query, session=None, max_retries=5, retry_after=30):
+    """
+    Run a SPARQL query, waiting and retrying while the query service is overloaded (429 / 503)
+    :param session: a requests session. If not given, requests is used directly
+    :return: the decoded json results
+    """
+    session = session if session else requests
+    for attempt in range(max_retries + 1):
+        response = session.post(sparql_endpoint_url, data={'query': query, 'format': 'json'},
+                                headers={'Accept': 'application/sparql-results+json'})
+        if response.status_code in (429, 503) and attempt < max_retries:
+            try:
+                delay = float(response.headers.get('Retry-After', retry_after))
+            except ValueError:
+                # an http date
+                delay = retry_after
+            time.sleep(delay)
+            continue
+        response.raise_for_status()
+        return response.json()
+
+
+def get_entities(mediawiki_api_url, ids, props=None, languages=None, session=None, maxlag=None, **kwargs):
+    """
+    wbgetentities. At most 50 ids per call (500 with apihighlimits)
+    :param maxlag: seconds. the request is refused with a 'maxlag' error if the replication lag is higher
+    :param kwargs: passed to requests (e.g. timeout, hooks)
+    :return: dict. key: entity id, value: entity json
+    """
+    params = {'action': 'wbgetentities', 'ids': "|".join(ids)}
+    if props:
+        params['props'] = props
+    if languages:
+        params['languages'] = languages
+    if maxlag:
+        params['maxlag'] = maxlag
+    return mediawiki_api_call(mediawiki_api_url, params, session=session, **kwargs)['entities']
+
+
+def get_concept_base_uri(mediawiki_api_url, session=None):
+    # prefix of the entity uris of a wikibase, e.g. "http://www.wikidata.org/entity/"
+    params = {'action': 'query', 'meta': 'wikibase'}
+    return mediawiki_api_call(mediawiki_api_url, params, session=session)['query']['wikibase']['conceptbaseuri']
+
+
+def get_entity_data(mediawiki_api_url, entity_id, fmt="nt", flavor="dump", session=None):
+    """
+    Special:EntityData: the wiki's own serialization of an entity, e.g. its RDF
+    :param fmt: "nt", "ttl", "json", ...
+    :param flavor: "dump" (what the wikidata dumps have), "simple" (truthy statements only), or None (the
+        entity plus stubs of what it refers to)
+    :return: the response text
+    """
+    session = session if session else requests
+    params = {'title': "Special:EntityData/{}.{}".format(entity_id, fmt)}
+    if flavor:
+        params['flavor'] = flavor
+    response = session.get(mediawiki_api_url.replace("api.php", "index.php"), params=params)
+    response.raise_for_status()
+    return response.text
+
+
+def search_entities(mediawiki_api_url, search, entity_type="item", language="en", limit=50, session=None):
+    """
+    wbsearchentities. Unlike the query service, this reads from the wiki's database, so newly created
+    entities are found immediately
+    :return: list of entity ids
+    """
+    params = {'action': 'wbsearchentities', 'search': search, 'type': entity_type, 'language': language,
+              'limit': limit}
+    return [x['id'] for x in mediawiki_api_call(mediawiki_api_url, params, session=session)['search']]
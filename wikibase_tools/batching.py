@@ -0,0 +1,90 @@
+"""
+Pick the number of entities per wbgetentities request from how the previous requests went
+
+A fixed 50 IDs per request is too many for chunks of huge items (the response is tens of megabytes and
+the request times out, failing all 50) and more requests than needed for small items, when the account
+may fetch up to 500 at a time (apihighlimits). BatchSizer keeps a size between min_size and max_size:
+
+- after a successful request it moves towards the size that would take target_seconds and return
+  target_bytes, growing by at most a factor of 2 per request
+- after a timeout, server error, or a maxlag / too many values error it halves
+
+Every size used is counted, so the effect can be reported.
+
+Usage:
+
+sizer = BatchSizer(max_size=50)
+batch = ids[:sizer.size]
+... fetch, taking `seconds` and returning `nbytes` ...
+sizer.success(len(batch), seconds, nbytes)  # or sizer.failure(len(batch))
+print(sizer.report())
+
+"""
+import threading
+from collections import Counter
+
+# wbgetentities accepts 50 IDs per request, 500 for accounts with the apihighlimits right (bots)
+MAX_IDS = 50
+MAX_IDS_HIGH = 500
+
+
+class BatchSizer:
+    def __init__(self, size=MAX_IDS, min_size=1, max_size=MAX_IDS, target_seconds=5, target_bytes=8 * 2 ** 20,
+                 metrics=None, name="fetch"):
+        """
+        :param size: size of the first batch
+        :param max_size: the api's limit. MAX_IDS, or MAX_IDS_HIGH for bot accounts
+        :param target_seconds: wanted latency per request
+        :param target_bytes: wanted response size per request
+        :param metrics: a metrics.Metrics to also count the sizes (and splits) in, under `name`
+        """
+        if not 1 <= min_size <= max_size <= MAX_IDS_HIGH:
+            raise ValueError("need 1 <= min_size <= max_size <= {}".format(MAX_IDS_HIGH))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = self._clamp(size)
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.metrics = metrics
+        self.name = name
+        # size -> number of successful requests of that size
+        self.sizes = Counter()
+        self.splits = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def _clamp(self, size):
+        return max(self.min_size, min(self.max_size, int(size)))
+
+    def success(self, n, seconds, nbytes):
+        # a request for n IDs took `seconds` and returned nbytes
+        if self.metrics:
+            self.metrics.observe_batch(self.name, n)
+        with self.lock:
+            self.sizes[n] += 1
+            ratio = min(self.target_seconds / max(seconds, 1e-3), self.target_bytes / max(nbytes, 1))
+            # grow slowly (one fast response says little), shrink at once
+            self.size = self._clamp(min(n * ratio, max(self.size, n) * 2))
+
+    def failure(self, n):
+        # a request for n IDs failed in a way a smaller request might not
+        with self.lock:
+            self.failures += 1
+            self.size = self._clamp(min(self.size, n) // 2)
+
+    def split(self):
+        if self.metrics:
+            self.metrics.incr(self.name + "_split")
+        with self.lock:
+            self.splits += 1
+
+    def report(self):
+        with self.lock:
+            requests = sum(self.sizes.values())
+            ids = sum(k * v for k, v in self.sizes.items())
+            return {'requests': requests,
+                    'mean_size': round(ids / requests, 1) if requests else None,
+                    'current_size': self.size,
+                    'sizes': dict(sorted(self.sizes.items())),
+                    'failures': self.failures,
+                    'splits': self.splits}
@@ -0,0 +1,16 @@
+"""
+Location of the on-disk caches used by wikibase_tools
+
+Defaults to ~/.cache/wikibase_tools. Set the WIKIBASE_TOOLS_CACHE environment variable to use a different directory
+"""
+import os
+
+
+def get_cache_dir():
+    path = os.environ.get("WIKIBASE_TOOLS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "wikibase_tools"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_path(name):
+    return os.path.join(get_cache_dir(), name)
@@ -0,0 +1,208 @@
+"""
+On-disk snapshot of the wikidata property catalog
+
+The two full-catalog SPARQL queries (get_wd_props, get_equiv_props) are slow and often time out, so their
+results are stored in a sqlite database. Once the snapshot is older than `ttl`, only the properties modified
+since the snapshot are fetched again. If wikidata can't be reached, the old snapshot is used.
+
+Usage:
+
+catalog = PropCatalog()
+catalog.get("P351")
+catalog.find_by_equiv("http://purl.org/dc/terms/title")
+
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from wikibase_tools.api import sparql_query
+from wikibase_tools.cache import cache_path
+
+WIKIDATA_SPARQL_URL = "https://query.wikidata.org/sparql"
+WD_ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+
+# bump when the table layout changes. older snapshots are rebuilt
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS props (pid TEXT PRIMARY KEY, pt TEXT, label TEXT, description TEXT, aliases TEXT,
+                                  modified TEXT);
+CREATE TABLE IF NOT EXISTS equivs (pid TEXT, uri TEXT, PRIMARY KEY (pid, uri));
+CREATE INDEX IF NOT EXISTS equivs_uri ON equivs (uri);
+'''
+
+
+class PropCatalog:
+    def __init__(self, path=None, ttl=24 * 3600, sparql_endpoint_url=WIKIDATA_SPARQL_URL, session=None):
+        """
+
+        :param path: sqlite file. default: wd_props.sqlite in the cache dir (one per endpoint)
+        :param ttl: seconds after which the snapshot is refreshed
+        :param sparql_endpoint_url: where the catalog is fetched from
+        :param session: requests session used for refreshing
+        """
+        if not path and sparql_endpoint_url != WIKIDATA_SPARQL_URL:
+            path = cache_path("wd_props_{}.sqlite".format(hashlib.sha1(sparql_endpoint_url.encode()).hexdigest()[:12]))
+        self.path = path if path else cache_path("wd_props.sqlite")
+        self.ttl = ttl
+        self.sparql_endpoint_url = sparql_endpoint_url
+        self.session = session
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn:
+            if self._get_meta('version') not in {None, str(SCHEMA_VERSION)}:
+                self.conn.executescript("DROP TABLE IF EXISTS meta; DROP TABLE IF EXISTS props; "
+                                        "DROP TABLE IF EXISTS equivs;")
+            self.conn.executescript(SCHEMA)
+            self._set_meta('version', SCHEMA_VERSION)
+        self.checked = False
+
+    def get(self, pid):
+        """
+        :return: dict in the format of get_prop_info_from_wikidata, or None if the property doesn't exist
+        {'p': 'property uri', 'pLabel': 'label', 'd': 'description', 'pt': 'property type',
+         'aliases': 'alias1|alias2', 'equivs': list of 'equivalent property uris'}
+        """
+        self.ensure_fresh()
+        with self.lock:
+            row = self.conn.execute("SELECT pid, pt, label, description, aliases FROM props WHERE pid = ?",
+                                    (pid,)).fetchone()
+            if not row:
+                return None
+            equivs = [x[0] for x in self.conn.execute("SELECT uri FROM equivs WHERE pid = ? ORDER BY uri", (pid,))]
+        info = {'p': WD_ENTITY_PREFIX + row[0], 'pt': row[1], 'pLabel': row[2], 'd': row[3] or ""}
+        if row[4]:
+            info['aliases'] = row[4]
+        info['equivs'] = [WD_ENTITY_PREFIX + row[0]] + equivs
+        return info
+
+    def __getitem__(self, pid):
+        info = self.get(pid)
+        if info is None:
+            raise KeyError(pid)
+        return info
+
+    def __contains__(self, pid):
+        return self.get(pid) is not None
+
+    def pids(self):
+        self.ensure_fresh()
+        with self.lock:
+            return [x[0] for x in self.conn.execute("SELECT pid FROM props ORDER BY CAST(SUBSTR(pid, 2) AS INTEGER)")]
+
+    def find_by_equiv(self, uri):
+        # wikidata PIDs with an equivalent property statement to uri
+        if uri.startswith(WD_ENTITY_PREFIX + "P"):
+            pid = uri[len(WD_ENTITY_PREFIX):]
+            return [pid] if pid in self else []
+        self.ensure_fresh()
+        with self.lock:
+            return [x[0] for x in self.conn.execute("SELECT pid FROM equivs WHERE uri = ? ORDER BY pid", (uri,))]
+
+    @property
+    def refreshed(self):
+        # unix time of the last refresh, or None if there is no snapshot
+        value = self._get_meta('refreshed')
+        return float(value) if value else None
+
+    def ensure_fresh(self):
+        # only checked once per instance, so a long run uses a single consistent snapshot
+        if self.checked:
+            return
+        with self.lock:
+            if self.checked:
+                return
+            refreshed = self.refreshed
+            if refreshed is None:
+                self.refresh(full=True)
+            elif time.time() - refreshed > self.ttl:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print("Could not refresh property catalog, using snapshot from {}: {}".format(
+                        datetime.fromtimestamp(refreshed), e))
+            self.checked = True
+
+    def refresh(self, full=False):
+        """
+        Update the snapshot from wikidata
+        :param full: fetch everything. Otherwise only properties modified since the last snapshot are fetched
+        """
+        with self.lock:
+            since = None if full else self._get_meta('modified')
+            started = time.time()
+            props = get_wd_props(since=since, endpoint=self.sparql_endpoint_url, session=self.session)
+            equiv = get_equiv_props(since=since, endpoint=self.sparql_endpoint_url, session=self.session)
+            with self.conn:
+                if since is None:
+                    self.conn.execute("DELETE FROM props")
+                    self.conn.execute("DELETE FROM equivs")
+                for p, v in props.items():
+                    pid = p.rsplit("/", 1)[-1]
+                    self.conn.execute("INSERT OR REPLACE INTO props VALUES (?, ?, ?, ?, ?, ?)",
+                                      (pid, v['pt'], v.get('pLabel'), v.get('d'), v.get('aliases'),
+                                       v.get('modified')))
+                    self.conn.execute("DELETE FROM equivs WHERE pid = ?", (pid,))
+                    uris = equiv[p]['equivs'].split("|") if p in equiv else []
+                    self.conn.executemany("INSERT OR IGNORE INTO equivs VALUES (?, ?)", [(pid, uri) for uri in uris])
+                modified = self.conn.execute("SELECT MAX(modified) FROM props").fetchone()[0]
+                self._set_meta('modified', modified)
+                self._set_meta('refreshed', started)
+            self.checked = True
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone() if self._has_meta() else None
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, None if value is None else str(value)))
+
+    def _has_meta(self):
+        return self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='meta'").fetchone()
+
+
+def _since_filter(since):
+    if not since:
+        return ""
+    return '?p schema:dateModified ?modified FILTER (?modified > "{}"^^xsd:dateTime)'.format(since)
+
+
+def get_wd_props(since=None, endpoint=WIKIDATA_SPARQL_URL, session=None):
+    # Get all props, inclusing labels, descriptions, aliases, from wikidata
+    # since: only props modified after this xsd:dateTime
+    query = '''SELECT ?p ?pt ?pLabel ?d ?aliases ?modified WHERE {{
+      {{
+        SELECT ?p ?pt ?d ?modified (GROUP_CONCAT(DISTINCT ?alias; separator="|") as ?aliases) WHERE {{
+          ?p wikibase:propertyType ?pt .
+          ?p schema:dateModified ?modified .
+          {}
+          OPTIONAL {{?p skos:altLabel ?alias FILTER (LANG (?alias) = "en")}}
+          OPTIONAL {{?p schema:description ?d FILTER (LANG (?d) = "en") .}}
+        }} GROUP BY ?p ?pt ?d ?modified
+      }}
+      SERVICE wikibase:label {{ bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }}
+    }}'''.format('FILTER (?modified > "{}"^^xsd:dateTime)'.format(since) if since else "")
+    results = sparql_query(endpoint, query, session=session)
+    results = results['results']['bindings']
+    d = [{k: v['value'] for k, v in item.items()} for item in results]
+    d = {x['p']: x for x in d}
+    return d
+
+
+def get_equiv_props(since=None, endpoint=WIKIDATA_SPARQL_URL, session=None):
+    # get the equivalent properties from wikidata for all properties
+    # since: only props modified after this xsd:dateTime
+    query = '''SELECT ?p (GROUP_CONCAT(DISTINCT ?equiv; separator="|") as ?equivs) WHERE {{
+      ?p wikibase:propertyType ?pt .
+      {}
+      ?p wdt:P1628 ?equiv
+    }} GROUP BY ?p'''.format(_since_filter(since))
+    results = sparql_query(endpoint, query, session=session)
+    results = results['results']['bindings']
+    d = [{k: v['value'] for k, v in item.items()} for item in results]
+    d = {x['p']: x for x in d}
+    return d
@@ -0,0 +1,203 @@
+"""
+The wikibase-tools command
+
+wikibase-tools setup
+wikibase-tools props [--sharded]
+wikibase-tools entities P31,Q5,... [--depth 1] [--sharded]
+wikibase-tools sparql "SELECT ?item WHERE { ?item wdt:P31 wd:Q7187 }" [--page-size 10000]
+wikibase-tools sync [Q42,...]
+wikibase-tools replay
+wikibase-tools export-rdf DIRECTORY [--format ttl] [--verify 200]
+wikibase-tools plan P31,Q5,... [--depth 1] [--output plan.jsonl]
+wikibase-tools plan --sparql "SELECT ?item WHERE { ?item wdt:P31 wd:Q7187 }"
+wikibase-tools apply plan.jsonl
+
+Defaults come from config.py. Until a command runs, only argparse and config are imported and nothing
+touches the network, so small invocations (e.g. from cron) start quickly.
+Exits with status 1 if anything failed.
+
+"""
+import argparse
+import sys
+
+from wikibase_tools.config import HOST, WIKIBASE_PORT, WDQS_FRONTEND_PORT, USER, PASS, TO_CREATE
+
+
+def split_ids(values):
+    # "P31,Q5" "Q42" -> ["P31", "Q5", "Q42"]
+    return [x.strip() for x in ",".join(values).split(",") if x.strip()]
+
+
+def get_statement_props(args):
+    # "*": all properties
+    if not args.statements:
+        return None
+    return args.statements if args.statements == "*" else split_ids([args.statements])
+
+
+def get_maker(args):
+    from wikibase_tools.make_entities import EntityMaker
+    return EntityMaker(args.api_url, args.sparql_url, args.user, args.password, concurrency=args.concurrency,
+                       edits_per_minute=args.edits_per_minute, fast_create=args.fast_create or bool(args.statements),
+                       fetch_batch_size=args.fetch_batch_size, dead_letters=args.dead_letters or True,
+                       statement_props=get_statement_props(args))
+
+
+def run_sharded(args, entities):
+    from wikibase_tools.shard import make_entities_sharded, get_accounts
+    report = make_entities_sharded(args.api_url, args.sparql_url, get_accounts(), entities, report_path=args.report,
+                                   concurrency=args.concurrency, edits_per_minute=args.edits_per_minute,
+                                   fast_create=args.fast_create or bool(args.statements),
+                                   fetch_batch_size=args.fetch_batch_size, dead_letters=args.dead_letters or True,
+                                   statement_props=get_statement_props(args))
+    return len(report['failed'])
+
+
+def setup(args):
+    from wikibase_tools import initial_setup
+    initial_setup.configure(args.api_url, args.sparql_url)
+    initial_setup.run_setup(initial_setup.get_login(args.user, args.password))
+    return 0
+
+
+def props(args):
+    if args.sharded:
+        return run_sharded(args, None)
+    _, failures = get_maker(args).create_all_props()
+    return len(failures)
+
+
+def entities(args):
+    ids = split_ids(args.ids) if args.ids else split_ids([TO_CREATE])
+    if args.sharded:
+        return run_sharded(args, ids)
+    maker = get_maker(args)
+    if args.depth:
+        _, failures = maker.make_entities_closure(ids, depth=args.depth)
+    else:
+        _, failures = maker.make_entities(ids)
+    return len(failures)
+
+
+def sparql(args):
+    _, failures = get_maker(args).make_entities_from_sparql(args.query, page_size=args.page_size)
+    return len(failures)
+
+
+def sync(args):
+    _, failures = get_maker(args).sync(split_ids(args.ids) if args.ids else None)
+    return len(failures)
+
+
+def replay(args):
+    _, failures = get_maker(args).replay()
+    return len(failures)
+
+
+def export(args):
+    maker = get_maker(args)
+    _, mismatched = maker.export_rdf(args.directory, ids=split_ids(args.ids) if args.ids else None,
+                                     fmt=args.format, max_bytes=args.max_mb * 2 ** 20,
+                                     compress=not args.no_compress, verify=args.verify)
+    return len(mismatched)
+
+
+def plan(args):
+    maker = get_maker(args)
+    if args.sparql:
+        maker.plan_from_sparql(args.sparql, path=args.output, page_size=args.page_size, max_age=args.max_age)
+    else:
+        ids = split_ids(args.ids) if args.ids else split_ids([TO_CREATE])
+        maker.plan(ids, path=args.output, depth=args.depth, max_age=args.max_age)
+    return 0
+
+
+def apply(args):
+    _, failures = get_maker(args).apply(args.plan)
+    return len(failures)
+
+
+def get_parser():
+    from wikibase_tools.metrics import add_arguments as add_metrics_arguments
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--api-url", default="http://{}:{}/w/api.php".format(HOST, WIKIBASE_PORT),
+                        help="mediawiki api of the local wikibase")
+    common.add_argument("--sparql-url", default="http://{}:{}/proxy/wdqs/bigdata/namespace/wdq/sparql".format(
+        HOST, WDQS_FRONTEND_PORT), help="query service of the local wikibase")
+    common.add_argument("--user", default=USER)
+    common.add_argument("--password", default=PASS)
+    common.add_argument("--concurrency", type=int, default=1, help="entities written in parallel")
+    common.add_argument("--edits-per-minute", type=float, help="maximum write rate")
+    common.add_argument("--fast-create", action="store_true", help="one wbeditentity request per entity")
+    common.add_argument("--fetch-batch-size", type=int, default=50,
+                        help="most IDs per request to wikidata (up to 500 for accounts with apihighlimits)")
+    common.add_argument("--dead-letters", metavar="FILE",
+                        help="where entities that failed are recorded, and replay reads them from. "
+                             "default: a file per wikibase in the cache directory")
+    common.add_argument("--statements", metavar="PIDS",
+                        help="also mirror the statements of these comma separated wikidata properties ('*': all). "
+                             "implies --fast-create")
+    add_metrics_arguments(common)
+
+    sharding = argparse.ArgumentParser(add_help=False)
+    sharding.add_argument("--sharded", action="store_true",
+                          help="one process per bot account (config.USER and config.BOTS)")
+    sharding.add_argument("--report", help="with --sharded: write the merged report to this json file")
+
+    parser = argparse.ArgumentParser(prog="wikibase-tools", description="Mirror wikidata entities into a wikibase")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    p = commands.add_parser("setup", parents=[common], help="create the equivalent property / class properties")
+    p.set_defaults(func=setup)
+    p = commands.add_parser("props", parents=[common, sharding], help="mirror all wikidata properties")
+    p.set_defaults(func=props)
+    p = commands.add_parser("entities", parents=[common, sharding], help="mirror QIDs and/or PIDs")
+    p.add_argument("ids", nargs="*", help="comma separated QIDs / PIDs. default: config.TO_CREATE")
+    p.add_argument("--depth", type=int, default=0, help="also mirror what they refer to, this many levels deep")
+    p.set_defaults(func=entities)
+    p = commands.add_parser("sparql", parents=[common], help="mirror the items a wikidata query returns")
+    p.add_argument("query")
+    p.add_argument("--page-size", type=int, help="stream the query in pages of this many rows")
+    p.set_defaults(func=sparql)
+    p = commands.add_parser("sync", parents=[common], help="update mirrored entities that changed on wikidata")
+    p.add_argument("ids", nargs="*", help="comma separated QIDs / PIDs. default: everything mirrored")
+    p.set_defaults(func=sync)
+    p = commands.add_parser("replay", parents=[common], help="retry only the entities that failed in earlier runs")
+    p.set_defaults(func=replay)
+    p = commands.add_parser("export-rdf", parents=[common],
+                            help="write mirrored entities as RDF files for a bulk load of the query service")
+    p.add_argument("directory")
+    p.add_argument("ids", nargs="*", help="comma separated local QIDs / PIDs. default: everything in the journal")
+    p.add_argument("--format", choices=["ttl", "nt"], default="ttl")
+    p.add_argument("--max-mb", type=int, default=256, help="most megabytes (uncompressed) per file")
+    p.add_argument("--no-compress", action="store_true", help="don't gzip the files")
+    p.add_argument("--verify", type=int, default=200, metavar="N",
+                   help="check N random triples against the wikibase's own RDF afterwards. 0: don't")
+    p.set_defaults(func=export)
+    p = commands.add_parser("plan", parents=[common],
+                            help="write what mirroring would create / update / skip to a plan file, without writing")
+    p.add_argument("ids", nargs="*", help="comma separated QIDs / PIDs. default: config.TO_CREATE")
+    p.add_argument("--depth", type=int, default=0, help="also plan what they refer to, this many levels deep")
+    p.add_argument("--sparql", metavar="QUERY", help="plan the items a wikidata query returns instead")
+    p.add_argument("--page-size", type=int, help="with --sparql: stream the query in pages of this many rows")
+    p.add_argument("--output", help="plan file. default: a file in the cache directory for this input")
+    p.add_argument("--max-age", type=float, metavar="SECONDS", help="reuse the plan file if it is younger than this")
+    p.set_defaults(func=plan)
+    p = commands.add_parser("apply", parents=[common], help="do the writes of a plan file")
+    p.add_argument("plan")
+    p.set_defaults(func=apply)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    from wikibase_tools.metrics import default_metrics, record
+    with record(default_metrics, args.metrics, args.profile):
+        failed = args.func(args)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
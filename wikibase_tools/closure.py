@@ -0,0 +1,70 @@
+"""
+Find the properties and items that a set of wikidata entities refer to
+
+Starting from seed QIDs/PIDs, each level of the traversal is fetched with batched wbgetentities calls
+(50 IDs per request, claims only). The properties used in statements, qualifiers and references, and
+the wikibase-item / wikibase-property values, make up the next level.
+
+Usage:
+
+levels = get_closure(["Q7187"], depth=1)
+# [{'Q7187'}, {'P31', 'P279', 'Q20747295', ...}]
+order = dependency_order(levels)
+
+"""
+from more_itertools import chunked
+
+from wikibase_tools.api import get_entities, WIKIDATA_API_URL
+
+
+def get_references(entity):
+    # IDs of the properties and entity values used in an entity's claims
+    refs = set()
+
+    def add_snak(snak):
+        refs.add(snak['property'])
+        if snak.get('snaktype') == 'value' and snak.get('datatype') in {'wikibase-item', 'wikibase-property'}:
+            refs.add(snak['datavalue']['value']['id'])
+
+    for prop, claims in entity.get('claims', dict()).items():
+        for claim in claims:
+            add_snak(claim['mainsnak'])
+            for snaks in claim.get('qualifiers', dict()).values():
+                for snak in snaks:
+                    add_snak(snak)
+            for reference in claim.get('references', []):
+                for snaks in reference['snaks'].values():
+                    for snak in snaks:
+                        add_snak(snak)
+    return refs
+
+
+def get_closure(seeds, depth=1, properties_only=False, mediawiki_api_url=WIKIDATA_API_URL, session=None):
+    """
+    :param seeds: QIDs / PIDs to start from
+    :param depth: number of levels to follow. 0: just the seeds
+    :param properties_only: only follow properties (not item values)
+    :return: list of sets of IDs, one per level. each ID appears only in the first level it's found in
+    """
+    levels = [set(seeds)]
+    seen = set(seeds)
+    for _ in range(depth):
+        frontier = set()
+        for chunk in chunked(sorted(levels[-1]), 50):
+            entities = get_entities(mediawiki_api_url, chunk, props="claims", session=session)
+            for entity in entities.values():
+                frontier.update(get_references(entity))
+        # no lexemes, forms, ...
+        frontier = {x for x in frontier if x[0] in ("P" if properties_only else "PQ")}
+        frontier -= seen
+        if not frontier:
+            break
+        seen.update(frontier)
+        levels.append(frontier)
+    return levels
+
+
+def dependency_order(levels):
+    # properties first, then items. within each, the most deeply referenced first
+    ids = [x for level in reversed(levels) for x in sorted(level, key=lambda x: (x[0], int(x[1:])))]
+    return [x for x in ids if x.startswith("P")] + [x for x in ids if not x.startswith("P")]
@@ -3,6 +3,8 @@
 HOST="localhost"
 USER="testbot"
 PASS="password"
+# extra bot accounts for sharded writes (see shard.py), as "user:password,user:password"
+BOTS=""
 WIKIBASE_PORT=7171
 WDQS_FRONTEND_PORT=7272
 PROXY_PORT=8989
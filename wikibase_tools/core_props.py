@@ -0,0 +1,155 @@
+"""
+Registry of the core properties of a wikibase: "equivalent property" and "equivalent class"
+
+The PIDs are looked up once per wikibase and stored on disk, keyed by mediawiki_api_url, so that
+creating entities doesn't cost a SPARQL query each time.
+
+Usage:
+
+registry = CorePropRegistry(mediawiki_api_url, sparql_endpoint_url)
+registry.equiv_prop_pid
+registry.equiv_class_pid
+registry.invalidate()  # e.g. after recreating the wikibase
+registry.check()  # forget the PIDs that are wrong
+
+"""
+import json
+import os
+import threading
+
+from wikibase_tools.api import get_entities, search_entities, sparql_query
+from wikibase_tools.cache import cache_path
+
+EQUIV_PROP_URI = "http://www.w3.org/2002/07/owl#equivalentProperty"
+EQUIV_CLASS_URI = "http://www.w3.org/2002/07/owl#equivalentClass"
+
+# name -> (label used in initial_setup, equiv uri)
+CORE_PROP_LABELS = {
+    'equiv_prop': ("equivalent property", EQUIV_PROP_URI),
+    'equiv_class': ("equivalent class", EQUIV_CLASS_URI),
+}
+
+_file_lock = threading.Lock()
+
+
+class CorePropRegistry:
+    def __init__(self, mediawiki_api_url, sparql_endpoint_url, path=None, session=None):
+        """
+
+        :param mediawiki_api_url:
+        :param sparql_endpoint_url:
+        :param path: json file the PIDs are stored in. Shared between wikibases
+        :param session: requests session used for lookups
+        """
+        self.mediawiki_api_url = mediawiki_api_url
+        self.sparql_endpoint_url = sparql_endpoint_url
+        self.path = path if path else cache_path("core_props.json")
+        self.session = session
+        self.lock = threading.RLock()
+        self.pids = self._load().get(mediawiki_api_url, dict())
+
+    @property
+    def equiv_prop_pid(self):
+        return self.get('equiv_prop')
+
+    @property
+    def equiv_class_pid(self):
+        return self.get('equiv_class')
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.pids:
+                pid = self._resolve_sparql(name) or self._resolve_api(name)
+                if not pid:
+                    raise ValueError("Could not find the '{}' property in {}".format(CORE_PROP_LABELS[name][0],
+                                                                                    self.mediawiki_api_url))
+                self.set(name, pid)
+            return self.pids[name]
+
+    def set(self, name, pid):
+        # record a PID we already know (e.g. because we just created the property)
+        with self.lock:
+            self.pids[name] = pid
+            self._save()
+
+    def invalidate(self, name=None):
+        # forget one (or all) of the PIDs for this wikibase, so they get looked up again
+        with self.lock:
+            if name:
+                self.pids.pop(name, None)
+            else:
+                self.pids.clear()
+            self._save()
+
+    def check(self):
+        """
+        Forget the stored PIDs that aren't the core properties of the wikibase (any more), e.g. because it was
+        recreated at the same url
+        :return: list of the names that were forgotten
+        """
+        with self.lock:
+            if not self.pids:
+                return []
+            entities = get_entities(self.mediawiki_api_url, sorted(set(self.pids.values())), props="claims",
+                                    session=self.session)
+            wrong = []
+            for name, pid in sorted(self.pids.items()):
+                claims = entities.get(pid, dict()).get('claims', dict())
+                prop_nr = pid if name == 'equiv_prop' else self.pids.get('equiv_prop')
+                if not any(x['mainsnak'].get('datavalue', dict()).get('value') == CORE_PROP_LABELS[name][1]
+                           for x in claims.get(prop_nr, [])):
+                    wrong.append(name)
+            for name in wrong:
+                self.pids.pop(name)
+            if wrong:
+                self._save()
+            return wrong
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return dict()
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _save(self):
+        with _file_lock:
+            d = self._load()
+            d[self.mediawiki_api_url] = dict(self.pids)
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(d, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def _resolve_sparql(self, name):
+        if name == 'equiv_prop':
+            # get the equivalent property property without knowing the PID for equivalent property!!!
+            query = '''SELECT * WHERE {
+              ?item ?prop <http://www.w3.org/2002/07/owl#equivalentProperty> .
+              ?item <http://wikiba.se/ontology#directClaim> ?prop .
+            }'''
+        else:
+            query = '''SELECT * WHERE {{
+              ?prop wdt:{} <http://www.w3.org/2002/07/owl#equivalentClass> .
+            }}'''.format(self.equiv_prop_pid)
+        results = sparql_query(self.sparql_endpoint_url, query, session=self.session)
+        bindings = results['results']['bindings']
+        if not bindings:
+            # the query service hasn't seen it (yet)
+            return None
+        return bindings[0]['prop']['value'].split("/")[-1]
+
+    def _resolve_api(self, name):
+        # look for a property with the expected label whose equiv prop statement points to the expected uri
+        label, uri = CORE_PROP_LABELS[name]
+        pids = search_entities(self.mediawiki_api_url, label, entity_type="property", session=self.session)
+        if not pids:
+            return None
+        entities = get_entities(self.mediawiki_api_url, pids, props="claims", session=self.session)
+        for pid in pids:
+            claims = entities.get(pid, dict()).get('claims', dict())
+            # equivalent property has the equiv prop statement on itself
+            prop_nr = pid if name == 'equiv_prop' else self.equiv_prop_pid
+            for claim in claims.get(prop_nr, []):
+                if claim['mainsnak'].get('datavalue', dict()).get('value') == uri:
+                    return pid
+        return None
@@ -0,0 +1,90 @@
+"""
+Entities that could not be mirrored, kept in a JSON lines file so they can be retried later
+
+Each failed write (after the retries of write_engine) appends one line:
+
+{"id": "Q42", "operation": "create_item_from_record", "error_class": "MWApiError", "error_code": "failed-save",
+ "kind": "transient", "message": "...", "payload": {...}, "time": 1546300800.0}
+
+operation is the EntityMaker method that failed, and payload what it was called with (when that can be
+stored as json), so a replay can re-submit it without fetching the entity from wikidata again. A failed
+run therefore doesn't need to be rerun as a whole: EntityMaker.replay (or `wikibase-tools replay`) takes
+just the entities in the file.
+
+Usage:
+
+dead_letters = DeadLetters.for_wikibase("http://localhost:7171/w/api.php")
+dead_letters.add("Q42", e, operation="create_item_from_record", payload={...})
+letters = dead_letters.take()  # and start a new file
+
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from wikibase_tools.cache import cache_path
+from wikibase_tools.write_engine import classify, get_error_code
+
+
+class DeadLetters:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_wikibase(cls, mediawiki_api_url, path=None):
+        # one file per target wikibase, next to its journal
+        if not path:
+            name = hashlib.sha1(mediawiki_api_url.encode()).hexdigest()[:12]
+            path = cache_path("deadletter_{}.jsonl".format(name))
+        return cls(path)
+
+    def add(self, entity_id, error, operation=None, payload=None):
+        letter = {'id': entity_id,
+                  'operation': operation,
+                  'error_class': type(error).__name__,
+                  'error_code': get_error_code(error),
+                  'kind': classify(error),
+                  'message': str(error),
+                  'payload': payload,
+                  'time': time.time()}
+        line = json.dumps(letter, default=str) + "\n"
+        # one write per line, in append mode: lines of several threads or processes don't interleave
+        with self.lock, open(self.path, 'a') as f:
+            f.write(line)
+
+    def read(self):
+        """
+        :return: list of dead letters (dicts), the last one for each ID, in the order they were written
+        """
+        if not os.path.exists(self.path):
+            return []
+        letters = dict()
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    letter = json.loads(line)
+                    letters.pop(letter['id'], None)
+                    letters[letter['id']] = letter
+        return list(letters.values())
+
+    def take(self):
+        """
+        Read the dead letters and move the file aside (to <path>.<unix time>), so entities that fail again
+        end up in a new file
+        """
+        with self.lock:
+            letters = self.read()
+            self._set_aside()
+        return letters
+
+    def set_aside(self):
+        # start a new file, keeping the old one (e.g. of a wikibase that was recreated) as <path>.<unix time>
+        with self.lock:
+            self._set_aside()
+
+    def _set_aside(self):
+        if os.path.exists(self.path):
+            os.replace(self.path, "{}.{}".format(self.path, int(time.time())))
@@ -0,0 +1,159 @@
+"""
+Stream entities from a wikidata JSON dump (latest-all.json.gz or latest-all.json.bz2)
+
+The dump has one entity per line, so it is read line by line and never held in memory. Lines are
+pre-filtered on their ID before being parsed, and parsing is spread over a pool of worker processes.
+If pigz / lbzip2 are installed, decompression runs in its own process too. Its exit status and error
+output are checked once the dump is read to the end, so a truncated download raises an OSError instead of
+ending the stream early.
+
+Usage:
+
+for info in iter_dump("latest-all.json.gz", ids={"Q42", "P31"}):
+    print(info['id'], info['label'])
+
+for info in iter_dump("latest-all.json.gz", predicate=has_equiv_class, processes=8):
+    ...
+
+"""
+import bz2
+import gzip
+import io
+import json
+import re
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from multiprocessing import Pool
+
+from more_itertools import chunked
+
+ID_RE = re.compile(r'"id":"([PQL]\d+)"')
+
+# external (multi-threaded) decompressors, used if installed
+DECOMPRESSORS = {'.gz': ['pigz', 'gzip'], '.bz2': ['lbzip2', 'pbzip2']}
+
+
+class ProcessOutput(io.TextIOWrapper):
+    # the text output of a decompressor process. Reading it to the end waits for the process, and raises if it
+    # failed, so a truncated or corrupt dump isn't taken for a complete one
+    def __init__(self, args):
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=self.stderr, bufsize=1 << 20)
+        super().__init__(self.process.stdout, encoding="utf-8")
+
+    def __next__(self):
+        try:
+            return super().__next__()
+        except StopIteration:
+            self.check()
+            raise
+
+    def check(self):
+        returncode = self.process.wait()
+        self.stderr.seek(0)
+        stderr = self.stderr.read().decode(errors="replace").strip()
+        if returncode or stderr:
+            raise OSError("{} failed (exit status {}): {}".format(" ".join(self.process.args), returncode, stderr))
+
+    def close(self):
+        if self.process.poll() is None:
+            # stopped reading before the end
+            self.process.kill()
+        super().close()
+        self.process.wait()
+        self.stderr.close()
+
+
+def open_dump(path):
+    # a text stream of the decompressed dump
+    for ext, commands in DECOMPRESSORS.items():
+        if not path.endswith(ext):
+            continue
+        for command in commands:
+            if shutil.which(command):
+                return ProcessOutput([command, "-dc", path])
+        return gzip.open(path, "rt", encoding="utf-8") if ext == '.gz' else bz2.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def iter_dump_lines(path, ids=None):
+    """
+    Yield the json line of each entity in the dump
+    :param ids: only lines for these IDs (checked without parsing the json)
+    """
+    with open_dump(path) as f:
+        for line in f:
+            line = line.strip()
+            if line in {"[", "]", ""}:
+                continue
+            if ids is not None:
+                m = ID_RE.search(line)
+                if not m or m.group(1) not in ids:
+                    continue
+            yield line.rstrip(",")
+
+
+def get_entity_info(entity):
+    # given an entity's json, get the same fields as get_item_info, plus the id, type and (for properties)
+    # datatype and equivalent property uris
+    def claim_values(prop):
+        return [x['mainsnak']['datavalue']['value'] for x in entity.get('claims', dict()).get(prop, [])
+                if x['mainsnak'].get('snaktype') == 'value']
+
+    info = {'id': entity['id'],
+            'type': entity['type'],
+            'label': entity.get('labels', dict()).get('en', dict()).get('value', ""),
+            'description': entity.get('descriptions', dict()).get('en', dict()).get('value', ""),
+            'aliases': [x['value'] for x in entity.get('aliases', dict()).get('en', [])],
+            'equiv_classes': claim_values('P1709'),
+            'lastrevid': entity.get('lastrevid'),
+            'modified': entity.get('modified')}
+    if entity['type'] == 'property':
+        info['datatype'] = entity['datatype']
+        info['equivs'] = ["http://www.wikidata.org/entity/" + entity['id']] + claim_values('P1628')
+    return info
+
+
+def has_equiv_class(entity):
+    # example predicate: entities with an "equivalent class" (P1709) statement
+    return 'P1709' in entity.get('claims', dict())
+
+
+def parse_lines(lines, predicate=None):
+    # runs in the worker processes
+    infos = []
+    for line in lines:
+        entity = json.loads(line)
+        if predicate is None or predicate(entity):
+            infos.append(get_entity_info(entity))
+    return infos
+
+
+def iter_dump(path, ids=None, predicate=None, processes=1, batch_size=1000):
+    """
+    Yield get_entity_info dicts for entities in the dump
+    :param path: path to the dump
+    :param ids: set of QIDs/PIDs to keep. None: all
+    :param predicate: function of the entity json. only entities for which it returns True are kept.
+        Must be picklable (i.e. a module level function) when processes > 1
+    :param processes: number of processes parsing json
+    :param batch_size: lines sent to a worker at a time
+    """
+    ids = set(ids) if ids is not None else None
+    batches = chunked(iter_dump_lines(path, ids), batch_size)
+    if processes <= 1:
+        for batch in batches:
+            yield from parse_lines(batch, predicate)
+        return
+
+    with Pool(processes) as pool:
+        # bounded number of batches in flight, so memory stays constant
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(parse_lines, (batch, predicate)))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
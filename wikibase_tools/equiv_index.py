@@ -0,0 +1,92 @@
+"""
+In-memory index of equivalent property / equivalent class URIs -> local entity ID
+
+Loaded with one paged SPARQL query over all equivalent property and equivalent class statements in the
+local wikibase, then kept up to date by EntityMaker as it writes. Every mirrored entity has an equiv
+statement pointing back to its wikidata URI, so this also tells whether a wikidata ID was already mirrored.
+
+Usage:
+
+index = EquivIndex(sparql_endpoint_url, core_props)
+index.get("http://www.wikidata.org/entity/P31")  # local PID or None
+
+"""
+import threading
+
+from wikibase_tools.api import sparql_query
+
+WD_ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+
+
+class EquivIndex:
+    def __init__(self, sparql_endpoint_url, core_props, page_size=10000, session=None):
+        """
+
+        :param sparql_endpoint_url: local query service
+        :param core_props: CorePropRegistry of the local wikibase
+        :param page_size: rows per SPARQL request when loading
+        :param session: requests session used for the queries
+        """
+        self.sparql_endpoint_url = sparql_endpoint_url
+        self.core_props = core_props
+        self.page_size = page_size
+        self.session = session
+        self.uri_to_id = None
+        self.lock = threading.RLock()
+
+    def load(self):
+        # (re)load the index from the query service
+        query = '''SELECT ?entity ?uri WHERE {{
+          {{ ?entity wdt:{} ?uri }} UNION {{ ?entity wdt:{} ?uri }}
+        }} ORDER BY ?entity ?uri LIMIT {} OFFSET {}'''
+        uri_to_id = dict()
+        offset = 0
+        while True:
+            q = query.format(self.core_props.equiv_prop_pid, self.core_props.equiv_class_pid, self.page_size, offset)
+            results = sparql_query(self.sparql_endpoint_url, q, session=self.session)
+            bindings = results['results']['bindings']
+            for x in bindings:
+                uri_to_id.setdefault(x['uri']['value'], x['entity']['value'].rsplit("/", 1)[-1])
+            if len(bindings) < self.page_size:
+                break
+            offset += self.page_size
+        with self.lock:
+            # keep anything added while we were loading (the query service may not have it yet)
+            if self.uri_to_id:
+                uri_to_id.update(self.uri_to_id)
+            self.uri_to_id = uri_to_id
+
+    def _ensure_loaded(self):
+        if self.uri_to_id is None:
+            with self.lock:
+                if self.uri_to_id is None:
+                    self.load()
+
+    def get(self, uri):
+        self._ensure_loaded()
+        return self.uri_to_id.get(uri)
+
+    def __contains__(self, uri):
+        return self.get(uri) is not None
+
+    def find(self, uris):
+        # local ID of the first of uris that is known, or None
+        self._ensure_loaded()
+        for uri in uris:
+            if uri in self.uri_to_id:
+                return self.uri_to_id[uri]
+        return None
+
+    def get_wikidata(self, wd_id):
+        # local ID of a wikidata entity
+        return self.get(WD_ENTITY_PREFIX + wd_id)
+
+    def add(self, uris, local_id):
+        self._ensure_loaded()
+        with self.lock:
+            for uri in uris:
+                self.uri_to_id.setdefault(uri, local_id)
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.uri_to_id)
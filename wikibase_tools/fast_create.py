@@ -0,0 +1,59 @@
+"""
+Create entities with a single wbeditentity call
+
+WDItemEngine looks for existing items before every write, and builds the full entity to diff against,
+so creating one entity through it takes several api calls. Here the wbeditentity json (labels,
+descriptions, equivalent property / class statements, property datatype) is built directly and sent
+with new=item / new=property: one request per entity. Checking whether an entity already exists is
+left to the caller (EntityMaker uses its journal and EquivIndex).
+
+Usage:
+
+data = build_entity("human", "common name of Homo sapiens",
+                    [url_statement(equiv_class_pid, "http://www.wikidata.org/entity/Q5")])
+entity = create_entity(mediawiki_api_url, login, data, "item")
+entity.wd_item_id  # 'Q123'
+
+"""
+from collections import namedtuple
+
+from wikibase_tools.api import edit_entity
+
+# what's left of a created entity. same attribute names as WDItemEngine, so callers can use either
+CreatedEntity = namedtuple("CreatedEntity", ["wd_item_id", "lastrevid"])
+
+# seconds of replication lag above which the wikibase refuses our edits (they are then retried later)
+MAXLAG = 5
+
+
+def url_statement(pid, uri):
+    # statement json of a url-valued claim
+    return {'mainsnak': {'snaktype': 'value', 'property': pid, 'datatype': 'url',
+                         'datavalue': {'value': uri, 'type': 'string'}},
+            'type': 'statement', 'rank': 'normal'}
+
+
+def build_entity(label, description, statements, property_datatype=None, language="en"):
+    """
+    wbeditentity json of a new entity
+    :param statements: list of statement json, e.g. from url_statement
+    :param property_datatype: datatype of a new property (e.g. 'external-id'). None for items
+    """
+    data = {'claims': statements}
+    if label:
+        data['labels'] = {language: {'language': language, 'value': label}}
+    if description:
+        data['descriptions'] = {language: {'language': language, 'value': description}}
+    if property_datatype:
+        data['datatype'] = property_datatype
+    return data
+
+
+def create_entity(mediawiki_api_url, login, data, entity_type="item", maxlag=MAXLAG):
+    """
+    :param data: from build_entity
+    :param entity_type: "item" or "property"
+    :return: CreatedEntity
+    """
+    entity = edit_entity(mediawiki_api_url, data, login, new=entity_type, maxlag=maxlag)
+    return CreatedEntity(entity['id'], entity.get('lastrevid'))
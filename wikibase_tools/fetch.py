@@ -0,0 +1,148 @@
+"""
+Fetch just the parts of wikidata items that get mirrored
+
+WDItemEngine instances hold every statement, reference and sitelink of an item, and large items (genes,
+chemicals) make a chunk of 50 of them many megabytes. Here wbgetentities is asked only for the info,
+labels, descriptions, aliases and claims in one language (no sitelinks), only the P1709 (equivalent class)
+claims are parsed, and each item is kept as a small EntityRecord. The api has no way to ask for the
+claims of a single property, so the other claims are still downloaded, but they are dropped as soon as
+the response is parsed. Only if statements are mirrored (statement_props, see statements.py) are the
+main snaks of those properties kept too.
+
+Usage:
+
+records = fetch_records(WIKIDATA_API_URL, ["Q42", "Q5"])
+records[0].label, records[0].equiv_classes
+
+fetch_records_adaptive takes any number of IDs and sizes the requests with a batching.BatchSizer. A request
+that times out or fails on the server is split in halves and retried, so one huge item fails alone instead
+of taking its whole batch down with it. While wikidata is lagged (maxlag), requests wait and are retried
+smaller too:
+
+sizer = BatchSizer()
+records = fetch_records_adaptive(WIKIDATA_API_URL, qids, sizer)
+sizer.report()
+
+"""
+import time
+
+import requests
+
+from wikibase_tools.api import MWApiError, get_entities
+from wikibase_tools.statements import select_statements
+
+EQUIV_CLASS_PID = "P1709"
+PROPS = "info|labels|descriptions|aliases|claims"
+# failures a smaller request may not run into
+SPLIT_STATUS = {413, 414, 500, 502, 503, 504}
+SPLIT_CODES = {'toomanyvalues', 'internal_api_error_DBQueryError', 'internal_api_error_MWException'}
+
+
+class EntityRecord:
+    __slots__ = ('id', 'type', 'label', 'description', 'aliases', 'equiv_classes', 'lastrevid', 'modified',
+                 'statements')
+
+    def __init__(self, id, type, label, description, aliases, equiv_classes, lastrevid=None, modified=None,
+                 statements=None):
+        self.id = id
+        self.type = type
+        self.label = label
+        self.description = description
+        self.aliases = aliases
+        self.equiv_classes = equiv_classes
+        self.lastrevid = lastrevid
+        self.modified = modified
+        # statements.select_statements, if statements are mirrored
+        self.statements = statements
+
+    @classmethod
+    def from_json(cls, entity, language="en", statement_props=None):
+        equiv_classes = [x['mainsnak']['datavalue']['value']
+                         for x in entity.get('claims', dict()).get(EQUIV_CLASS_PID, [])
+                         if x['mainsnak'].get('snaktype') == 'value']
+        return cls(entity['id'], entity.get('type'),
+                   entity.get('labels', dict()).get(language, dict()).get('value', ""),
+                   entity.get('descriptions', dict()).get(language, dict()).get('value', ""),
+                   [x['value'] for x in entity.get('aliases', dict()).get(language, [])],
+                   equiv_classes, entity.get('lastrevid'), entity.get('modified'),
+                   select_statements(entity, statement_props) if statement_props else None)
+
+    def to_dict(self):
+        # json-able, e.g. for a dead-letter payload. EntityRecord(**d) gives the record back
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return "EntityRecord({}, {!r})".format(self.id, self.label)
+
+
+def fetch_records(mediawiki_api_url, ids, language="en", session=None, statement_props=None):
+    """
+    :param ids: at most 50 QIDs / PIDs
+    :param statement_props: also keep the statements of these properties (a set of PIDs, or statements.ALL)
+    :return: list of EntityRecord. missing entities are left out
+    """
+    entities = get_entities(mediawiki_api_url, ids, props=PROPS, languages=language, session=session)
+    return [EntityRecord.from_json(x, language, statement_props) for x in entities.values() if 'missing' not in x]
+
+
+def fetch_records_adaptive(mediawiki_api_url, ids, sizer, language="en", session=None, timeout=60, maxlag=None,
+                           max_retries=5, statement_props=None):
+    """
+    fetch_records for any number of IDs, in requests sized by sizer
+    :param sizer: a batching.BatchSizer. Told how each request went, and keeps count of the sizes used
+    :param timeout: seconds to wait for a response, before the request is split
+    :param maxlag: seconds. while wikidata's replication lag is higher, wait and retry with smaller requests (the
+        sizer halves the size on each maxlag error). At most max_retries times per ID
+    :param statement_props: see fetch_records
+    :return: list of EntityRecord. missing entities are left out.
+        Raises if an ID can't be fetched even on its own
+    """
+    ids = list(ids)
+    records = []
+    while ids:
+        batch, ids = ids[:sizer.size], ids[sizer.size:]
+        records.extend(_fetch_batch(mediawiki_api_url, batch, sizer, language, session, timeout, maxlag,
+                                    max_retries, statement_props))
+    return records
+
+
+def _fetch_batch(mediawiki_api_url, batch, sizer, language, session, timeout, maxlag, max_retries, statement_props):
+    def fetch_parts(size, retries):
+        return [record for i in range(0, len(batch), size)
+                for record in _fetch_batch(mediawiki_api_url, batch[i:i + size], sizer, language, session, timeout,
+                                           maxlag, retries, statement_props)]
+
+    nbytes = []
+    hooks = {'response': lambda response, *args, **kwargs: nbytes.append(len(response.content))}
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            entities = get_entities(mediawiki_api_url, batch, props=PROPS, languages=language, session=session,
+                                    maxlag=maxlag, timeout=(10, timeout), hooks=hooks)
+        except MWApiError as e:
+            if e.code == 'maxlag' and attempt < max_retries:
+                sizer.failure(len(batch))
+                time.sleep(float(e.error.get('lag', 5)))
+                if len(batch) > sizer.size:
+                    # retry in smaller requests, with the retries that are left
+                    return fetch_parts(sizer.size, max_retries - attempt - 1)
+                continue
+            if e.code not in SPLIT_CODES:
+                raise
+            error = e
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in SPLIT_STATUS:
+                raise
+            error = e
+        except (requests.Timeout, requests.ConnectionError) as e:
+            error = e
+        else:
+            sizer.success(len(batch), time.perf_counter() - start, nbytes[-1] if nbytes else 0)
+            return [EntityRecord.from_json(x, language, statement_props) for x in entities.values()
+                    if 'missing' not in x]
+        sizer.failure(len(batch))
+        if len(batch) == 1:
+            raise error
+        sizer.split()
+        return fetch_parts((len(batch) + 1) // 2, max_retries)
+    raise MWApiError({'code': 'maxlag', 'info': "still lagged after {} retries".format(max_retries)})
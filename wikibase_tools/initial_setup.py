@@ -7,92 +7,134 @@ Create a "equivalent property" property, set equiv prop statement on it to point
 Create an "equivalent class" property, which equiv prop -> owl#equivalentClass
 
 """
-import time
-from wikidataintegrator import wdi_core, wdi_login
+import argparse
 CORE_PROPS = set()
 
+from wikibase_tools.api import edit_entity
 from wikibase_tools.config import WDQS_FRONTEND_PORT, WIKIBASE_PORT, USER, PASS, HOST
+from wikibase_tools.core_props import CorePropRegistry, EQUIV_CLASS_URI, EQUIV_PROP_URI
+from wikibase_tools.deadletter import DeadLetters
+from wikibase_tools.fast_create import MAXLAG, build_entity, create_entity, url_statement
+from wikibase_tools.journal import Journal, is_stale
+from wikibase_tools.session import make_session, share_login_session
+from wikibase_tools.metrics import default_metrics as metrics, add_arguments as add_metrics_arguments, \
+    record as record_metrics
+from wikibase_tools.wait import wait_until_visible
 
 mediawiki_api_url = "http://{}:{}/w/api.php".format(HOST, WIKIBASE_PORT)
 sparql_endpoint_url = "http://{}:{}/proxy/wdqs/bigdata/namespace/wdq/sparql".format(HOST, WDQS_FRONTEND_PORT)
-localItemEngine = wdi_core.WDItemEngine.wikibase_item_engine_factory(mediawiki_api_url, sparql_endpoint_url)
+# built on first use: importing wikidataintegrator is slow
+localItemEngine = None
+session = make_session()
+metrics.instrument_session(session)
+core_props = CorePropRegistry(mediawiki_api_url, sparql_endpoint_url, session=session)
+
+
+def configure(api_url, sparql_url):
+    # set up a different wikibase than the one in config.py
+    global mediawiki_api_url, sparql_endpoint_url, localItemEngine, core_props
+    mediawiki_api_url = api_url
+    sparql_endpoint_url = sparql_url
+    localItemEngine = None
+    core_props = CorePropRegistry(mediawiki_api_url, sparql_endpoint_url, session=session)
+
+
+def get_local_item_engine():
+    global localItemEngine
+    if localItemEngine is None:
+        from wikidataintegrator import wdi_core
+        localItemEngine = wdi_core.WDItemEngine.wikibase_item_engine_factory(mediawiki_api_url, sparql_endpoint_url)
+    return localItemEngine
+
+
+def get_login(username=USER, password=PASS):
+    from wikidataintegrator import wdi_login
+    return share_login_session(wdi_login.WDLogin(username, password, mediawiki_api_url=mediawiki_api_url), session)
+
+
+def run_setup(login):
+    # a fresh wikibase may reuse the url of a previous one: forget what was cached and mirrored for that
+    journal = Journal.for_wikibase(mediawiki_api_url)
+    if is_stale(journal, mediawiki_api_url, core_props, session=session):
+        print("Starting a new journal for {}".format(mediawiki_api_url))
+        journal.clear()
+        DeadLetters.for_wikibase(mediawiki_api_url).set_aside()
+    core_props.invalidate()
+    create_equiv_property_property(login)
+    create_equiv_class_property(login)
 
 
 def create_equiv_property_property(login):
     # create a property for "equivalent property"
     # https://www.wikidata.org/wiki/Property:P1628
-    item = localItemEngine(item_name="equivalent property", domain="foo")
-    item.set_label("equivalent property")
-    item.set_description("equivalent property in other ontologies (use in statements on properties, use property URI)")
-    item.write(login, entity_type="property", property_datatype="url")
-
-    equiv_prop_pid = item.wd_item_id
+    # written with wbeditentity directly: this runs before anything else, so it shouldn't depend on the
+    # WDItemEngine api of the installed wikidataintegrator
+    data = build_entity("equivalent property",
+                        "equivalent property in other ontologies (use in statements on properties, use property URI)",
+                        [], property_datatype="url")
+    equiv_prop_pid = create_entity(mediawiki_api_url, login, data, "property").wd_item_id
+    core_props.set('equiv_prop', equiv_prop_pid)
     # add equiv prop statement to equiv prop
-    item = localItemEngine(wd_item_id=equiv_prop_pid)
-    del item.wd_json_representation['sitelinks']
-    s = wdi_core.WDUrl("http://www.w3.org/2002/07/owl#equivalentProperty", equiv_prop_pid)
-    item.update(data=[s])
-    item.write(login)
+    entity = edit_entity(mediawiki_api_url, {'claims': [url_statement(equiv_prop_pid, EQUIV_PROP_URI)]}, login,
+                         entity_id=equiv_prop_pid, maxlag=MAXLAG)
     # so the updater updates blazegraph
-    time.sleep(30)
+    wait_until_visible(sparql_endpoint_url, equiv_prop_pid, revision=entity.get('lastrevid'), session=session)
     return equiv_prop_pid
 
 
 def create_equiv_class_property(login):
-    label = "equivalent class"
-    description = "equivalent class in other ontologies (use property URI)"
-    property_datatype = "url"
-    create_property(label, description, property_datatype, ["http://www.wikidata.org/entity/P1709",
-                                                            "http://www.w3.org/2002/07/owl#equivalentClass",
-                                                            "http://www.w3.org/2004/02/skos/core#exactMatch"], login)
+    uris = ["http://www.wikidata.org/entity/P1709", EQUIV_CLASS_URI, "http://www.w3.org/2004/02/skos/core#exactMatch"]
+    data = build_entity("equivalent class", "equivalent class in other ontologies (use property URI)",
+                        [url_statement(get_quiv_prop_pid(), uri) for uri in uris], property_datatype="url")
+    entity = create_entity(mediawiki_api_url, login, data, "property")
+    core_props.set('equiv_class', entity.wd_item_id)
+    wait_until_visible(sparql_endpoint_url, entity.wd_item_id, revision=entity.lastrevid, session=session)
+    return entity.wd_item_id
 
 
 def get_quiv_prop_pid():
-    # get the equivalent property property without knowing the PID for equivalent property!!!
-    query = '''SELECT * WHERE {
-      ?item ?prop <http://www.w3.org/2002/07/owl#equivalentProperty> .
-      ?item <http://wikiba.se/ontology#directClaim> ?prop .
-    }'''
-    pid = wdi_core.WDItemEngine.execute_sparql_query(query, endpoint=sparql_endpoint_url)
-    pid = pid['results']['bindings'][0]['prop']['value']
-    pid = pid.split("/")[-1]
-    return pid
+    return core_props.equiv_prop_pid
 
 
 def get_quiv_class_pid():
-    # get the equivalent property property without knowing the PID for equivalent property!!!
-    query = '''SELECT * WHERE {{
-      ?prop wdt:{} <http://www.w3.org/2002/07/owl#equivalentClass> .
-    }}'''.format(get_quiv_prop_pid())
-    pid = wdi_core.WDItemEngine.execute_sparql_query(query, endpoint=sparql_endpoint_url)
-    pid = pid['results']['bindings'][0]['prop']['value']
-    pid = pid.split("/")[-1]
-    return pid
+    return core_props.equiv_class_pid
 
 
 def create_property(label, description, property_datatype, equiv_props, login):
-    CORE_PROPS.add(get_quiv_prop_pid())
-    s = [wdi_core.WDUrl(equiv_prop, get_quiv_prop_pid()) for equiv_prop in equiv_props]
-    item = localItemEngine(item_name=label, domain="foo", data=s)
-    item.set_label(label)
-    item.set_description(description)
-    item.write(login, entity_type="property", property_datatype=property_datatype)
+    with metrics.phase("lookup"):
+        equiv_prop_pid = get_quiv_prop_pid()
+    CORE_PROPS.add(equiv_prop_pid)
+    from wikidataintegrator import wdi_core
+    with metrics.phase("construct"):
+        s = [wdi_core.WDUrl(equiv_prop, equiv_prop_pid) for equiv_prop in equiv_props]
+        item = get_local_item_engine()(item_name=label, domain="foo", data=s)
+        item.set_label(label)
+        item.set_description(description)
+    with metrics.phase("write"):
+        item.write(login, entity_type="property", property_datatype=property_datatype)
     return item
 
 
 def create_item(label, description, equiv_classes, login):
-    CORE_PROPS.add(get_quiv_class_pid())
-    s = [wdi_core.WDUrl(equiv_class, get_quiv_class_pid()) for equiv_class in equiv_classes]
-    item = localItemEngine(item_name=label, domain="foo", data=s)
-    item.set_label(label)
-    item.set_description(description)
-    item.write(login)
+    with metrics.phase("lookup"):
+        equiv_class_pid = get_quiv_class_pid()
+    CORE_PROPS.add(equiv_class_pid)
+    from wikidataintegrator import wdi_core
+    with metrics.phase("construct"):
+        s = [wdi_core.WDUrl(equiv_class, equiv_class_pid) for equiv_class in equiv_classes]
+        item = get_local_item_engine()(item_name=label, domain="foo", data=s)
+        item.set_label(label)
+        item.set_description(description)
+    with metrics.phase("write"):
+        item.write(login)
     return item
 
 
 if __name__ == "__main__":
-    login = wdi_login.WDLogin(USER, PASS, mediawiki_api_url=mediawiki_api_url)
-    create_equiv_property_property(login)
-    create_equiv_class_property(login)
+    parser = argparse.ArgumentParser(description="Initial setup of a blank wikibase")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    with record_metrics(metrics, args.metrics, args.profile):
+        run_setup(get_login())
 
     # wdi_helpers.id_mapper(get_quiv_prop_pid(), endpoint=sparql_endpoint_url)
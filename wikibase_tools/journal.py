@@ -0,0 +1,166 @@
+"""
+Durable record of which wikidata entities have been mirrored, and what their local IDs are
+
+Every successful write is recorded right away, so a run that dies partway through can be restarted
+without recreating anything: completed IDs are skipped without a network call, and whole chunks that
+were finished are skipped via their checkpoint.
+
+Usage:
+
+journal = Journal.for_wikibase("http://localhost:7171/w/api.php")
+journal.record("Q42", "Q7")
+journal.get("Q42")
+journal.done(["Q42", "Q43"])  # {"Q42"}
+journal.record_revision("Q42", 123456, "2019-01-01T00:00:00Z")  # the wikidata revision that was mirrored
+
+The journal is keyed by the wikibase's url, which a recreated wikibase reuses: initial_setup and EntityMaker
+check a sample of the local IDs against the wikibase before trusting it (is_stale), and start over if it
+is of a wikibase that's gone. A few entities that were deleted or merged since don't make it stale.
+
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+
+from wikibase_tools.api import get_entities
+from wikibase_tools.cache import cache_path
+from wikibase_tools.catalog import WD_ENTITY_PREFIX
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS mapping (source_id TEXT PRIMARY KEY, local_id TEXT, created REAL);
+CREATE TABLE IF NOT EXISTS checkpoints (run TEXT, chunk INTEGER, done REAL, PRIMARY KEY (run, chunk));
+CREATE TABLE IF NOT EXISTS revisions (source_id TEXT PRIMARY KEY, lastrevid INTEGER, modified TEXT, synced REAL);
+'''
+
+# max number of sql variables per query
+BATCH_SIZE = 500
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL: each record is durable without a full fsync of the database
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    @classmethod
+    def for_wikibase(cls, mediawiki_api_url, path=None):
+        # one journal per target wikibase
+        if not path:
+            name = hashlib.sha1(mediawiki_api_url.encode()).hexdigest()[:12]
+            path = cache_path("journal_{}.sqlite".format(name))
+        return cls(path)
+
+    def record(self, source_id, local_id):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO mapping VALUES (?, ?, ?)", (source_id, local_id, time.time()))
+
+    def get(self, source_id):
+        with self.lock:
+            row = self.conn.execute("SELECT local_id FROM mapping WHERE source_id = ?", (source_id,)).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, source_id):
+        return self.get(source_id) is not None
+
+    def get_many(self, source_ids):
+        # dict: source_id -> local_id, for the ids that have been created
+        source_ids = list(source_ids)
+        mapping = dict()
+        with self.lock:
+            for i in range(0, len(source_ids), BATCH_SIZE):
+                batch = source_ids[i:i + BATCH_SIZE]
+                query = "SELECT source_id, local_id FROM mapping WHERE source_id IN ({})".format(
+                    ",".join("?" * len(batch)))
+                mapping.update(self.conn.execute(query, batch))
+        return mapping
+
+    def done(self, source_ids):
+        return set(self.get_many(source_ids))
+
+    def sample(self, n):
+        # n random (source_id, local_id) pairs
+        with self.lock:
+            return self.conn.execute("SELECT source_id, local_id FROM mapping ORDER BY RANDOM() LIMIT ?",
+                                     (n,)).fetchall()
+
+    def clear(self):
+        # forget everything: mappings, revisions and checkpoints
+        with self.lock, self.conn:
+            for table in ("mapping", "revisions", "checkpoints"):
+                self.conn.execute("DELETE FROM {}".format(table))
+
+    def items(self):
+        with self.lock:
+            return self.conn.execute("SELECT source_id, local_id FROM mapping ORDER BY source_id").fetchall()
+
+    def record_revision(self, source_id, lastrevid, modified=None):
+        # the revision of the source entity that the local entity now matches
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?)",
+                              (source_id, lastrevid, modified, time.time()))
+
+    def sync_state(self, source_ids):
+        """
+        :return: dict. key: source_id (created ones only), value: (local_id, created, lastrevid).
+            lastrevid is None if no revision was recorded
+        """
+        source_ids = list(source_ids)
+        state = dict()
+        with self.lock:
+            for i in range(0, len(source_ids), BATCH_SIZE):
+                batch = source_ids[i:i + BATCH_SIZE]
+                query = """SELECT m.source_id, m.local_id, m.created, r.lastrevid FROM mapping m
+                           LEFT JOIN revisions r ON m.source_id = r.source_id
+                           WHERE m.source_id IN ({})""".format(",".join("?" * len(batch)))
+                state.update((row[0], row[1:]) for row in self.conn.execute(query, batch))
+        return state
+
+    def checkpoint(self, run, chunk):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)", (run, chunk, time.time()))
+
+    def checkpoints(self, run):
+        # chunk numbers of `run` that were completed
+        with self.lock:
+            return {x[0] for x in self.conn.execute("SELECT chunk FROM checkpoints WHERE run = ?", (run,))}
+
+    def clear_checkpoints(self, run=None):
+        with self.lock, self.conn:
+            if run:
+                self.conn.execute("DELETE FROM checkpoints WHERE run = ?", (run,))
+            else:
+                self.conn.execute("DELETE FROM checkpoints")
+
+
+def get_run_id(ids, chunk_size):
+    # identifies a run by its input, so a restart with the same input finds its checkpoints
+    h = hashlib.sha1(str(chunk_size).encode())
+    for x in sorted(ids):
+        h.update(x.encode() + b"\n")
+    return h.hexdigest()
+
+
+def is_stale(journal, mediawiki_api_url, core_props, sample_size=5, session=None):
+    """
+    Whether a journal is of a wikibase that was recreated at the same url: none of a random sample of its local
+    IDs is the entity the journal says it is, or most aren't and the stored core property PIDs are wrong too
+    :param core_props: a core_props.CorePropRegistry of the wikibase. its wrong PIDs are forgotten
+    """
+    wrong_props = core_props.check()
+    sample = journal.sample(sample_size)
+    if not sample:
+        return False
+    entities = get_entities(mediawiki_api_url, [x[1] for x in sample], props="claims", session=session)
+    mismatched = 0
+    for source_id, local_id in sample:
+        claims = entities.get(local_id, dict()).get('claims', dict())
+        uris = {x['mainsnak'].get('datavalue', dict()).get('value') for v in claims.values() for x in v
+                if x['mainsnak'].get('datatype') == 'url'}
+        if WD_ENTITY_PREFIX + source_id not in uris:
+            mismatched += 1
+    return mismatched == len(sample) or (mismatched > len(sample) / 2 and bool(wrong_props))
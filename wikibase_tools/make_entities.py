@@ -13,14 +13,45 @@ m = EntityMaker(mediawiki_api_url, sparql_endpoint_url, username, password)
 m.create_item_from_qid("Q42")
 
 """
-import traceback
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from itertools import groupby
 from tqdm import tqdm
-from wikidataintegrator import wdi_core, wdi_login
 
 CORE_PROPS = set()
 from functools import lru_cache
 from more_itertools import chunked
 
+from wikibase_tools.api import WIKIDATA_API_URL, edit_entity, get_entities, search_entities, sparql_query
+from wikibase_tools.batching import BatchSizer, MAX_IDS
+from wikibase_tools.catalog import PropCatalog, get_wd_props, get_equiv_props, WIKIDATA_SPARQL_URL
+from wikibase_tools.closure import get_closure, dependency_order
+from wikibase_tools.deadletter import DeadLetters
+from wikibase_tools.core_props import CorePropRegistry
+from wikibase_tools.dump import iter_dump, get_entity_info
+from wikibase_tools.equiv_index import EquivIndex, WD_ENTITY_PREFIX
+from wikibase_tools.fetch import EntityRecord, fetch_records, fetch_records_adaptive
+from wikibase_tools.fast_create import CreatedEntity, build_entity, create_entity, url_statement, MAXLAG
+from wikibase_tools.journal import Journal, get_run_id, is_stale
+from wikibase_tools.metrics import default_metrics
+from wikibase_tools.pipeline import prefetch
+from wikibase_tools.plan import default_path, get_levels, iter_batches, read_plan, write_plan
+from wikibase_tools.rdf_export import export_rdf, verify_rdf
+from wikibase_tools.session import make_session, share_login_session
+from wikibase_tools.sparql_stream import iter_query_ids
+from wikibase_tools.statements import ALL, LocalIds, UnresolvedStatements, get_refs, left_out, translate
+from wikibase_tools.sync import is_changed, get_update
+from wikibase_tools.wait import wait_until_visible
+from wikibase_tools.write_engine import WriteEngine
+
+# number of items fetched from wikidata and written at a time (the unit of checkpoints). the chunks are
+# fetched in requests sized by a batching.BatchSizer
+CHUNK_SIZE = 50
+
 datatype_map = {
     'http://wikiba.se/ontology#CommonsMedia': 'commonsMedia',
     'http://wikiba.se/ontology#ExternalId': 'external-id',
@@ -39,13 +70,38 @@ datatype_map = {
 
 
 class EntityMaker:
-    def __init__(self, mediawiki_api_url, sparql_endpoint_url, username, password):
+    def __init__(self, mediawiki_api_url, sparql_endpoint_url, username, password, concurrency=1,
+                 edits_per_minute=None, journal=True, prefetch_chunks=2, wikidata_api_url=WIKIDATA_API_URL,
+                 wikidata_sparql_url=WIKIDATA_SPARQL_URL, metrics=None, fast_create=False, session=None,
+                 fetch_batch_size=MAX_IDS, dead_letters=True, statement_props=None):
         """
 
         :param mediawiki_api_url:
         :param sparql_endpoint_url:
         :param username:
         :param password:
+        :param concurrency: number of entities written in parallel by create_all_props and make_entities
+        :param edits_per_minute: maximum write rate (e.g. the bot edit rate limit). None: no limit
+        :param journal: record wikidata ID -> local ID of everything created, and skip those IDs in later runs.
+            True: use the default journal file for this wikibase. Can also be a path or a Journal. False: don't
+        :param prefetch_chunks: number of chunks of items make_entities downloads ahead of the one being written.
+            Bounds memory use: at most (prefetch_chunks + 2) chunks of items are held at once.
+            A chunk is CHUNK_SIZE items, or fetch_batch_size if that is larger
+        :param wikidata_api_url: where entities are copied from
+        :param wikidata_sparql_url: query service of the wikibase entities are copied from
+        :param metrics: a metrics.Metrics to record timings and requests in. default: metrics.default_metrics
+        :param fast_create: create each entity with one wbeditentity request (see fast_create.py) instead of
+            through WDItemEngine. Existing entities are then only detected through the journal and equiv index,
+            and create_item / create_property return a fast_create.CreatedEntity
+        :param session: requests session used for all requests: reads and writes to the local wikibase, the local
+            query service and wikidata. default: a new session.make_session() sized for `concurrency`
+        :param fetch_batch_size: most IDs per wbgetentities request to wikidata: 50, or up to 500 if the
+            account has apihighlimits. Requests are made smaller while responses are slow or large, and
+            failing ones are split (see batching.py)
+        :param dead_letters: record entities that failed (after retries) in a dead-letter file, for replay.
+            True: use the default file for this wikibase. Can also be a path or a DeadLetters. False: don't
+        :param statement_props: also mirror the statements of these wikidata properties (PIDs, or statements.ALL),
+            with property and item values translated to local IDs (see statements.py). Needs fast_create
         """
         """
         mediawiki_api_url = "http://localhost:7171/w/api.php"
@@ -58,173 +114,874 @@ class EntityMaker:
         self.sparql_endpoint_url = sparql_endpoint_url
         self.username = username
         self.password = password
-
-        self.localItemEngine = wdi_core.WDItemEngine.wikibase_item_engine_factory(mediawiki_api_url,
-                                                                                  sparql_endpoint_url)
-        self.login = wdi_login.WDLogin(username, password, mediawiki_api_url=mediawiki_api_url)
+        self.wikidata_api_url = wikidata_api_url
+        self.wikidata_sparql_url = wikidata_sparql_url
+        # one pool of keep-alive connections for everything
+        self.session = session if session else make_session(pool_size=max(10, 2 * concurrency))
+        self.catalog = get_catalog(wikidata_sparql_url, session=self.session)
+
+        self.metrics = metrics if metrics else default_metrics
+        self.metrics.instrument_session(self.session)
+        # wikidataintegrator is slow to import, and logging in is a network call: both are done on first use
+        self._local_item_engine = None
+        self._login = None
+        self._login_lock = threading.Lock()
+        # PIDs of "equivalent property" and "equivalent class", looked up once and cached on disk
+        self.core_props = CorePropRegistry(mediawiki_api_url, sparql_endpoint_url, session=self.session)
+        # all writes go through here, so they back off together on maxlag / rate limiting
+        self.write_engine = WriteEngine(concurrency=concurrency, edits_per_minute=edits_per_minute,
+                                        metrics=self.metrics)
+        self.prefetch_chunks = prefetch_chunks
+        self.fetch_sizer = BatchSizer(size=fetch_batch_size, max_size=fetch_batch_size, metrics=self.metrics)
+        self.chunk_size = max(CHUNK_SIZE, fetch_batch_size)
+        self.fast_create = fast_create
+        if isinstance(journal, Journal) or not journal:
+            self.journal = journal if journal else None
+        else:
+            self.journal = Journal.for_wikibase(mediawiki_api_url, path=journal if isinstance(journal, str) else None)
+        if isinstance(dead_letters, DeadLetters) or not dead_letters:
+            self.dead_letters = dead_letters if dead_letters else None
+        else:
+            self.dead_letters = DeadLetters.for_wikibase(mediawiki_api_url,
+                                                         path=dead_letters if isinstance(dead_letters, str) else None)
+        self.write_engine.dead_letters = self.dead_letters
+        if self.journal:
+            self._check_journal()
+        if statement_props and not fast_create:
+            raise ValueError("statement_props needs fast_create")
+        self.statement_props = (ALL if statement_props == ALL else set(statement_props)) if statement_props else None
+        # equiv uri -> local ID, for existence checks without a lookup per entity. loaded on first use
+        self.equiv_index = EquivIndex(sparql_endpoint_url, self.core_props, session=self.session)
+        # wikidata ID -> local ID of what statements refer to, resolved a chunk of items at a time
+        self.local_ids = LocalIds(self.journal, self.equiv_index)
+        # wikidata ID -> statements left out of the item created for it, added once they can be resolved
+        self.pending_statements = dict()
+
+    def _check_journal(self):
+        # a journal is kept per url, and a recreated wikibase reuses the url of the old one (see journal.is_stale)
+        with self.metrics.phase("lookup"):
+            stale = is_stale(self.journal, self.mediawiki_api_url, self.core_props, session=self.session)
+        if stale:
+            print("The journal {} doesn't match {}: the wikibase was recreated? Starting over".format(
+                self.journal.path, self.mediawiki_api_url))
+            self.journal.clear()
+            if self.dead_letters:
+                self.dead_letters.set_aside()
+            self.core_props.invalidate()
+
+    @property
+    def localItemEngine(self):
+        if self._local_item_engine is None:
+            from wikidataintegrator import wdi_core
+            self._local_item_engine = wdi_core.WDItemEngine.wikibase_item_engine_factory(self.mediawiki_api_url,
+                                                                                         self.sparql_endpoint_url)
+        return self._local_item_engine
+
+    @property
+    def login(self):
+        with self._login_lock:
+            if self._login is None:
+                from wikidataintegrator import wdi_login
+                self._login = share_login_session(wdi_login.WDLogin(self.username, self.password,
+                                                                    mediawiki_api_url=self.mediawiki_api_url),
+                                                  self.session)
+            return self._login
 
     def get_quiv_prop_pid(self):
-        # get the equivalent property property without knowing the PID for equivalent property!!!
-        query = '''SELECT * WHERE {
-          ?item ?prop <http://www.w3.org/2002/07/owl#equivalentProperty> .
-          ?item <http://wikiba.se/ontology#directClaim> ?prop .
-        }'''
-        pid = wdi_core.WDItemEngine.execute_sparql_query(query, endpoint=self.sparql_endpoint_url)
-        pid = pid['results']['bindings'][0]['prop']['value']
-        pid = pid.split("/")[-1]
-        return pid
+        return self.core_props.equiv_prop_pid
 
     def get_quiv_class_pid(self):
-        # get the equivalent property property without knowing the PID for equivalent property!!!
-        query = '''SELECT * WHERE {{
-          ?prop wdt:{} <http://www.w3.org/2002/07/owl#equivalentClass> .
-        }}'''.format(self.get_quiv_prop_pid())
-        pid = wdi_core.WDItemEngine.execute_sparql_query(query, endpoint=self.sparql_endpoint_url)
-        pid = pid['results']['bindings'][0]['prop']['value']
-        pid = pid.split("/")[-1]
-        return pid
-
-    def create_item(self, label, description, equiv_classes, login):
-        CORE_PROPS.add(self.get_quiv_class_pid())
-        s = [wdi_core.WDUrl(equiv_class, self.get_quiv_class_pid()) for equiv_class in equiv_classes]
-        item = self.localItemEngine(item_name=label, domain="foo", data=s)
-        item.set_label(label)
-        item.set_description(description)
-        item.write(login)
+        return self.core_props.equiv_class_pid
+
+    def create_item(self, label, description, equiv_classes, login, statements=None):
+        # statements: more statement json to create the item with (fast_create only)
+        with self.metrics.phase("lookup"):
+            equiv_class_pid = self.get_quiv_class_pid()
+        CORE_PROPS.add(equiv_class_pid)
+        if self.fast_create:
+            return self._create_entity(label, description, equiv_class_pid, equiv_classes, login,
+                                       statements=statements)
+        if statements:
+            raise ValueError("statements need fast_create")
+        from wikidataintegrator import wdi_core
+        with self.metrics.phase("construct"):
+            s = [wdi_core.WDUrl(equiv_class, equiv_class_pid) for equiv_class in equiv_classes]
+            item = self.localItemEngine(item_name=label, domain="foo", data=s)
+            item.set_label(label)
+            item.set_description(description)
+        with self.metrics.phase("write"):
+            self.write_engine.call_once(item.write, login, max_retries=1,
+                                        lookup=self._created_lookup(label, "item", equiv_class_pid, equiv_classes,
+                                                                    item=item))
+        self.equiv_index.add(equiv_classes, item.wd_item_id)
         return item
 
     def create_property(self, label, description, property_datatype, equiv_props, login):
-        CORE_PROPS.add(self.get_quiv_prop_pid())
-        s = [wdi_core.WDUrl(equiv_prop, self.get_quiv_prop_pid()) for equiv_prop in equiv_props]
-        item = self.localItemEngine(item_name=label, domain="foo", data=s)
-        item.set_label(label)
-        item.set_description(description)
-        item.write(login, entity_type="property", property_datatype=property_datatype)
+        with self.metrics.phase("lookup"):
+            equiv_prop_pid = self.get_quiv_prop_pid()
+        CORE_PROPS.add(equiv_prop_pid)
+        if self.fast_create:
+            return self._create_entity(label, description, equiv_prop_pid, equiv_props, login,
+                                       property_datatype=property_datatype)
+        from wikidataintegrator import wdi_core
+        with self.metrics.phase("construct"):
+            s = [wdi_core.WDUrl(equiv_prop, equiv_prop_pid) for equiv_prop in equiv_props]
+            item = self.localItemEngine(item_name=label, domain="foo", data=s)
+            item.set_label(label)
+            item.set_description(description)
+        with self.metrics.phase("write"):
+            self.write_engine.call_once(item.write, login, entity_type="property", property_datatype=property_datatype,
+                                        max_retries=1, lookup=self._created_lookup(label, "property", equiv_prop_pid,
+                                                                                   equiv_props, item=item))
+        self.equiv_index.add(equiv_props, item.wd_item_id)
         return item
 
+    def _create_entity(self, label, description, equiv_pid, uris, login, property_datatype=None, statements=None):
+        # fast path: one wbeditentity request, no search for existing entities
+        with self.metrics.phase("lookup"):
+            # only the wikidata uri identifies an entity. other equivalent uris can be shared
+            existing = self.equiv_index.find([x for x in uris if x.startswith(WD_ENTITY_PREFIX)])
+        if existing:
+            return CreatedEntity(existing, None)
+        with self.metrics.phase("construct"):
+            data = build_entity(label, description,
+                                [url_statement(equiv_pid, uri) for uri in uris] + (statements or []),
+                                property_datatype=property_datatype)
+        entity_type = "property" if property_datatype else "item"
+        with self.metrics.phase("write"):
+            entity = self.write_engine.call_once(create_entity, self.mediawiki_api_url, login, data, entity_type,
+                                                 lookup=self._created_lookup(label, entity_type, equiv_pid, uris))
+        self.equiv_index.add(uris, entity.wd_item_id)
+        return entity
+
+    def _created_lookup(self, label, entity_type, equiv_pid, uris, item=None):
+        """
+        A lookup for write_engine.call_once after a create failed in a way it may have been done anyway: finds the
+        entity by its label and its equiv statement to a wikidata uri, in the wiki's database (the query service
+        and the equiv index wouldn't have it yet). None if there is nothing to find it by: the create is then only
+        retried if it never reached the wikibase
+        :param item: the WDItemEngine being written. Gets the ID of the entity that is found
+        """
+        wd_uris = {x for x in uris if x.startswith(WD_ENTITY_PREFIX)}
+        if not label or not wd_uris:
+            return None
+
+        def lookup():
+            with self.metrics.phase("lookup"):
+                ids = search_entities(self.mediawiki_api_url, label, entity_type=entity_type, session=self.session)
+                entities = get_entities(self.mediawiki_api_url, ids, props="claims|info",
+                                        session=self.session) if ids else dict()
+            for local_id in ids:
+                entity = entities.get(local_id, dict())
+                claims = entity.get('claims', dict()).get(equiv_pid, [])
+                if any(x['mainsnak'].get('datavalue', dict()).get('value') in wd_uris for x in claims):
+                    if item is not None:
+                        # as if its write had succeeded
+                        item.wd_item_id = local_id
+                        return local_id
+                    return CreatedEntity(local_id, entity.get('lastrevid'))
+            return None
+        return lookup
+
     def create_item_from_wdi_item(self, item):
         # create an item in a local wikibase from a WDI item instance
-        item_info = get_item_info(item)
+        with self.metrics.phase("transform"):
+            item_info = get_item_info(item)
         label = item_info['label']
         description = item_info['description']
         equiv_classes = item_info['equiv_classes']
         equiv_classes.append("http://www.wikidata.org/entity/{}".format(item.wd_item_id.upper()))
-        return self.create_item(label, description, equiv_classes, self.login)
+        local_item = self.create_item(label, description, equiv_classes, self.login)
+        self._record(item.wd_item_id, local_item, revision=getattr(item, 'source_revision', None))
+        return local_item
+
+    def create_item_from_record(self, record):
+        # create an item in a local wikibase from a fetch.EntityRecord
+        equiv_classes = record.equiv_classes + ["http://www.wikidata.org/entity/{}".format(record.id)]
+        statements = None
+        if record.statements:
+            with self.metrics.phase("transform"):
+                statements, unresolved = translate(record.statements, self.local_ids)
+        local_item = self.create_item(record.label, record.description, equiv_classes, self.login,
+                                      statements=statements)
+        self._record(record.id, local_item, revision=(record.lastrevid, record.modified))
+        if record.statements and unresolved:
+            self.metrics.incr("unresolved_statement", len(record.statements) - len(statements))
+            self.pending_statements[record.id] = {'id': record.id, 'local_id': local_item.wd_item_id,
+                                                  'statements': left_out(record.statements, unresolved)}
+        return local_item
 
     def create_item_from_qid(self, qid):
-        item_info = get_item_info_from_qid(qid)
-        label = item_info['label']
-        description = item_info['description']
-        equiv_classes = item_info['equiv_classes']
-        equiv_classes.append("http://www.wikidata.org/entity/{}".format(qid.upper()))
-        return self.create_item(label, description, equiv_classes, self.login)
+        with self.metrics.phase("fetch"):
+            records = fetch_records(self.wikidata_api_url, [qid.upper()], session=self.session,
+                                    statement_props=self.statement_props)
+        if not records:
+            raise ValueError("No such entity: {}".format(qid))
+        return self.create_item_from_record(records[0])
 
-    def create_all_props(self):
-        prop_info = get_prop_info_from_wikidata()
-        for prop in tqdm(prop_info.values()):
-            try:
-                self.create_property(prop['pLabel'], prop.get('d', ""), datatype_map[prop['pt']], prop['equivs'],
-                                     self.login)
-            except Exception as e:
-                print(prop)
-                traceback.print_exc()
+    def create_all_props(self, concurrency=None):
+        return self._map(self.create_property_from_pid, self._not_done(self.catalog.pids()), concurrency=concurrency)
 
-    def make_entities(self, entities):
+    def make_entities(self, entities, concurrency=None, prefetch_chunks=None):
         # entitites is a list of QIDs and/or PIDs
+        # returns (results, failures): dicts keyed by wikidata ID of the created entities / exceptions
+        pids = set()
         qids = set()
         for entity in entities:
             if entity.startswith("P"):
-                try:
-                    self.create_property_from_pid(entity)
-                except Exception:
-                    print("Creation failed: {}".format(entity))
-                    traceback.print_exc()
+                pids.add(entity)
             elif entity.startswith("Q"):
                 qids.add(entity)
             else:
                 print("Unknown ID: {}".format(entity))
-        chunks = chunked(sorted(qids), 50)
-        for chunk in tqdm(chunks, total=len(qids) / 50):
-            items = dict(wdi_core.WDItemEngine.generate_item_instances(chunk)).values()
-            for item in tqdm(items):
-                try:
-                    self.create_item_from_wdi_item(item)
-                except Exception:
-                    print("Creation failed: {}".format(item.wd_item_id))
-                    traceback.print_exc()
+        results, failures = self._map(self.create_property_from_pid, self._not_done(sorted(pids)),
+                                      concurrency=concurrency)
+
+        # chunks whose items were all created in an earlier run with the same input are skipped
+        run = get_run_id(qids, self.chunk_size)
+        finished = self.journal.checkpoints(run) if self.journal else set()
+        chunks = [(n, chunk) for n, chunk in enumerate(chunked(sorted(qids), self.chunk_size))
+                  if n not in finished]
+        item_results, item_failures = self._make_items(chunks, run=run, total=len(chunks),
+                                                       concurrency=concurrency, prefetch_chunks=prefetch_chunks)
+        results.update(item_results)
+        failures.update(item_failures)
+        self._add_pending_statements(results, failures, concurrency=concurrency)
+        return results, failures
+
+    def _make_items(self, chunks, run=None, total=None, concurrency=None, prefetch_chunks=None):
+        # chunks: iterable of (chunk number, list of QIDs). consumed lazily
+        results = dict()
+        failures = dict()
+        try:
+            for n, items in self._iter_fetched(chunks, failures, total=total, prefetch_chunks=prefetch_chunks):
+                chunk_results, chunk_failures = self._create_chunk(items, concurrency=concurrency)
+                results.update(chunk_results)
+                failures.update(chunk_failures)
+                if self.journal and run and not chunk_failures:
+                    self.journal.checkpoint(run, n)
+        except BaseException:
+            # a rerun skips the items created so far, so the statements left out of them would be lost
+            self._dead_letter_pending()
+            raise
+        self.print_fetch_report()
+        return results, failures
+
+    def _create_chunk(self, records, concurrency=None):
+        # create a chunk of items. with statements, a level at a time (see plan.get_levels), so that statements
+        # referring to items of the same chunk aren't left out. references to later chunks are added at the end
+        # of the run (_add_pending_statements)
+        if not self.statement_props:
+            return self._create_items(records, concurrency=concurrency)
+        levels = get_levels({x.id: x.statements for x in records})
+        results = dict()
+        failures = dict()
+        for _, group in groupby(sorted(records, key=lambda x: levels[x.id]), key=lambda x: levels[x.id]):
+            r, f = self._create_items(list(group), concurrency=concurrency)
+            results.update(r)
+            failures.update(f)
+        return results, failures
+
+    def _iter_fetched(self, chunks, failures, total=None, prefetch_chunks=None):
+        # (chunk number, EntityRecords) of each chunk of (chunk number, QIDs). the next chunks are downloaded
+        # while the current one is written. chunks that can't be fetched go into failures
+        fetched = prefetch(lambda x: self._fetch_items(x[1]), chunks,
+                           size=prefetch_chunks if prefetch_chunks else self.prefetch_chunks)
+        for (n, chunk), items, error in tqdm(fetched, total=total, disable=not self.write_engine.progress):
+            if error:
+                print("Fetching failed: {}: {}: {}".format(",".join(chunk), type(error).__name__, error))
+                failures.update(dict.fromkeys(chunk, error))
+                if self.dead_letters:
+                    for x in chunk:
+                        self.dead_letters.add(x, error, operation="fetch")
+                continue
+            yield n, items
+
+    def _create_items(self, records, concurrency=None):
+        # create a batch of items from EntityRecords
+        if any(x.statements for x in records):
+            # one lookup for everything the batch's statements refer to
+            with self.metrics.phase("lookup"):
+                self.local_ids.load(get_refs(x.statements for x in records if x.statements))
+        return self._map(self.create_item_from_record, records, key=lambda x: x.id, concurrency=concurrency,
+                         payload=EntityRecord.to_dict)
+
+    def _add_pending_statements(self, results, failures, concurrency=None):
+        """
+        Add the statements that were left out of items created so far, because what they refer to wasn't
+        mirrored yet (items in a cycle, properties created after the items, ...), if it is now. One edit per
+        item. Statements that still can't be resolved are reported in failures as UnresolvedStatements
+        """
+        entries = [self.pending_statements.pop(x) for x in list(self.pending_statements)]
+        if not entries:
+            return
+        with self.metrics.phase("lookup"):
+            self.local_ids.load(get_refs(x['statements'] for x in entries))
+        r, f = self._map(self._add_statements, entries, key=lambda x: x['id'], concurrency=concurrency,
+                         payload=dict)
+        results.update(r)
+        failures.update(f)
+
+    def _dead_letter_pending(self):
+        # a run that is interrupted won't get to _add_pending_statements: keep the statements that were left out
+        # for a replay
+        if not self.dead_letters:
+            return
+        for entry in self.pending_statements.values():
+            error = UnresolvedStatements(entry['id'], get_refs([entry['statements']]))
+            self.dead_letters.add(entry['id'], error, operation="_add_statements", payload=entry)
+        self.pending_statements.clear()
+
+    def _find_statements(self, local_id, statements):
+        # the local entity, if it has all of the statements already (a write_engine.call_once lookup)
+        with self.metrics.phase("lookup"):
+            entity = get_entities(self.mediawiki_api_url, [local_id], props="claims|info",
+                                  session=self.session)[local_id]
+
+        def values(claims):
+            return {(x['mainsnak']['property'], json.dumps(x['mainsnak'].get('datavalue'), sort_keys=True))
+                    for x in claims}
+        current = values(x for claims in entity.get('claims', dict()).values() for x in claims)
+        return entity if values(statements) <= current else None
+
+    def _add_statements(self, entry):
+        # add the statements of a pending_statements entry that can be resolved to its local entity
+        statements, unresolved = translate(entry['statements'], self.local_ids)
+        entity = None
+        if statements:
+            with self.metrics.phase("write"):
+                entity = self.write_engine.call_once(
+                    edit_entity, self.mediawiki_api_url, {'claims': statements}, self.login,
+                    entity_id=entry['local_id'], summary="add statements", maxlag=MAXLAG,
+                    lookup=lambda: self._find_statements(entry['local_id'], statements))
+        if unresolved:
+            # what is dead-lettered: just the statements that are still missing
+            entry['statements'] = left_out(entry['statements'], unresolved)
+            raise UnresolvedStatements(entry['id'], unresolved)
+        return CreatedEntity(entity['id'], entity.get('lastrevid'))
+
+    def _fetch_items(self, qids):
+        # EntityRecords of the qids that still need to be created
+        qids = self._not_done(qids)
+        if not qids:
+            return []
+        with self.metrics.phase("fetch"):
+            return fetch_records_adaptive(self.wikidata_api_url, qids, self.fetch_sizer, session=self.session,
+                                          maxlag=MAXLAG, statement_props=self.statement_props)
+
+    def print_fetch_report(self):
+        # the wbgetentities batch sizes used so far
+        report = self.fetch_sizer.report()
+        if report['requests']:
+            print("Fetched in {requests} requests, {mean_size} IDs on average ({splits} split, {failures} failed). "
+                  "Sizes: {sizes}".format(**report))
+
+    def make_entities_closure(self, entities, depth=1, properties_only=False, concurrency=None):
+        """
+        Create entities along with the properties and items they refer to
+        :param entities: seed QIDs and/or PIDs
+        :param depth: how many levels of references to follow
+        :param properties_only: only follow references to properties, not item values
+        """
+        levels = get_closure(entities, depth=depth, properties_only=properties_only,
+                             mediawiki_api_url=self.wikidata_api_url, session=self.session)
+        print("Closure: {} entities in {} levels".format(sum(map(len, levels)), len(levels)))
+        # make_entities creates all properties before the items
+        return self.make_entities(dependency_order(levels), concurrency=concurrency)
+
+    def make_entities_from_dump(self, path, entities=None, predicate=None, processes=1, concurrency=None):
+        """
+        Mirror entities from a wikidata json dump instead of fetching them from wikidata
+        :param path: latest-all.json.gz or .bz2
+        :param entities: QIDs and/or PIDs to create. None: everything that passes `predicate`
+        :param predicate: function of an entity's json, see dump.iter_dump. e.g. dump.has_equiv_class
+        :param processes: number of processes parsing the dump
+        :return: (results, failures), as make_entities
+        """
+        results = dict()
+        failures = dict()
+        infos = iter_dump(path, ids=entities, predicate=predicate, processes=processes)
+        for batch in chunked(infos, 500):
+            not_done = set(self._not_done([x['id'] for x in batch]))
+            batch = [x for x in batch if x['id'] in not_done]
+            r, f = self._map(self.create_entity_from_info, batch, key=lambda x: x['id'], concurrency=concurrency,
+                             payload=dict)
+            results.update(r)
+            failures.update(f)
+        return results, failures
+
+    def create_entity_from_info(self, info):
+        # create an item or property from a dump.get_entity_info dict
+        if info['type'] == 'property':
+            local_item = self.create_property(info['label'], info['description'], info['datatype'], info['equivs'],
+                                              self.login)
+        else:
+            equiv_classes = info['equiv_classes'] + ["http://www.wikidata.org/entity/{}".format(info['id'])]
+            local_item = self.create_item(info['label'], info['description'], equiv_classes, self.login)
+        self._record(info['id'], local_item, revision=(info.get('lastrevid'), info.get('modified')))
+        return local_item
+
+    def _not_done(self, ids):
+        # ids that aren't in the journal yet, and don't already exist in the wikibase
+        with self.metrics.phase("lookup"):
+            return self._filter_done(ids)
+
+    def _filter_done(self, ids):
+        done = self.journal.done(ids) if self.journal else set()
+        not_done = []
+        for x in ids:
+            if x in done:
+                continue
+            local_id = self.equiv_index.get_wikidata(x)
+            if local_id:
+                # created outside of the journal
+                if self.journal:
+                    self.journal.record(x, local_id)
+                continue
+            not_done.append(x)
+        return not_done
+
+    def create_property_from_uri(self, uri):
+        """
+        make a property given its equivalent property uri
+        (the wikidata property with that equivalent property is mirrored)
+        :return: local PID. If it already exists, nothing is created
+        """
+        local_id = self.equiv_index.get(uri)
+        if local_id:
+            return local_id
+        pids = self.catalog.find_by_equiv(uri)
+        if not pids:
+            raise ValueError("No wikidata property has equivalent property: {}".format(uri))
+        local_id = self.equiv_index.get_wikidata(pids[0])
+        if local_id:
+            return local_id
+        return self.create_property_from_pid(pids[0]).wd_item_id
+
+    def wait_until_visible(self, item, timeout=600):
+        """
+        Block until the local query service has caught up with a write
+        :param item: a written WDItemEngine or CreatedEntity (waits for its revision), or an entity ID
+        """
+        if isinstance(item, str):
+            wait_until_visible(self.sparql_endpoint_url, item, timeout=timeout, session=self.session)
+        else:
+            wait_until_visible(self.sparql_endpoint_url, item.wd_item_id, revision=item.lastrevid, timeout=timeout,
+                               session=self.session)
+
+    def _record(self, source_id, local_item, revision=None):
+        # revision: (lastrevid, modified) of the source entity, if known
+        if self.journal:
+            self.journal.record(source_id, local_item.wd_item_id)
+            if revision and revision[0]:
+                self.journal.record_revision(source_id, *revision)
+
+    def sync(self, entities=None, concurrency=None):
+        """
+        Update mirrored entities that changed on wikidata since they were created or last synced (see sync.py)
+        :param entities: source QIDs / PIDs to check. default: everything in the journal
+        :return: (list of the source IDs that were updated, failures). failures as in make_entities
+        """
+        if not self.journal:
+            raise ValueError("sync needs a journal")
+        ids = entities if entities is not None else [x[0] for x in self.journal.items()]
+        state = self.journal.sync_state(ids)
+        changed, _ = self._find_changed(state, concurrency=concurrency)
+        print("Sync: {} of {} entities changed".format(len(changed), len(state)))
+
+        updated = []
+        failures = dict()
+        for pairs in self._iter_update_pairs(changed, state):
+            results, chunk_failures = self._map(self._update_entity, pairs, key=lambda x: x[0]['id'],
+                                                concurrency=concurrency)
+            updated.extend(x for x, edited in results.items() if edited)
+            failures.update(chunk_failures)
+        return updated, failures
+
+    def _find_changed(self, state, concurrency=None):
+        # (source IDs that changed on wikidata since they were mirrored, source IDs missing on wikidata)
+        # state: from journal.sync_state
+        chunks = list(chunked(sorted(state), CHUNK_SIZE))
+        with self.metrics.phase("fetch"), ThreadPoolExecutor(concurrency or self.write_engine.concurrency) as pool:
+            infos = dict()
+            for x in pool.map(lambda chunk: get_entities(self.wikidata_api_url, chunk, props="info",
+                                                         session=self.session), chunks):
+                infos.update(x)
+        changed = []
+        missing = []
+        for source_id, info in infos.items():
+            if 'missing' in info:
+                missing.append(source_id)
+                continue
+            _, created, lastrevid = state[source_id]
+            if is_changed(info, created, lastrevid):
+                changed.append(source_id)
+            elif lastrevid is None:
+                # from now on compare revisions
+                self.journal.record_revision(source_id, info['lastrevid'], info['modified'])
+        return changed, missing
+
+    def _iter_update_pairs(self, changed, state):
+        # lists of (source json, local json) of changed entities, a chunk at a time
+        for chunk in chunked(changed, CHUNK_SIZE):
+            with self.metrics.phase("fetch"):
+                sources = get_entities(self.wikidata_api_url, chunk, props="info|labels|descriptions|claims|datatype",
+                                       languages="en", session=self.session)
+                local_ids = {x: state[x][0] for x in chunk}
+                local = get_entities(self.mediawiki_api_url, list(local_ids.values()),
+                                     props="labels|descriptions|claims", languages="en", session=self.session)
+            yield [(sources[x], local[local_ids[x]]) for x in chunk if 'missing' not in local[local_ids[x]]]
+
+    def _update_entity(self, pair):
+        # bring one local entity in line with its source. returns whether an edit was made
+        source, local = pair
+        info = get_entity_info(source)
+        equiv_pid = self.get_quiv_prop_pid() if info['type'] == 'property' else self.get_quiv_class_pid()
+        with self.metrics.phase("transform"):
+            data = get_update(info, local, equiv_pid)
+        if data:
+            with self.metrics.phase("write"):
+                self.write_engine.call(edit_entity, self.mediawiki_api_url, data, self.login, entity_id=local['id'],
+                                       summary="sync from wikidata", maxlag=MAXLAG)
+        self.journal.record_revision(info['id'], info['lastrevid'], info['modified'])
+        return data is not None
+
+    def export_rdf(self, directory, ids=None, fmt="ttl", max_bytes=256 * 2 ** 20, compress=True, verify=0):
+        """
+        Write the RDF of mirrored entities to files for a bulk load of the local query service (see rdf_export.py)
+        :param ids: local QIDs / PIDs. default: everything in the journal, and the equivalent property / class
+            properties
+        :param verify: check this many random triples against the wikibase's own RDF afterwards
+        :return: (list of the paths written, list of the mismatched lines verify found)
+        """
+        if ids is None:
+            if not self.journal:
+                raise ValueError("export_rdf needs ids or a journal")
+            ids = [self.get_quiv_prop_pid(), self.get_quiv_class_pid()] + [x[1] for x in self.journal.items()]
+        with self.metrics.phase("export"):
+            paths = export_rdf(self.mediawiki_api_url, ids, directory, fmt=fmt, max_bytes=max_bytes,
+                               compress=compress, session=self.session)
+        print("Wrote {} files to {}".format(len(paths), directory))
+        mismatched = []
+        if verify:
+            with self.metrics.phase("verify"):
+                report = verify_rdf(self.mediawiki_api_url, paths, sample_size=verify, session=self.session)
+            print("Verified {sampled} triples of {entities} entities: {} mismatched".format(
+                len(report['mismatched']), **report))
+            mismatched = report['mismatched']
+            for line in mismatched:
+                print("Mismatch: {}".format(line.rstrip()))
+        return paths, mismatched
+
+    def _map(self, func, entities, key=str, concurrency=None, payload=None):
+        # run func on each entity using the write engine's worker pool. failures are reported, dead-lettered
+        # and skipped
+        concurrency = concurrency if concurrency else self.write_engine.concurrency
+        engine = self.write_engine
+        if concurrency != engine.concurrency:
+            # same throttle, different pool size
+            engine = copy(engine)
+            engine.concurrency = concurrency
+        return engine.map(func, entities, key=key, payload=payload)
+
+    def replay(self, concurrency=None):
+        """
+        Re-submit the entities in the dead-letter file, and only those. The file is moved aside first, so
+        whatever fails again ends up in a new one (see deadletter.py)
+        :return: (results, failures), as make_entities
+        """
+        if not self.dead_letters:
+            raise ValueError("replay needs dead_letters")
+        letters = self.dead_letters.take()
+        print("Replaying {} dead-lettered entities".format(len(letters)))
+        by_operation = dict()
+        for letter in letters:
+            by_operation.setdefault(letter['operation'], []).append(letter)
+
+        results, failures = self.make_entities([x['id'] for x in by_operation.pop("fetch", [])]
+                                               + [x['id'] for x in by_operation.pop("create_property_from_pid", [])],
+                                               concurrency=concurrency)
+        # the payload is what failed: no need to fetch it from wikidata again
+        records = {x['id']: EntityRecord(**x['payload']) for x in by_operation.pop("create_item_from_record", [])}
+        infos = {x['id']: x['payload'] for x in by_operation.pop("create_entity_from_info", [])}
+        for func, todo, key, payload in ((self.create_item_from_record, records, lambda x: x.id, EntityRecord.to_dict),
+                                         (self.create_entity_from_info, infos, lambda x: x['id'], dict)):
+            r, f = self._map(func, [todo[x] for x in self._not_done(list(todo))], key=key, concurrency=concurrency,
+                             payload=payload)
+            results.update(r)
+            failures.update(f)
+        # plan entries (see apply)
+        for operation, func in (("_apply_property", self._apply_property), ("_apply_update", self._apply_update),
+                                ("_add_statements", self._add_statements)):
+            entries = [x['payload'] for x in by_operation.pop(operation, [])]
+            if operation == "_apply_property":
+                todo = set(self._not_done([x['id'] for x in entries]))
+                entries = [x for x in entries if x['id'] in todo]
+            if operation == "_add_statements":
+                with self.metrics.phase("lookup"):
+                    self.local_ids.load(get_refs(x['statements'] for x in entries))
+            r, f = self._map(func, entries, key=lambda x: x['id'], concurrency=concurrency, payload=dict)
+            results.update(r)
+            failures.update(f)
+        self._add_pending_statements(results, failures, concurrency=concurrency)
+        updates = [x['id'] for x in by_operation.pop("_update_entity", [])]
+        if updates:
+            _, sync_failures = self.sync(updates, concurrency=concurrency)
+            failures.update(sync_failures)
+        for operation, x in by_operation.items():
+            print("Can't replay {}: {} entities".format(operation, len(x)))
+        return results, failures
 
     def create_property_from_pid(self, pid):
-        prop = get_prop_info_from_wikidata()[pid]
-        return self.create_property(prop['pLabel'], prop['d'], datatype_map[prop['pt']], prop['equivs'], self.login)
+        with self.metrics.phase("fetch"):
+            prop = self.catalog[pid]
+        item = self.create_property(prop['pLabel'], prop['d'], datatype_map[prop['pt']], prop['equivs'], self.login)
+        self._record(pid, item)
+        return item
 
     # make entities from a result of a sparql query.
     # requires one variable in result, which is a list of qids
-    def make_entities_from_sparql(self, query):
-        # example: all human genes
-        # query = "SELECT DISTINCT ?item WHERE { ?item wdt:P353 ?entrez . ?item wdt:P703 wd:Q15978631}"
-        df = wdi_core.WDItemEngine.execute_sparql_query(query, as_dataframe=True)
-        qids = list(df.iloc[:, 0])
-        qids = set(map(lambda x: x.replace("http://www.wikidata.org/entity/", ""), qids))
-        self.make_entities(qids)
+    def make_entities_from_sparql(self, query, page_size=None, concurrency=None):
+        """
+        example: all human genes
+        query = "SELECT DISTINCT ?item WHERE { ?item wdt:P353 ?entrez . ?item wdt:P703 wd:Q15978631}"
+        :param page_size: stream the results: page the query (page_size rows per request, see sparql_stream.py),
+            and create the items of each page while the next ones are fetched. Memory use is bounded by the page
+            size instead of the size of the result. None: run the query in one go
+        """
+        if page_size:
+            return self._make_entities_from_sparql_pages(query, page_size, concurrency=concurrency)
+        with self.metrics.phase("fetch"):
+            results = sparql_query(self.wikidata_sparql_url, query, session=self.session)
+        var = results['head']['vars'][0]
+        qids = {x[var]['value'].replace(WD_ENTITY_PREFIX, "") for x in results['results']['bindings'] if var in x}
+        return self.make_entities(qids, concurrency=concurrency)
+
+    def _make_entities_from_sparql_pages(self, query, page_size, concurrency=None):
+        pids = set()
+        # an error paging the query. what was read before it is still mirrored, then it is raised
+        error = []
+
+        def iter_qids():
+            # runs in the prefetch thread: pages are requested as the items before them are created
+            try:
+                for x in iter_query_ids(self.wikidata_sparql_url, query, page_size=page_size, session=self.session):
+                    if x.startswith("P"):
+                        pids.add(x)
+                    elif x.startswith("Q"):
+                        yield x
+            except Exception as e:
+                error.append(e)
+
+        # results can change between runs, so no chunk checkpoints. the journal still skips created items
+        results, failures = self._make_items(enumerate(chunked(iter_qids(), self.chunk_size)),
+                                            concurrency=concurrency)
+        prop_results, prop_failures = self._map(self.create_property_from_pid, self._not_done(sorted(pids)),
+                                                concurrency=concurrency)
+        results.update(prop_results)
+        failures.update(prop_failures)
+        # the statements that refer to the properties or to items of later pages
+        self._add_pending_statements(results, failures, concurrency=concurrency)
+        if error:
+            print("Paging the query failed after {} entities: {}: {}".format(
+                len(results) + len(failures), type(error[0]).__name__, error[0]))
+            raise error[0]
+        return results, failures
+
+    def plan(self, entities, path=None, depth=0, properties_only=False, max_age=None):
+        """
+        Work out what mirroring entities would do, and write it to a plan file for apply (see plan.py).
+        Only reads: nothing is written to the wikibase
+        :param entities: QIDs and/or PIDs
+        :param path: where to write the plan. default: a file in the cache directory for this input and target
+        :param depth: also plan what they refer to, this many levels deep (as make_entities_closure)
+        :param max_age: seconds. reuse the plan file if it is younger than this
+        :return: path of the plan
+        """
+        entities = sorted(set(entities))
+        header = self._plan_header(entities, depth=depth, properties_only=properties_only)
+        path = path if path else default_path(header)
+        if self._is_fresh(path, max_age):
+            return path
+        if depth:
+            levels = get_closure(entities, depth=depth, properties_only=properties_only,
+                                 mediawiki_api_url=self.wikidata_api_url, session=self.session)
+        else:
+            levels = [set(entities)]
+        counts = write_plan(path, header, self._plan_entries(dependency_order(levels)))
+        print("Plan {}: {}".format(path, ", ".join("{} {}".format(v, k) for k, v in sorted(counts.items()))))
+        return path
+
+    def plan_from_sparql(self, query, path=None, page_size=None, max_age=None):
+        # plan the items (and properties) a wikidata query returns. see plan and make_entities_from_sparql
+        header = self._plan_header({'sparql': query})
+        path = path if path else default_path(header)
+        if self._is_fresh(path, max_age):
+            return path
+        with self.metrics.phase("fetch"):
+            if page_size:
+                ids = list(iter_query_ids(self.wikidata_sparql_url, query, page_size=page_size, session=self.session))
+            else:
+                results = sparql_query(self.wikidata_sparql_url, query, session=self.session)
+                var = results['head']['vars'][0]
+                ids = [x[var]['value'].replace(WD_ENTITY_PREFIX, "") for x in results['results']['bindings']
+                       if var in x]
+        counts = write_plan(path, header, self._plan_entries(dependency_order([set(ids)])))
+        print("Plan {}: {}".format(path, ", ".join("{} {}".format(v, k) for k, v in sorted(counts.items()))))
+        return path
+
+    def _plan_header(self, inputs, depth=0, properties_only=False):
+        statement_props = self.statement_props
+        return {'target': self.mediawiki_api_url,
+                'wikidata': self.wikidata_api_url,
+                'inputs': inputs,
+                'depth': depth,
+                'properties_only': properties_only,
+                'statement_props': sorted(statement_props) if isinstance(statement_props, set) else statement_props}
+
+    @staticmethod
+    def _is_fresh(path, max_age):
+        if max_age is not None and os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+            print("Reusing plan {}".format(path))
+            return True
+        return False
+
+    def _plan_entries(self, ids):
+        # plan.py entries for the create / update / skip decision of each ID
+        new = set(self._not_done(ids))
+        done = [x for x in ids if x not in new]
+        entries = []
+
+        if self.journal:
+            state = self.journal.sync_state(done)
+            changed, missing = self._find_changed(state)
+            updates = dict()
+            for pairs in self._iter_update_pairs(changed, state):
+                for source, local in pairs:
+                    info = get_entity_info(source)
+                    equiv_pid = self.get_quiv_prop_pid() if info['type'] == 'property' else self.get_quiv_class_pid()
+                    with self.metrics.phase("transform"):
+                        data = get_update(info, local, equiv_pid)
+                    if data:
+                        updates[info['id']] = {'data': data, 'local_id': local['id'], 'lastrevid': info['lastrevid'],
+                                               'modified': info['modified']}
+            for x in done:
+                if x in updates:
+                    entries.append(dict(updates[x], action='update', id=x, type=get_entity_type(x)))
+                    continue
+                reason = ("missing on wikidata" if x in missing else
+                          "no mirrored field changed" if x in changed else "unchanged")
+                entries.append({'action': 'skip', 'id': x, 'type': get_entity_type(x), 'local_id': state[x][0],
+                                'reason': reason})
+        else:
+            entries += [{'action': 'skip', 'id': x, 'type': get_entity_type(x),
+                         'local_id': self.equiv_index.get_wikidata(x), 'reason': "exists"} for x in done]
+
+        for pid in (x for x in ids if x in new and x.startswith("P")):
+            if pid not in self.catalog:
+                entries.append({'action': 'skip', 'id': pid, 'type': 'property', 'reason': "missing on wikidata"})
+                continue
+            prop = self.catalog[pid]
+            if prop['pt'] not in datatype_map:
+                # e.g. lexemes, reached through a qualifier or reference of a closure
+                entries.append({'action': 'skip', 'id': pid, 'type': 'property', 'reason': "unsupported datatype"})
+                continue
+            entries.append({'action': 'create', 'id': pid, 'type': 'property', 'label': prop['pLabel'],
+                            'description': prop['d'], 'datatype': datatype_map[prop['pt']],
+                            'equivs': sorted(prop['equivs'])})
+
+        qids = [x for x in ids if x in new and x.startswith("Q")]
+        with self.metrics.phase("fetch"):
+            records = {x.id: x for x in fetch_records_adaptive(self.wikidata_api_url, qids, self.fetch_sizer,
+                                                               session=self.session, maxlag=MAXLAG,
+                                                               statement_props=self.statement_props)}
+        levels = get_levels({k: v.statements for k, v in records.items()})
+        for qid in qids:
+            if qid in records:
+                entries.append(dict(records[qid].to_dict(), action='create', level=levels[qid]))
+            else:
+                entries.append({'action': 'skip', 'id': qid, 'type': 'item', 'reason': "missing on wikidata"})
+        return entries
+
+    def apply(self, path, concurrency=None):
+        """
+        Do the writes of a plan file (see plan), a batch of entities that don't depend on each other at a time.
+        Nothing is fetched from wikidata. Entities created since the plan was made (e.g. by an earlier apply of
+        the same plan) are skipped
+        :return: (results, failures), as make_entities
+        """
+        header, entries = read_plan(path)
+        if header['target'] != self.mediawiki_api_url:
+            raise ValueError("{} is a plan for {}".format(path, header['target']))
+        results = dict()
+        failures = dict()
+        skipped = 0
+        for (action, entity_type, _), batch in iter_batches(entries, self.chunk_size):
+            if action == 'skip':
+                skipped += len(batch)
+                continue
+            if action == 'update':
+                r, f = self._map(self._apply_update, batch, key=lambda x: x['id'], concurrency=concurrency,
+                                 payload=dict)
+            elif entity_type == 'property':
+                todo = set(self._not_done([x['id'] for x in batch]))
+                r, f = self._map(self._apply_property, [x for x in batch if x['id'] in todo], key=lambda x: x['id'],
+                                 concurrency=concurrency, payload=dict)
+            else:
+                todo = set(self._not_done([x['id'] for x in batch]))
+                records = [EntityRecord(**{k: x.get(k) for k in EntityRecord.__slots__}) for x in batch
+                           if x['id'] in todo]
+                r, f = self._create_items(records, concurrency=concurrency)
+            results.update(r)
+            failures.update(f)
+        # items in a cycle
+        self._add_pending_statements(results, failures, concurrency=concurrency)
+        print("Applied {}: {} written, {} failed, {} skipped".format(path, len(results), len(failures), skipped))
+        return results, failures
+
+    def _apply_property(self, entry):
+        # create a property from a plan entry
+        item = self.create_property(entry['label'], entry['description'], entry['datatype'], entry['equivs'],
+                                    self.login)
+        self._record(entry['id'], item)
+        return item
+
+    def _apply_update(self, entry):
+        # edit a local entity with the data of a plan entry
+        with self.metrics.phase("write"):
+            entity = self.write_engine.call(edit_entity, self.mediawiki_api_url, entry['data'], self.login,
+                                            entity_id=entry['local_id'], summary="sync from wikidata", maxlag=MAXLAG)
+        if self.journal:
+            self.journal.record_revision(entry['id'], entry['lastrevid'], entry['modified'])
+        return CreatedEntity(entity['id'], entity.get('lastrevid'))
+
+
+def get_entity_type(entity_id):
+    return "property" if entity_id.startswith("P") else "item"
+
+
+@lru_cache()
+def get_catalog(sparql_endpoint_url=WIKIDATA_SPARQL_URL, session=None):
+    # snapshot of the wikidata property catalog, shared by everything in this process using the same session
+    return PropCatalog(sparql_endpoint_url=sparql_endpoint_url, session=session)
 
 
 @lru_cache()
 def get_prop_info_from_wikidata():
     """
     Get information about all properties in wikidata
+    Prefer get_prop_info(pid), which doesn't load the whole catalog
     :return: dict[dict]. key: wikidata PID, value:
     {'pLabel': 'label', 'd': 'description', 'pt': 'property type',
      'equivs': list of 'equivalent property uris'}
     """
-    props = get_wd_props()
-    equiv = get_equiv_props()
-    for k, v in props.items():
-        props[k].update(equiv.get(k, dict()))
-        equiv_props = ["http://www.wikidata.org/entity/" + v['p'].split("/")[-1]]
-        equiv_props.extend(v["equivs"].split("|") if "equivs" in v else [])
-        v['equivs'] = equiv_props
-    props = {k.rsplit("/", 1)[-1]: v for k, v in props.items()}
-    return props
-
-
-def get_wd_props():
-    # Get all props, inclusing labels, descriptions, aliases, from wikidata
-    query = '''SELECT ?p ?pt ?pLabel ?d ?aliases WHERE {
-      {
-        SELECT ?p ?pt ?d (GROUP_CONCAT(DISTINCT ?alias; separator="|") as ?aliases) WHERE {
-          ?p wikibase:propertyType ?pt .
-          OPTIONAL {?p skos:altLabel ?alias FILTER (LANG (?alias) = "en")}
-          OPTIONAL {?p schema:description ?d FILTER (LANG (?d) = "en") .}
-        } GROUP BY ?p ?pt ?d
-      }
-      SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }
-    }'''
-    results = wdi_core.WDItemEngine.execute_sparql_query(query)
-    results = results['results']['bindings']
-    d = [{k: v['value'] for k, v in item.items()} for item in results]
-    d = {x['p']: x for x in d}
-    return d
-
-
-def get_equiv_props():
-    # get the equivalent properties from wikidata for all properties
-    query = '''SELECT ?p (GROUP_CONCAT(DISTINCT ?equiv; separator="|") as ?equivs) WHERE {
-      ?p wikibase:propertyType ?pt .
-      ?p wdt:P1628 ?equiv
-    } GROUP BY ?p'''
-    results = wdi_core.WDItemEngine.execute_sparql_query(query)
-    results = results['results']['bindings']
-    d = [{k: v['value'] for k, v in item.items()} for item in results]
-    d = {x['p']: x for x in d}
-    return d
-
-
-def create_property_from_uri(pid):
-    """make a property given its equivalent property uri"""
-    # look up property info
-    # need to check for duplicates
-    equiv_uri_to_pid = dict()
-    # todo: finish
+    catalog = get_catalog()
+    return {pid: catalog.get(pid) for pid in catalog.pids()}
+
+
+def get_prop_info(pid):
+    # information about one wikidata property, see get_prop_info_from_wikidata
+    return get_catalog()[pid]
 
 
 def get_item_info(item):
@@ -236,6 +993,22 @@ def get_item_info(item):
             'equiv_classes': [x.get_value() for x in equiv_class_statements]}
 
 
-def get_item_info_from_qid(qid):
-    item = wdi_core.WDItemEngine(wd_item_id=qid)
-    return get_item_info(item)
+def get_item_info_from_qid(qid, mediawiki_api_url=None, sparql_endpoint_url=None, session=None):
+    from wikidataintegrator import wdi_core
+    if session is None:
+        item = wdi_core.WDItemEngine(wd_item_id=qid, mediawiki_api_url=mediawiki_api_url,
+                                     sparql_endpoint_url=sparql_endpoint_url)
+        return get_item_info(item)
+    mediawiki_api_url = mediawiki_api_url if mediawiki_api_url else WIKIDATA_API_URL
+    entity = get_entities(mediawiki_api_url, [qid], session=session)[qid]
+    return get_item_info(wdi_item_from_json(qid, entity, mediawiki_api_url))
+
+
+def wdi_item_from_json(entity_id, entity, mediawiki_api_url):
+    # a WDItemEngine of already fetched entity json (as WDItemEngine.generate_item_instances does)
+    from wikidataintegrator import wdi_core
+    item = wdi_core.WDItemEngine(wd_item_id=entity_id, item_data=entity)
+    item.mediawiki_api_url = mediawiki_api_url
+    # recorded in the journal, for EntityMaker.sync
+    item.source_revision = (entity.get('lastrevid'), entity.get('modified'))
+    return item
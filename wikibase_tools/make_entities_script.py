@@ -9,101 +9,67 @@ To make all properties in wikidata:
 ./make_entities.py
 To make a specific list of QIDs and/or PIDs
 ./make_entities.py P123,Q123,...
+To also write timings and request metrics (metrics.json, metrics.prom) and a cProfile
+./make_entities.py P123,Q123 --metrics metrics --profile run.pstats
 
 """
-import sys
+import argparse
 import traceback
-from tqdm import tqdm
-from wikidataintegrator import wdi_core, wdi_login
 from functools import lru_cache
+from tqdm import tqdm
 from more_itertools import chunked
 
+from wikibase_tools import initial_setup
+from wikibase_tools.api import sparql_query
+from wikibase_tools.catalog import WIKIDATA_SPARQL_URL, WD_ENTITY_PREFIX
+from wikibase_tools.equiv_index import EquivIndex
 from wikibase_tools.initial_setup import create_property, create_item
+from wikibase_tools.make_entities import datatype_map, get_catalog, get_prop_info
+from wikibase_tools.metrics import default_metrics as metrics, add_arguments as add_metrics_arguments, \
+    record as record_metrics
 from wikibase_tools.config import WDQS_FRONTEND_PORT, WIKIBASE_PORT, USER, PASS, HOST
 
 mediawiki_api_url = "http://{}:{}/w/api.php".format(HOST, WIKIBASE_PORT)
 sparql_endpoint_url = "http://{}:{}/proxy/wdqs/bigdata/namespace/wdq/sparql".format(HOST, WDQS_FRONTEND_PORT)
-localItemEngine = wdi_core.WDItemEngine.wikibase_item_engine_factory(mediawiki_api_url, sparql_endpoint_url)
-
-login = wdi_login.WDLogin(USER, PASS, mediawiki_api_url=mediawiki_api_url)
-
-datatype_map = {'http://wikiba.se/ontology#CommonsMedia': 'commonsMedia',
-                'http://wikiba.se/ontology#ExternalId': 'external-id',
-                'http://wikiba.se/ontology#GeoShape': 'geo-shape',
-                'http://wikiba.se/ontology#GlobeCoordinate': 'globe-coordinate',
-                'http://wikiba.se/ontology#Math': 'math',
-                'http://wikiba.se/ontology#Monolingualtext': 'monolingualtext',
-                'http://wikiba.se/ontology#Quantity': 'quantity',
-                'http://wikiba.se/ontology#String': 'string',
-                'http://wikiba.se/ontology#TabularData': 'tabular-data',
-                'http://wikiba.se/ontology#Time': 'time',
-                'http://wikiba.se/ontology#Url': 'url',
-                'http://wikiba.se/ontology#WikibaseItem': 'wikibase-item',
-                'http://wikiba.se/ontology#WikibaseProperty': 'wikibase-property'}
 
 
 @lru_cache()
-def get_prop_info_from_wikidata():
-    """
-    Get information about all properties in wikidata
-    :return: dict[dict]. key: wikidata PID, value:
-    {'pLabel': 'label', 'd': 'description', 'pt': 'property type',
-     'equivs': list of 'equivalent property uris'}
-    """
-    props = get_wd_props()
-    equiv = get_equiv_props()
-    for k, v in props.items():
-        props[k].update(equiv.get(k, dict()))
-        equiv_props = ["http://www.wikidata.org/entity/" + v['p'].split("/")[-1]]
-        equiv_props.extend(v["equivs"].split("|") if "equivs" in v else [])
-        v['equivs'] = equiv_props
-    props = {k.rsplit("/", 1)[-1]: v for k, v in props.items()}
-    return props
-
-
-def get_wd_props():
-    # Get all props, inclusing labels, descriptions, aliases, from wikidata
-    query = '''SELECT ?p ?pt ?pLabel ?d ?aliases WHERE {
-      {
-        SELECT ?p ?pt ?d (GROUP_CONCAT(DISTINCT ?alias; separator="|") as ?aliases) WHERE {
-          ?p wikibase:propertyType ?pt .
-          OPTIONAL {?p skos:altLabel ?alias FILTER (LANG (?alias) = "en")}
-          OPTIONAL {?p schema:description ?d FILTER (LANG (?d) = "en") .}
-        } GROUP BY ?p ?pt ?d
-      }
-      SERVICE wikibase:label { bd:serviceParam wikibase:language "[AUTO_LANGUAGE],en". }
-    }'''
-    results = wdi_core.WDItemEngine.execute_sparql_query(query)
-    results = results['results']['bindings']
-    d = [{k: v['value'] for k, v in item.items()} for item in results]
-    d = {x['p']: x for x in d}
-    return d
-
-
-def get_equiv_props():
-    # get the equivalent properties from wikidata for all properties
-    query = '''SELECT ?p (GROUP_CONCAT(DISTINCT ?equiv; separator="|") as ?equivs) WHERE {
-      ?p wikibase:propertyType ?pt .
-      ?p wdt:P1628 ?equiv
-    } GROUP BY ?p'''
-    results = wdi_core.WDItemEngine.execute_sparql_query(query)
-    results = results['results']['bindings']
-    d = [{k: v['value'] for k, v in item.items()} for item in results]
-    d = {x['p']: x for x in d}
-    return d
+def get_login():
+    # logged in on first use, not on import. writes go through initial_setup's session, so they are measured
+    return initial_setup.get_login(USER, PASS)
 
 
 def create_property_from_pid(pid):
-    prop = get_prop_info_from_wikidata()[pid]
-    return create_property(prop['pLabel'], prop['d'], datatype_map[prop['pt']], prop['equivs'], login)
+    with metrics.phase("fetch"):
+        prop = get_prop_info(pid)
+    return create_property(prop['pLabel'], prop['d'], datatype_map[prop['pt']], prop['equivs'], get_login())
 
 
-def create_property_from_uri(pid):
-    """make a property given its equivalent property uri"""
-    # look up property info
-    # need to check for duplicates
-    equiv_uri_to_pid = dict()
-    # todo: finish
+@lru_cache()
+def get_equiv_index():
+    # equiv uri -> local ID of the local wikibase. loaded on first use
+    return EquivIndex(initial_setup.sparql_endpoint_url, initial_setup.core_props, session=initial_setup.session)
+
+
+def create_property_from_uri(uri):
+    """
+    make a property given its equivalent property uri
+    (the wikidata property with that equivalent property is mirrored)
+    :return: local PID. If it already exists, nothing is created
+    """
+    equiv_index = get_equiv_index()
+    local_id = equiv_index.get(uri)
+    if local_id:
+        return local_id
+    pids = get_catalog().find_by_equiv(uri)
+    if not pids:
+        raise ValueError("No wikidata property has equivalent property: {}".format(uri))
+    local_id = equiv_index.get_wikidata(pids[0])
+    if local_id:
+        return local_id
+    item = create_property_from_pid(pids[0])
+    equiv_index.add([uri, WD_ENTITY_PREFIX + pids[0]], item.wd_item_id)
+    return item.wd_item_id
 
 
 def get_item_info(item):
@@ -116,18 +82,20 @@ def get_item_info(item):
 
 
 def get_item_info_from_qid(qid):
+    from wikidataintegrator import wdi_core
     item = wdi_core.WDItemEngine(wd_item_id=qid)
     return get_item_info(item)
 
 
 def create_item_from_wdi_item(item):
     # create an item in a local wikibase from a WDI item instance
-    item_info = get_item_info(item)
+    with metrics.phase("transform"):
+        item_info = get_item_info(item)
     label = item_info['label']
     description = item_info['description']
     equiv_classes = item_info['equiv_classes']
     equiv_classes.append("http://www.wikidata.org/entity/{}".format(item.wd_item_id.upper()))
-    return create_item(label, description, equiv_classes, login)
+    return create_item(label, description, equiv_classes, get_login())
 
 
 def create_item_from_qid(qid):
@@ -136,16 +104,15 @@ def create_item_from_qid(qid):
     description = item_info['description']
     equiv_classes = item_info['equiv_classes']
     equiv_classes.append("http://www.wikidata.org/entity/{}".format(qid.upper()))
-    return create_item(label, description, equiv_classes, login)
+    return create_item(label, description, equiv_classes, get_login())
 
 
 def create_all_props():
-    prop_info = get_prop_info_from_wikidata()
-    for prop in tqdm(prop_info.values()):
+    for pid in tqdm(get_catalog().pids()):
         try:
-            create_property(prop['pLabel'], prop.get('d', ""), datatype_map[prop['pt']], prop['equivs'], login)
+            create_property_from_pid(pid)
         except Exception as e:
-            print(prop)
+            print(pid)
             traceback.print_exc()
 
 
@@ -163,13 +130,17 @@ def make_entities(entities):
             qids.add(entity)
         else:
             print("Unknown ID: {}".format(entity))
+    from wikidataintegrator import wdi_core
     chunks = chunked(sorted(qids), 50)
     for chunk in tqdm(chunks, total=len(qids)/50):
-        items = dict(wdi_core.WDItemEngine.generate_item_instances(chunk)).values()
+        with metrics.phase("fetch"):
+            # with a login, wikidataintegrator fetches through its session: the measured one
+            items = dict(wdi_core.WDItemEngine.generate_item_instances(chunk, login=get_login())).values()
         for item in tqdm(items):
             try:
                 create_item_from_wdi_item(item)
             except Exception:
+                metrics.incr("failed")
                 print("Creation failed: {}".format(item.wd_item_id))
                 traceback.print_exc()
 
@@ -179,15 +150,20 @@ def make_entities(entities):
 def make_entities_from_sparql(query):
     # example: all human genes
     # query = "SELECT DISTINCT ?item WHERE { ?item wdt:P353 ?entrez . ?item wdt:P703 wd:Q15978631}"
-    df = wdi_core.WDItemEngine.execute_sparql_query(query, as_dataframe=True)
-    qids = list(df.iloc[:, 0])
-    qids = set(map(lambda x: x.replace("http://www.wikidata.org/entity/", ""), qids))
+    with metrics.phase("fetch"):
+        results = sparql_query(WIKIDATA_SPARQL_URL, query)
+    var = results['head']['vars'][0]
+    qids = {x[var]['value'].replace(WD_ENTITY_PREFIX, "") for x in results['results']['bindings'] if var in x}
     make_entities(qids)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        create_all_props()
-    else:
-        entities = sys.argv[1].split(",")
-        make_entities(entities)
+    parser = argparse.ArgumentParser(description="Recreate wikidata properties and items in a local wikibase")
+    parser.add_argument("entities", nargs="?", help="comma separated QIDs and/or PIDs. default: all properties")
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    with record_metrics(metrics, args.metrics, args.profile):
+        if not args.entities:
+            create_all_props()
+        else:
+            make_entities(args.entities.split(","))
@@ -0,0 +1,247 @@
+"""
+Timing and HTTP metrics for runs of EntityMaker and the scripts
+
+- phase timers: time spent fetching from wikidata, transforming, looking up local IDs, constructing
+  WDItemEngine instances and writing
+- per endpoint / api action request counts, errors and latency histograms of the requests made through
+  the sessions it instruments (instrument_session). EntityMaker instruments its own session, so each
+  maker counts just its own requests
+- event counters: retries, maxlag, rate limiting, ...
+- batch sizes: how many requests of each size were made (e.g. the adaptive wbgetentities batches)
+- optional cProfile capture
+
+Exported as a JSON summary or as a Prometheus textfile (for node_exporter's textfile collector).
+
+Usage:
+
+metrics = Metrics()
+metrics.instrument_session(session)
+with metrics.phase("fetch"):
+    ...
+metrics.incr("retry")
+metrics.write_json("run.json")
+metrics.write_prometheus("/var/lib/node_exporter/wikibase_tools.prom")
+
+"""
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+# the api action (or the sparql query) in a form encoded body, found without decoding the rest (e.g. the
+# wbeditentity data)
+PARAM_RE = re.compile(rb"(?:^|&)(action|query)=([^&]*)")
+
+
+class Metrics:
+    def __init__(self, prefix="wikibase_tools"):
+        self.prefix = prefix
+        self.started = time.time()
+        self.phases = dict()
+        self.requests = dict()
+        self.events = Counter()
+        self.batch_sizes = Counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        # time a block of code. phases running in parallel threads add up (busy time, not wall time)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                p = self.phases.setdefault(name, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+                p['count'] += 1
+                p['seconds'] += elapsed
+                p['max'] = max(p['max'], elapsed)
+
+    def incr(self, event, n=1):
+        with self.lock:
+            self.events[event] += n
+
+    def observe_batch(self, name, size):
+        with self.lock:
+            self.batch_sizes[(name, size)] += 1
+
+    def observe_request(self, endpoint, action, seconds, error=False):
+        with self.lock:
+            r = self.requests.setdefault((endpoint, action), {'count': 0, 'errors': 0, 'seconds': 0.0,
+                                                              'buckets': [0] * len(BUCKETS)})
+            r['count'] += 1
+            r['errors'] += int(error)
+            r['seconds'] += seconds
+            for i, le in enumerate(BUCKETS):
+                if seconds <= le:
+                    r['buckets'][i] += 1
+                    break
+
+    def instrument_session(self, session):
+        # record the http requests made through a requests session in this Metrics. a session instrumented by
+        # several Metrics records its requests in each of them
+        for prefix, adapter in list(session.adapters.items()):
+            wrapped = adapter
+            while isinstance(wrapped, InstrumentedAdapter):
+                if wrapped.metrics is self:
+                    break
+                wrapped = wrapped.adapter
+            else:
+                session.mount(prefix, InstrumentedAdapter(adapter, self))
+
+    @contextmanager
+    def profile(self, path):
+        # cProfile the block, writing pstats to path. does nothing if path is None
+        if not path:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+
+    def summary(self):
+        with self.lock:
+            requests_summary = []
+            for (endpoint, action), r in sorted(self.requests.items()):
+                cumulative = 0
+                histogram = dict()
+                for le, n in zip(BUCKETS, r['buckets']):
+                    cumulative += n
+                    histogram["+Inf" if le == float("inf") else str(le)] = cumulative
+                requests_summary.append({'endpoint': endpoint, 'action': action, 'count': r['count'],
+                                         'errors': r['errors'], 'seconds': round(r['seconds'], 6),
+                                         'mean_seconds': round(r['seconds'] / r['count'], 6),
+                                         'histogram': histogram})
+            return {'started': self.started,
+                    'wall_seconds': round(time.time() - self.started, 3),
+                    'phases': {k: dict(v, seconds=round(v['seconds'], 6), max=round(v['max'], 6))
+                               for k, v in sorted(self.phases.items())},
+                    'requests': requests_summary,
+                    'events': dict(sorted(self.events.items())),
+                    'batch_sizes': [{'batch': name, 'size': size, 'count': n}
+                                    for (name, size), n in sorted(self.batch_sizes.items())]}
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2))
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.prometheus_text())
+
+    def prometheus_text(self):
+        s = self.summary()
+        p = self.prefix
+        lines = ["# HELP {}_wall_seconds Seconds since the run started".format(p),
+                 "# TYPE {}_wall_seconds gauge".format(p),
+                 "{}_wall_seconds {}".format(p, s['wall_seconds']),
+                 "# HELP {}_phase_seconds_total Time spent in each phase".format(p),
+                 "# TYPE {}_phase_seconds_total counter".format(p)]
+        lines += ['{}_phase_seconds_total{{phase="{}"}} {}'.format(p, k, v['seconds']) for k, v in s['phases'].items()]
+        lines += ["# HELP {}_phase_count_total Number of times each phase ran".format(p),
+                  "# TYPE {}_phase_count_total counter".format(p)]
+        lines += ['{}_phase_count_total{{phase="{}"}} {}'.format(p, k, v['count']) for k, v in s['phases'].items()]
+        lines += ["# HELP {}_request_duration_seconds HTTP request latency".format(p),
+                  "# TYPE {}_request_duration_seconds histogram".format(p)]
+        for r in s['requests']:
+            labels = 'endpoint="{}",action="{}"'.format(r['endpoint'], r['action'])
+            for le, n in r['histogram'].items():
+                lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(p, labels, le, n))
+            lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(p, labels, r['seconds']))
+            lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(p, labels, r['count']))
+        lines += ["# HELP {}_request_errors_total HTTP requests that failed".format(p),
+                  "# TYPE {}_request_errors_total counter".format(p)]
+        for r in s['requests']:
+            lines.append('{}_request_errors_total{{endpoint="{}",action="{}"}} {}'.format(
+                p, r['endpoint'], r['action'], r['errors']))
+        lines += ["# HELP {}_events_total Retries, maxlag, rate limiting, failures, ...".format(p),
+                  "# TYPE {}_events_total counter".format(p)]
+        lines += ['{}_events_total{{event="{}"}} {}'.format(p, k, v) for k, v in s['events'].items()]
+        lines += ["# HELP {}_batches_total Requests made per batch size".format(p),
+                  "# TYPE {}_batches_total counter".format(p)]
+        lines += ['{}_batches_total{{batch="{}",size="{}"}} {}'.format(p, x['batch'], x['size'], x['count'])
+                  for x in s['batch_sizes']]
+        return "\n".join(lines) + "\n"
+
+
+def add_arguments(parser):
+    # command line options for the scripts
+    parser.add_argument("--metrics", metavar="PREFIX",
+                        help="write metrics to PREFIX.json and PREFIX.prom (Prometheus textfile)")
+    parser.add_argument("--profile", metavar="FILE", help="write cProfile stats to FILE")
+
+
+@contextmanager
+def record(metrics, prefix=None, profile=None):
+    # optionally profile the block, and write the metrics at the end
+    try:
+        with metrics.profile(profile):
+            yield metrics
+    finally:
+        if prefix:
+            metrics.write_json(prefix + ".json")
+            metrics.write_prometheus(prefix + ".prom")
+
+
+def _write_atomic(path, text):
+    # so a collector never reads a half written file
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def get_action(request):
+    # the mediawiki api action of a prepared request, or "sparql"
+    url = urlparse(request.url)
+    params = parse_qs(url.query)
+    if 'action' in params:
+        return params['action'][0]
+    body = request.body
+    if body and request.headers.get('Content-Type', "").startswith("application/x-www-form-urlencoded"):
+        m = PARAM_RE.search(body.encode() if isinstance(body, str) else body)
+        if m:
+            return m.group(2).decode() if m.group(1) == b"action" else "sparql"
+    if 'query' in params or url.path.endswith("sparql"):
+        return "sparql"
+    return "other"
+
+
+class InstrumentedAdapter:
+    def __init__(self, adapter, metrics):
+        """
+        A transport adapter that records each request it sends (see Metrics.instrument_session)
+        :param adapter: the adapter that does the sending
+        """
+        self.adapter = adapter
+        self.metrics = metrics
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        endpoint = url.netloc + url.path
+        action = get_action(request)
+        start = time.perf_counter()
+        try:
+            response = self.adapter.send(request, **kwargs)
+        except Exception:
+            self.metrics.observe_request(endpoint, action, time.perf_counter() - start, error=True)
+            raise
+        self.metrics.observe_request(endpoint, action, time.perf_counter() - start,
+                                     error=response.status_code >= 400)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+# shared by the module level functions in initial_setup and make_entities_script
+default_metrics = Metrics()
@@ -0,0 +1,59 @@
+"""
+Producer / consumer helpers, so reading from wikidata overlaps with writing to the local wikibase
+"""
+import queue
+import threading
+
+_DONE = object()
+
+
+def prefetch(func, items, size=2):
+    """
+    Apply func to each item in a background thread, staying at most `size` results ahead of the consumer
+    :param func: e.g. fetches a chunk of entities
+    :param items: iterable. Consumed lazily by the background thread
+    :param size: max number of results waiting to be consumed (bounds memory)
+    :return: generator of (item, result, exception). exception is None unless func raised.
+        If iterating items raises, the generator raises the same exception after the results before it
+    """
+    q = queue.Queue(maxsize=max(size, 1))
+    stop = threading.Event()
+    # an exception raised by items, for the consumer
+    error = []
+
+    def put(x):
+        # give up if the consumer went away
+        while not stop.is_set():
+            try:
+                q.put(x, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                try:
+                    x = (item, func(item), None)
+                except Exception as e:
+                    x = (item, None, e)
+                if not put(x):
+                    return
+        except Exception as e:
+            error.append(e)
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            x = q.get()
+            if x is _DONE:
+                break
+            yield x
+        if error:
+            raise error[0]
+    finally:
+        stop.set()
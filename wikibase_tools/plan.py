@@ -0,0 +1,130 @@
+"""
+Mirror plans: what a run would create, update and skip, worked out before anything is written
+
+EntityMaker.plan resolves the input (IDs, optionally with what they refer to, a SPARQL query or
+config.TO_CREATE), looks everything up on wikidata and in the journal, and writes a plan file. EntityMaker.apply
+then only does the writes. The file is JSON lines: a header, then one entry per entity, in the order they are
+applied (properties, then items by level, then updates), each a json object with sorted keys. Nothing in it
+depends on when the plan was made, so planning the same input twice gives the same file, and two plans can be
+compared with diff.
+
+{"plan": 1, "target": "http://localhost:7171/w/api.php", "inputs": ["P31", "Q5"], ...}
+{"action": "create", "datatype": "wikibase-item", "description": "...", "equivs": [...], "id": "P31", ...}
+{"action": "create", "equiv_classes": [...], "id": "Q5", "label": "human", "level": 0, "type": "item", ...}
+{"action": "update", "data": {"labels": ...}, "id": "Q42", "local_id": "Q7", ...}
+{"action": "skip", "id": "Q43", "local_id": "Q8", "reason": "unchanged"}
+
+level: items are created after the items their statements refer to (see statements.py). Items of one level
+don't refer to each other, so each level can be written in parallel.
+
+"""
+import hashlib
+import json
+import os
+from collections import defaultdict
+from itertools import groupby
+
+from more_itertools import chunked
+
+from wikibase_tools.cache import cache_path
+from wikibase_tools.statements import get_refs
+
+PLAN_VERSION = 1
+ACTIONS = ('create', 'update', 'skip')
+
+
+def default_path(header):
+    # a cache file per input and target, so a plan can be reused
+    name = hashlib.sha1(json.dumps(header, sort_keys=True).encode()).hexdigest()[:12]
+    return cache_path("plan_{}.jsonl".format(name))
+
+
+def get_levels(items):
+    """
+    Dependency levels of items to create: 0 for items whose statements don't refer to other items of the plan,
+    otherwise one more than the highest level they refer to. Items in a cycle (and what refers to them) are put
+    after everything else
+    :param items: dict: ID -> list of statements.select_statements snaks (or None)
+    :return: dict: ID -> level
+    """
+    ids = set(items)
+    # a level at a time (Kahn's algorithm): an item is ready once everything it refers to has a level
+    waiting = dict()
+    dependents = defaultdict(list)
+    for k, v in items.items():
+        deps = get_refs([v]) & ids if v else set()
+        deps.discard(k)
+        waiting[k] = len(deps)
+        for x in deps:
+            dependents[x].append(k)
+    levels = dict()
+    level = 0
+    ready = [k for k, n in waiting.items() if not n]
+    while ready:
+        next_ready = []
+        for k in ready:
+            levels[k] = level
+            for x in dependents[k]:
+                waiting[x] -= 1
+                if not waiting[x]:
+                    next_ready.append(x)
+        ready = next_ready
+        level += 1
+    # whatever is left is in a cycle, or refers to one
+    levels.update(dict.fromkeys((k for k in items if k not in levels), level))
+    return levels
+
+
+def sort_key(entry):
+    # properties, then items by level, then updates, then skips. by numeric ID within each
+    order = (ACTIONS.index(entry['action']),
+             0 if entry['action'] != 'create' or entry['type'] == 'property' else 1,
+             entry.get('level', 0))
+    return order + (entry['id'][0], int(entry['id'][1:]))
+
+
+def write_plan(path, header, entries):
+    """
+    :param header: dict
+    :param entries: iterable of dicts, in any order
+    :return: dict: "<action> <type>" -> number of entries
+    """
+    counts = dict()
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(dict(header, plan=PLAN_VERSION), sort_keys=True, ensure_ascii=False) + "\n")
+        for entry in sorted(entries, key=sort_key):
+            f.write(json.dumps(entry, sort_keys=True, ensure_ascii=False) + "\n")
+            key = "{} {}".format(entry['action'], entry['type'])
+            counts[key] = counts.get(key, 0) + 1
+    # a plan is either complete or not there
+    os.replace(tmp, path)
+    return counts
+
+
+def read_plan(path):
+    """
+    :return: (header, generator of entries). the entries are read as they are consumed
+    """
+    f = open(path, encoding='utf-8')
+    header = json.loads(f.readline())
+    if header.get('plan') != PLAN_VERSION:
+        f.close()
+        raise ValueError("{} is not a version {} plan".format(path, PLAN_VERSION))
+
+    def entries():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return header, entries()
+
+
+def iter_batches(entries, size):
+    """
+    Group consecutive entries that can be applied together (same action, type and level)
+    :return: generator of ((action, type, level), list of at most size entries)
+    """
+    for key, group in groupby(entries, key=lambda x: (x['action'], x.get('type'), x.get('level', 0))):
+        for batch in chunked(group, size):
+            yield key, batch
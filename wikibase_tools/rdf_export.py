@@ -0,0 +1,375 @@
+"""
+Export mirrored entities as RDF, to bulk load into the local query service
+
+After a large run, the query service updater replays the edits one at a time, and Blazegraph can lag behind
+by hours. Instead, the entities can be read back from the local wikibase (wbgetentities, 50 at a time) and
+written as Wikibase RDF (the subset that mirrored entities use: labels, descriptions, aliases, property
+datatypes, truthy wdt: values and statement nodes with their rank and ps: value), in the form the query
+service expects after munging. The output is streamed into files of at most max_bytes (uncompressed), each
+starting with its own prefixes, named like the dumps that the query service's loadData.sh loads by default:
+
+wikidump-000000001.ttl.gz, wikidump-000000002.ttl.gz, ...
+
+Every triple is written on one line, so the files can be sampled line by line: verify_rdf picks random
+triples and checks that the wikibase itself serializes their entities with them (Special:EntityData/<id>.nt,
+munged the way the query service munges it). That catches both conversion errors of the export and edits
+made since.
+
+Usage:
+
+paths = export_rdf(mediawiki_api_url, ["Q1", "P2", ...], "/tmp/rdf")
+verify_rdf(mediawiki_api_url, paths)  # {'sampled': 200, 'entities': 180, 'mismatched': []}
+# then, in the wdqs container: ./loadData.sh -n wdq -d /tmp/rdf
+
+"""
+import gzip
+import os
+import random
+import re
+from urllib.parse import quote, unquote
+
+from more_itertools import chunked
+
+import requests
+
+from wikibase_tools.api import get_concept_base_uri, get_entities, get_entity_data
+from wikibase_tools.pipeline import prefetch
+
+FORMATS = {'ttl', 'nt'}
+FILE_PATTERN = "wikidump-{:09d}.{}"
+
+ONTOLOGY = "http://wikiba.se/ontology#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+FIXED_PREFIXES = {
+    'rdf': "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    'rdfs': "http://www.w3.org/2000/01/rdf-schema#",
+    'skos': "http://www.w3.org/2004/02/skos/core#",
+    'schema': "http://schema.org/",
+    'xsd': XSD,
+    'geo': "http://www.opengis.net/ont/geosparql#",
+    'wikibase': ONTOLOGY,
+}
+RANKS = {'preferred': "PreferredRank", 'normal': "NormalRank", 'deprecated': "DeprecatedRank"}
+ENTITY_ID_RE = re.compile(r"([QPL]\d+)")
+TRIPLE_RE = re.compile(r"^(\S+) (\S+) (.+) \.\s*$")
+LITERAL_RE = re.compile(r'^"(.*)"(?:@([A-Za-z0-9-]+)|\^\^(\S+))?$', re.S)
+ESCAPE_RE = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))")
+ESCAPES = {'n': "\n", 'r': "\r", 't': "\t", 'b': "\b", 'f': "\f"}
+# data node triples that the query service's munger moves to the entity. the others are dropped
+MUNGED_DATA_PREDICATES = {FIXED_PREFIXES['schema'] + "version", FIXED_PREFIXES['schema'] + "dateModified"}
+LOCAL_NAME_RE = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_-]*$")
+
+
+def get_prefixes(concept_base_uri):
+    # prefix -> namespace, as the query service names them, for a wikibase with this concept base uri
+    root = concept_base_uri[:-len("entity/")] if concept_base_uri.endswith("entity/") else concept_base_uri
+    return dict(FIXED_PREFIXES,
+                wd=root + "entity/",
+                wds=root + "entity/statement/",
+                wdata=root + "wiki/Special:EntityData/",
+                wdt=root + "prop/direct/",
+                p=root + "prop/",
+                ps=root + "prop/statement/")
+
+
+def iri(uri):
+    # an IRI term. characters that aren't allowed in one are percent encoded
+    return "<{}>".format(quote(uri, safe=":/?#[]@!$&'()*+,;=%~"))
+
+
+def literal(value, language=None, datatype=None):
+    value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+    if language:
+        return '"{}"@{}'.format(value, language)
+    if datatype:
+        return '"{}"^^<{}>'.format(value, datatype)
+    return '"{}"'.format(value)
+
+
+def property_type(datatype):
+    # 'external-id' -> http://wikiba.se/ontology#ExternalId
+    return ONTOLOGY + "".join(x[:1].upper() + x[1:] for x in datatype.split("-"))
+
+
+def value_term(datatype, value, prefixes):
+    # the RDF term of a snak's datavalue value, or None if it isn't exported
+    if datatype in {'wikibase-item', 'wikibase-property'}:
+        return iri(prefixes['wd'] + value['id'])
+    if datatype == 'url':
+        return iri(value)
+    if datatype == 'commonsMedia':
+        return iri("http://commons.wikimedia.org/wiki/Special:FilePath/" + value.replace(" ", "_"))
+    if datatype in {'geo-shape', 'tabular-data'}:
+        return iri("http://commons.wikimedia.org/data/main/" + value.replace(" ", "_"))
+    if datatype == 'monolingualtext':
+        return literal(value['text'], language=value['language'])
+    if datatype == 'quantity':
+        return literal(value['amount'].lstrip("+"), datatype=XSD + "decimal")
+    if datatype == 'time':
+        return literal(value['time'].lstrip("+"), datatype=XSD + "dateTime")
+    if datatype == 'globe-coordinate':
+        return literal("Point({} {})".format(value['longitude'], value['latitude']),
+                       datatype=FIXED_PREFIXES['geo'] + "wktLiteral")
+    if isinstance(value, str):
+        # string, external-id, math, musical-notation, ...
+        return literal(value)
+    return None
+
+
+def entity_triples(entity, prefixes):
+    """
+    :param entity: wbgetentities json (info, labels, descriptions, aliases, claims, datatype)
+    :param prefixes: from get_prefixes
+    :return: list of (subject, predicate, object) N-Triples terms
+    """
+    rdf, rdfs, schema, skos, wb = (prefixes[x] for x in ('rdf', 'rdfs', 'schema', 'skos', 'wikibase'))
+    entity_id = entity['id']
+    subject = iri(prefixes['wd'] + entity_id)
+    triples = [(subject, iri(rdf + "type"), iri(wb + ("Property" if entity['type'] == 'property' else "Item")))]
+    # munged: the version and modification date of the entity's data node (wdata:) are on the entity itself,
+    # where the query service's updater (and wait.is_visible) looks for them. the data node is left out
+    if entity.get('lastrevid'):
+        triples.append((subject, iri(schema + "version"), literal(str(entity['lastrevid']), datatype=XSD + "integer")))
+    if entity.get('modified'):
+        triples.append((subject, iri(schema + "dateModified"), literal(entity['modified'], datatype=XSD + "dateTime")))
+    for x in entity.get('labels', dict()).values():
+        label = literal(x['value'], language=x['language'])
+        triples += [(subject, iri(rdfs + "label"), label), (subject, iri(skos + "prefLabel"), label),
+                    (subject, iri(schema + "name"), label)]
+    for x in entity.get('descriptions', dict()).values():
+        triples.append((subject, iri(schema + "description"), literal(x['value'], language=x['language'])))
+    for aliases in entity.get('aliases', dict()).values():
+        for x in aliases:
+            triples.append((subject, iri(skos + "altLabel"), literal(x['value'], language=x['language'])))
+    if entity['type'] == 'property':
+        triples += [(subject, iri(wb + "propertyType"), iri(property_type(entity['datatype']))),
+                    (subject, iri(wb + "directClaim"), iri(prefixes['wdt'] + entity_id)),
+                    (subject, iri(wb + "claim"), iri(prefixes['p'] + entity_id)),
+                    (subject, iri(wb + "statementProperty"), iri(prefixes['ps'] + entity_id))]
+
+    for pid, claims in entity.get('claims', dict()).items():
+        # truthy: the best ranked values
+        best = 'preferred' if any(x.get('rank') == 'preferred' for x in claims) else 'normal'
+        for claim in claims:
+            snak = claim['mainsnak']
+            statement = iri(prefixes['wds'] + claim['id'].replace("$", "-"))
+            rank = claim.get('rank', 'normal')
+            triples += [(subject, iri(prefixes['p'] + pid), statement),
+                        (statement, iri(rdf + "type"), iri(wb + "Statement")),
+                        (statement, iri(wb + "rank"), iri(wb + RANKS[rank]))]
+            if rank == best:
+                triples.append((statement, iri(rdf + "type"), iri(wb + "BestRank")))
+            if snak.get('snaktype') != 'value':
+                continue
+            value = value_term(snak.get('datatype'), snak['datavalue']['value'], prefixes)
+            if value is None:
+                continue
+            triples.append((statement, iri(prefixes['ps'] + pid), value))
+            if rank == best:
+                triples.append((subject, iri(prefixes['wdt'] + pid), value))
+    return triples
+
+
+def compact(term, namespaces):
+    # prefixed name of an IRI term, if there is one (turtle)
+    if not term.startswith("<"):
+        return term
+    uri = term[1:-1]
+    for namespace, prefix in namespaces:
+        if uri.startswith(namespace) and LOCAL_NAME_RE.match(uri[len(namespace):]):
+            return prefix + ":" + uri[len(namespace):]
+    return term
+
+
+def format_triples(triples, fmt, prefixes):
+    # one line per triple
+    if fmt == 'nt':
+        return "".join("{} {} {} .\n".format(*x) for x in triples)
+    # longest namespace first: wds: before wd:, ps: before p:
+    namespaces = sorted(((v, k) for k, v in prefixes.items()), key=lambda x: -len(x[0]))
+    return "".join("{} {} {} .\n".format(*(compact(t, namespaces) for t in x)) for x in triples)
+
+
+class RotatingWriter:
+    def __init__(self, directory, fmt="ttl", max_bytes=256 * 2 ** 20, compress=True, header=""):
+        """
+        Writes text to numbered files (FILE_PATTERN) in directory, starting a new one when max_bytes is reached
+        :param header: written at the start of every file (the turtle prefixes)
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.extension = fmt + (".gz" if compress else "")
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.header = header
+        self.paths = []
+        self.file = None
+        self.size = 0
+
+    def write(self, text):
+        # text is never split between files, so each file holds whole entities
+        size = len(text.encode('utf-8'))
+        if self.file is None or (self.size and self.size + size > self.max_bytes):
+            self._next_file()
+        self.file.write(text)
+        self.size += size
+
+    def _next_file(self):
+        self.close()
+        path = os.path.join(self.directory, FILE_PATTERN.format(len(self.paths) + 1, self.extension))
+        self.file = gzip.open(path, 'wt', encoding='utf-8') if self.compress else open(path, 'w', encoding='utf-8')
+        self.paths.append(path)
+        self.file.write(self.header)
+        self.size = len(self.header.encode('utf-8'))
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def turtle_header(prefixes):
+    return "".join("@prefix {}: <{}> .\n".format(k, v) for k, v in sorted(prefixes.items()))
+
+
+def export_rdf(mediawiki_api_url, ids, directory, fmt="ttl", max_bytes=256 * 2 ** 20, compress=True,
+               concept_base_uri=None, session=None):
+    """
+    Write the RDF of entities of a wikibase to files for bulk loading
+    :param ids: local QIDs / PIDs. Entities that don't exist are skipped
+    :param directory: where the files are written
+    :param fmt: "ttl" (Turtle) or "nt" (N-Triples)
+    :param max_bytes: most (uncompressed) bytes per file
+    :param compress: gzip the files
+    :param concept_base_uri: of the wikibase. default: asked from its api
+    :return: list of the paths written
+    """
+    if fmt not in FORMATS:
+        raise ValueError("fmt must be one of {}".format(FORMATS))
+    prefixes = get_prefixes(concept_base_uri or get_concept_base_uri(mediawiki_api_url, session=session))
+    writer = RotatingWriter(directory, fmt=fmt, max_bytes=max_bytes, compress=compress,
+                            header=turtle_header(prefixes) if fmt == 'ttl' else "")
+    props = "info|labels|descriptions|aliases|claims|datatype"
+    # the next batches are fetched while one is written
+    fetched = prefetch(lambda chunk: get_entities(mediawiki_api_url, chunk, props=props, session=session),
+                       chunked(ids, 50))
+    try:
+        for chunk, entities, error in fetched:
+            if error:
+                raise error
+            for entity in entities.values():
+                if 'missing' not in entity:
+                    writer.write(format_triples(entity_triples(entity, prefixes), fmt, prefixes))
+    finally:
+        writer.close()
+    return writer.paths
+
+
+def iter_triple_lines(paths):
+    # the triple lines of exported files
+    for path in paths:
+        with (gzip.open(path, 'rt', encoding='utf-8') if path.endswith(".gz") else open(path, encoding='utf-8')) as f:
+            for line in f:
+                if line.strip() and not line.startswith("@prefix"):
+                    yield line
+
+
+def get_subject_entity(line, prefixes):
+    # ID of the entity a triple line was exported for (its subject is the entity or a statement)
+    subject = line.split(" ", 1)[0].strip("<>")
+    # wds: before wd:, whose namespace it starts with
+    for prefix in ('wds', 'wd'):
+        for namespace in (prefixes[prefix], prefix + ":"):
+            if subject.startswith(namespace):
+                m = ENTITY_ID_RE.match(subject[len(namespace):])
+                return m.group(1) if m else None
+    return None
+
+
+def unescape(value):
+    # the string an N-Triples / turtle string literal stands for
+    def replace(m):
+        code = m.group(1) or m.group(2)
+        return chr(int(code, 16)) if code else ESCAPES.get(m.group(3), m.group(3))
+    return ESCAPE_RE.sub(replace, value)
+
+
+def parse_term(term, prefixes):
+    """
+    A form of a term that doesn't depend on how it was written (prefixed name or IRI, escapes)
+    :return: ('iri', uri), ('literal', value, language, datatype uri) or ('blank', label)
+    """
+    m = LITERAL_RE.match(term)
+    if m:
+        value, language, datatype = m.groups()
+        return ('literal', unescape(value), language.lower() if language else None,
+                parse_term(datatype, prefixes)[1] if datatype else None)
+    if term.startswith("<"):
+        return ('iri', unquote(term[1:-1]))
+    if term.startswith("_:"):
+        return ('blank', term)
+    prefix, _, local = term.partition(":")
+    return ('iri', prefixes[prefix] + local)
+
+
+def parse_triple(line, prefixes):
+    # (subject, predicate, object) of a triple line, each from parse_term. None if it isn't one
+    m = TRIPLE_RE.match(line.strip())
+    return tuple(parse_term(x, prefixes) for x in m.groups()) if m else None
+
+
+def munge(triples, entity_id, prefixes):
+    # what the query service keeps of an entity's triples: its data node's version and modification date
+    # are moved to the entity itself, the rest of the data node is dropped
+    data = ('iri', prefixes['wdata'] + entity_id)
+    entity = ('iri', prefixes['wd'] + entity_id)
+    munged = set()
+    for subject, predicate, obj in triples:
+        if subject == data:
+            if predicate[1] in MUNGED_DATA_PREDICATES:
+                munged.add((entity, predicate, obj))
+            continue
+        munged.add((subject, predicate, obj))
+    return munged
+
+
+def get_server_triples(mediawiki_api_url, entity_id, prefixes, session=None):
+    # the munged triples of the wikibase's own RDF of an entity. an empty set if it doesn't exist
+    try:
+        text = get_entity_data(mediawiki_api_url, entity_id, fmt="nt", session=session)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return set()
+        raise
+    triples = (parse_triple(x, prefixes) for x in text.splitlines())
+    return munge([x for x in triples if x], entity_id, prefixes)
+
+
+def verify_rdf(mediawiki_api_url, paths, sample_size=200, concept_base_uri=None, session=None, seed=None):
+    """
+    Check a random sample of exported triples against the RDF the wikibase serves for their entities now
+    (Special:EntityData, munged). One request per entity in the sample
+    :param paths: from export_rdf
+    :return: dict: 'sampled': number of triples checked, 'entities': number of entities they belong to,
+        'mismatched': the triple lines that aren't in the wikibase's RDF of their entity
+    """
+    prefixes = get_prefixes(concept_base_uri or get_concept_base_uri(mediawiki_api_url, session=session))
+    # reservoir sample: the files are read once, and only the sample is kept
+    rng = random.Random(seed)
+    sample = []
+    for n, line in enumerate(iter_triple_lines(paths)):
+        if len(sample) < sample_size:
+            sample.append(line)
+        else:
+            i = rng.randrange(n + 1)
+            if i < sample_size:
+                sample[i] = line
+    by_entity = dict()
+    for line in sample:
+        by_entity.setdefault(get_subject_entity(line, prefixes), []).append(line)
+
+    mismatched = list(by_entity.pop(None, []))
+    for entity_id in sorted(by_entity):
+        current = get_server_triples(mediawiki_api_url, entity_id, prefixes, session=session)
+        mismatched += [x for x in by_entity[entity_id] if parse_triple(x, prefixes) not in current]
+    return {'sampled': len(sample), 'entities': len(by_entity), 'mismatched': mismatched}
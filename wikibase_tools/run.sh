@@ -4,6 +4,7 @@ set -e
 
 USER="$(python -c 'import config;print(config.USER)')"
 PASS="$(python -c 'import config;print(config.PASS)')"
+BOTS="$(python -c 'import config;print(config.BOTS)')"
 TO_CREATE="$(python -c 'import config;print(config.TO_CREATE)')"
 
 wget -N https://raw.githubusercontent.com/wmde/wikibase-docker/master/docker-compose.yml
@@ -20,6 +21,9 @@ ID=$(docker-compose ps -q wikibase)
 # create a new bot account
 sleep 10
 docker exec -it $ID php /var/www/html/maintenance/createAndPromote.php ${USER} ${PASS} --bot
+for BOT in ${BOTS//,/ }; do
+    docker exec -it $ID php /var/www/html/maintenance/createAndPromote.php ${BOT%%:*} ${BOT#*:} --bot
+done
 
 ./initial_setup.py
 
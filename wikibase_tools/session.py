@@ -0,0 +1,53 @@
+"""
+A pooled http session shared by all requests to the local wikibase, the local query service and wikidata
+
+Connections are kept alive and reused, response bodies are gzip compressed, and every request gets a
+default timeout. On the local docker stack, most of the latency of a request is setting up its connection,
+so going through one session instead of a new connection per call matters.
+
+Usage:
+
+session = make_session(pool_size=16, timeout=(5, 120))
+get_entities(mediawiki_api_url, ["Q42"], session=session)
+EntityMaker(..., session=session)
+
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "wikibase_tools (https://github.com/stuppie/wikibase-tools)"
+
+# (connect, read) seconds. SPARQL queries over the whole wikibase can take a while
+DEFAULT_TIMEOUT = (10, 300)
+
+
+class PooledSession(requests.Session):
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def make_session(pool_size=10, timeout=DEFAULT_TIMEOUT, user_agent=USER_AGENT):
+    """
+    :param pool_size: connections kept open per host. Should be at least the number of threads using the session
+    :param timeout: default timeout of each request. seconds, or a (connect, read) tuple
+    :return: a requests.Session
+    """
+    session = PooledSession(timeout=timeout)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({'User-Agent': user_agent, 'Accept-Encoding': "gzip, deflate",
+                            'Connection': "keep-alive"})
+    return session
+
+
+def share_login_session(login, session):
+    # make a wdi_login.WDLogin use session (keeping its cookies), so writes go through the same pool
+    session.cookies.update(login.get_session().cookies)
+    login.s = session
+    return login
@@ -0,0 +1,130 @@
+"""
+Mirror entities with several processes, each writing as a different bot account
+
+A single account is capped by its edit rate limit, however many threads it writes with. Here the IDs are
+split deterministically (by a hash of the ID, so a rerun gives every shard the same IDs again) between
+one worker process per account, each running its own EntityMaker. All shards share the journal, so a
+rerun skips whatever any of them already created. Progress is shown per shard, and the results and
+failures of all shards are merged into one report.
+
+The extra accounts are set with BOTS in config.py, as "user:password,user:password".
+
+Usage:
+
+report = make_entities_sharded(mediawiki_api_url, sparql_endpoint_url, get_accounts(), ["Q42", "P31", ...])
+report['failed']  # {'Q42': 'MWApiError: ...'}
+
+"""
+import hashlib
+import json
+import multiprocessing
+import time
+
+from tqdm import tqdm
+
+from wikibase_tools.catalog import WIKIDATA_SPARQL_URL
+from wikibase_tools.core_props import CorePropRegistry
+from wikibase_tools.journal import Journal
+
+
+def get_accounts():
+    # (username, password) of the main bot account and the extra ones in config.BOTS
+    from wikibase_tools.config import USER, PASS, BOTS
+    accounts = [(USER, PASS)]
+    for x in BOTS.split(","):
+        if x.strip():
+            user, password = x.strip().split(":", 1)
+            accounts.append((user, password))
+    return accounts
+
+
+def get_shard(entity_id, n_shards):
+    # stable across runs and python processes (unlike hash())
+    return int(hashlib.sha1(entity_id.encode()).hexdigest(), 16) % n_shards
+
+
+def partition(ids, n_shards):
+    shards = [[] for _ in range(n_shards)]
+    for x in sorted(set(ids)):
+        shards[get_shard(x, n_shards)].append(x)
+    return shards
+
+
+def run_shard(shard, username, password, ids, maker_kwargs):
+    # runs in a worker process
+    from wikibase_tools.make_entities import EntityMaker
+    start = time.time()
+    maker = EntityMaker(username=username, password=password, **maker_kwargs)
+    # the parent shows progress
+    maker.write_engine.progress = False
+    results, failures = maker.make_entities(ids)
+    return {'shard': shard,
+            'account': username,
+            'entities': len(ids),
+            'created': {k: v.wd_item_id for k, v in results.items()},
+            'failed': {k: "{}: {}".format(type(e).__name__, e) for k, e in failures.items()},
+            'fetch': maker.fetch_sizer.report(),
+            'seconds': round(time.time() - start, 1)}
+
+
+def make_entities_sharded(mediawiki_api_url, sparql_endpoint_url, accounts, entities=None, report_path=None,
+                          poll_interval=2, **maker_kwargs):
+    """
+    :param accounts: list of (username, password), one worker process each. See get_accounts
+    :param entities: QIDs and/or PIDs. None: all wikidata properties (as create_all_props)
+    :param report_path: also write the merged report to this json file
+    :param maker_kwargs: passed to each EntityMaker (e.g. concurrency, edits_per_minute, fast_create).
+        Must be picklable, so no metrics or session
+    :return: dict: 'shards': per shard summaries, 'created': {source ID: local ID}, 'failed': {source ID: error}
+    """
+    # fill the caches the workers share before they start, so they don't all fetch them at once
+    if entities is None:
+        from wikibase_tools.make_entities import get_catalog
+        entities = get_catalog(maker_kwargs.get('wikidata_sparql_url', WIKIDATA_SPARQL_URL)).pids()
+    core_props = CorePropRegistry(mediawiki_api_url, sparql_endpoint_url)
+    core_props.get('equiv_prop')
+    core_props.get('equiv_class')
+
+    shards = partition(entities, len(accounts))
+    journal = maker_kwargs.get('journal', True)
+    if journal is True or isinstance(journal, str):
+        journal = Journal.for_wikibase(mediawiki_api_url, path=journal if isinstance(journal, str) else None)
+        maker_kwargs['journal'] = journal.path
+    maker_kwargs = dict(maker_kwargs, mediawiki_api_url=mediawiki_api_url, sparql_endpoint_url=sparql_endpoint_url)
+
+    # spawn: workers must not inherit sqlite connections or threads of this process
+    with multiprocessing.get_context("spawn").Pool(len(accounts)) as pool:
+        pending = [pool.apply_async(run_shard, (n, user, password, ids, maker_kwargs))
+                   for n, ((user, password), ids) in enumerate(zip(accounts, shards))]
+        bars = [tqdm(total=len(ids), desc="shard {} ({})".format(n, user), position=n)
+                for n, ((user, _), ids) in enumerate(zip(accounts, shards))]
+        while not all(x.ready() for x in pending):
+            time.sleep(poll_interval)
+            if journal:
+                # the journal is shared, so it tells how far each shard got
+                for bar, ids in zip(bars, shards):
+                    bar.update(len(journal.done(ids)) - bar.n)
+        for bar in bars:
+            bar.close()
+
+    report = {'shards': [], 'created': dict(), 'failed': dict()}
+    for n, (x, (user, _), ids) in enumerate(zip(pending, accounts, shards)):
+        try:
+            summary = x.get()
+        except Exception as e:
+            # the whole shard failed (e.g. its login)
+            summary = {'shard': n, 'account': user, 'entities': len(ids), 'created': dict(),
+                       'failed': dict.fromkeys(ids, "{}: {}".format(type(e).__name__, e)), 'error': str(e)}
+        report['created'].update(summary['created'])
+        report['failed'].update(summary['failed'])
+        summary['created'] = len(summary['created'])
+        summary['failed'] = len(summary['failed'])
+        report['shards'].append(summary)
+
+    for summary in report['shards']:
+        print("Shard {shard} ({account}): {entities} entities, {created} created, {failed} failed".format(**summary))
+    print("Created: {}, failed: {}".format(len(report['created']), len(report['failed'])))
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return report
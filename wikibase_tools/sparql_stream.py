@@ -0,0 +1,105 @@
+"""
+Page through the results of a large SPARQL query, instead of running it in one go
+
+A query like "all genes in all organisms" returns millions of rows: as a single request it hits the query
+service timeout, and loading the whole result as json (or a DataFrame) exhausts memory. Here the query is
+wrapped as a subquery and paged with a keyset on one variable:
+
+SELECT * WHERE { { <query> } FILTER (STR(?item) > "<last value of the previous page>") }
+ORDER BY STR(?item) LIMIT <page_size>
+
+Each page is read as TSV, line by line, so at most one page of values is held in memory, and the caller
+can start working on the first page before the later ones are requested.
+
+Usage:
+
+for qid in iter_query_ids(sparql_endpoint_url, "SELECT ?item WHERE { ?item wdt:P31 wd:Q7187 }"):
+    ...
+
+"""
+import re
+
+import requests
+
+from wikibase_tools.catalog import WD_ENTITY_PREFIX
+
+# PREFIX / BASE declarations (and comments) have to stay in front of the wrapping query
+PROLOGUE_RE = re.compile(r"^(\s*(?:(?:PREFIX\s+[\w.-]*:\s*<[^>]*>|BASE\s+<[^>]*>|#[^\n]*)\s*)*)", re.I)
+SELECT_VAR_RE = re.compile(r"SELECT\s+(?:DISTINCT\s+|REDUCED\s+)?\?(\w+)", re.I)
+
+
+def get_first_var(query):
+    m = SELECT_VAR_RE.search(query)
+    if not m:
+        raise ValueError("Could not find the first variable of the query. Pass var=")
+    return m.group(1)
+
+
+def page_query(query, var, page_size, after=None):
+    # the query for the page of rows with ?var after `after`
+    prologue = PROLOGUE_RE.match(query).group(1)
+    body = query[len(prologue):]
+    if after:
+        keyset = 'FILTER (STR(?{}) > "{}")'.format(var, after.replace("\\", "\\\\").replace('"', '\\"'))
+    else:
+        keyset = 'FILTER (BOUND(?{}))'.format(var)
+    return '{}SELECT * WHERE {{ {{ {} }} {} }} ORDER BY STR(?{}) LIMIT {}'.format(prologue, body, keyset, var,
+                                                                               page_size)
+
+
+def term_value(term):
+    # value of an RDF term as written in SPARQL TSV results: <iri>, "literal"@en, "literal"^^<type>, 42, ...
+    if term.startswith("<") and term.endswith(">"):
+        return term[1:-1]
+    if term.startswith('"'):
+        end = term.rfind('"')
+        return term[1:end].replace('\\"', '"').replace("\\t", "\t").replace("\\n", "\n").replace("\\\\", "\\")
+    return term
+
+
+def iter_tsv(sparql_endpoint_url, query, session=None):
+    """
+    Run a query, parsing the TSV results as they arrive
+    :return: generator of dicts. key: variable name, value: the value of its term. unbound variables are left out
+    """
+    session = session if session else requests
+    response = session.post(sparql_endpoint_url, data={'query': query},
+                            headers={'Accept': 'text/tab-separated-values'}, stream=True)
+    try:
+        response.raise_for_status()
+        lines = response.iter_lines(decode_unicode=True)
+        header = [x.lstrip("?") for x in next(lines, "").split("\t")]
+        for line in lines:
+            if not line:
+                continue
+            yield {k: term_value(v) for k, v in zip(header, line.split("\t")) if v}
+    finally:
+        response.close()
+
+
+def iter_query_values(sparql_endpoint_url, query, var=None, page_size=10000, session=None):
+    """
+    Distinct values of one variable of a query, fetched page by page
+    :param var: the variable to page on and return. default: the first variable selected by the query
+    :param page_size: rows per request
+    :return: generator of values (uris or literal values), in STR order
+    """
+    var = var if var else get_first_var(query)
+    after = None
+    while True:
+        # read the whole page before yielding, so the connection isn't held open while the caller works
+        page = [row.get(var) for row in iter_tsv(sparql_endpoint_url, page_query(query, var, page_size, after),
+                                                 session=session)]
+        for value in page:
+            if value is not None and value != after:
+                after = value
+                yield value
+        if len(page) < page_size:
+            break
+
+
+def iter_query_ids(sparql_endpoint_url, query, var=None, page_size=10000, session=None):
+    # QIDs / PIDs of the wikidata entities a query returns
+    for value in iter_query_values(sparql_endpoint_url, query, var=var, page_size=page_size, session=session):
+        if value.startswith(WD_ENTITY_PREFIX):
+            yield value[len(WD_ENTITY_PREFIX):]
@@ -0,0 +1,143 @@
+"""
+Mirror statements of wikidata items, with the properties and entity values translated to local IDs
+
+Besides label, description and equivalent class, items can be mirrored with the main values of selected
+properties (qualifiers and references are left out). Every statement refers to wikidata IDs: its property,
+and for wikibase-item / wikibase-property values the value too. Looking these up one by one would be a
+lookup per claim value, so EntityMaker first collects the IDs referred to by a whole chunk of items
+(get_refs) and resolves them with one bulk query of the journal's mapping table, falling back to the
+EquivIndex for entities mirrored outside of the journal (LocalIds.load). Each item is then written with
+all of its translated statements in one edit.
+
+Statements whose property or value isn't mirrored yet are left out of the new item. EntityMaker creates
+the items of a chunk that refer to each other in dependency order (plan.get_levels), and once the items of
+a run are created it adds the statements that were left out and can now be resolved (references to later
+chunks, items in a cycle) with one edit per item. What is still unresolved then is reported as an
+UnresolvedStatements failure and dead-lettered, so it can be added with a replay after the missing entities
+are mirrored. A run that is interrupted dead-letters the statements it left out so far.
+
+Usage:
+
+local_ids = LocalIds(journal, equiv_index)
+local_ids.load(get_refs(record.statements for record in records))
+statements, unresolved = translate(record.statements, local_ids)
+
+"""
+import threading
+
+# statement_props value that selects the statements of every property
+ALL = "*"
+
+ENTITY_DATATYPES = {'wikibase-item', 'wikibase-property'}
+
+
+class UnresolvedStatements(Exception):
+    # statements of an item were left out, because the entities they refer to aren't mirrored
+    def __init__(self, entity_id, ids):
+        self.entity_id = entity_id
+        self.ids = ids
+        super().__init__("statements of {} refer to entities that aren't mirrored: {}".format(
+            entity_id, ", ".join(sorted(ids))))
+
+
+def select_statements(entity, props):
+    """
+    The main snaks of an entity's statements, trimmed to what is needed to recreate them
+    :param entity: wikidata entity json
+    :param props: set of PIDs, or ALL
+    :return: list of snak dicts (property, datatype, datavalue). snaks without a value are left out
+    """
+    snaks = []
+    for pid, claims in entity.get('claims', dict()).items():
+        if props != ALL and pid not in props:
+            continue
+        for claim in claims:
+            snak = claim['mainsnak']
+            if snak.get('snaktype') == 'value' and snak.get('datatype'):
+                snaks.append({'property': pid, 'datatype': snak['datatype'], 'datavalue': snak['datavalue']})
+    return snaks
+
+
+def get_refs(statement_lists):
+    # wikidata IDs (properties and entity values) referred to by an iterable of select_statements lists
+    refs = set()
+    for snaks in statement_lists:
+        for snak in snaks:
+            refs.add(snak['property'])
+            if snak['datatype'] in ENTITY_DATATYPES:
+                refs.add(snak['datavalue']['value']['id'])
+    return refs
+
+
+def left_out(snaks, unresolved):
+    # the snaks that translate left out because they refer to one of the unresolved IDs
+    return [x for x in snaks if get_refs([[x]]) & unresolved]
+
+
+class LocalIds:
+    def __init__(self, journal, equiv_index):
+        """
+        wikidata ID -> local ID, resolved in bulk
+        :param journal: a Journal, or None
+        :param equiv_index: an EquivIndex of the local wikibase
+        """
+        self.journal = journal
+        self.equiv_index = equiv_index
+        self.mapping = dict()
+        self.lock = threading.Lock()
+
+    def load(self, ids):
+        """
+        Resolve ids with one query of the journal (the ones it doesn't know are looked up in the EquivIndex),
+        replacing what was loaded before, so an ID that wasn't mirrored then is looked up again
+        """
+        ids = set(ids)
+        mapping = self.journal.get_many(ids) if self.journal else dict()
+        for x in ids - set(mapping):
+            mapping[x] = self.equiv_index.get_wikidata(x)
+        with self.lock:
+            self.mapping = mapping
+
+    def get_many(self, ids):
+        # ids that weren't loaded (e.g. for a single item) are resolved together
+        mapping = self.mapping
+        missing = [x for x in ids if x not in mapping]
+        found = self.journal.get_many(missing) if self.journal and missing else dict()
+        for x in missing:
+            if x not in found:
+                found[x] = self.equiv_index.get_wikidata(x)
+        if found:
+            with self.lock:
+                self.mapping.update(found)
+        return {x: found[x] if x in found else mapping[x] for x in ids}
+
+
+def translate(snaks, local_ids):
+    """
+    Statement json for the local wikibase
+    :param snaks: from select_statements
+    :param local_ids: a LocalIds
+    :return: (list of statement json, set of wikidata IDs that aren't mirrored). statements referring to
+        those are left out
+    """
+    mapping = local_ids.get_many(get_refs([snaks]))
+    statements = []
+    unresolved = set()
+    for snak in snaks:
+        pid = mapping[snak['property']]
+        datavalue = snak['datavalue']
+        if snak['datatype'] in ENTITY_DATATYPES:
+            local_id = mapping[datavalue['value']['id']]
+            if not local_id:
+                unresolved.add(datavalue['value']['id'])
+                continue
+            datavalue = {'type': 'wikibase-entityid',
+                         'value': {'entity-type': datavalue['value']['entity-type'], 'id': local_id,
+                                   'numeric-id': int(local_id[1:])}}
+        if not pid:
+            unresolved.add(snak['property'])
+            continue
+        statements.append({'mainsnak': {'snaktype': 'value', 'property': pid, 'datatype': snak['datatype'],
+                                        'datavalue': datavalue},
+                           'type': 'statement', 'rank': 'normal'})
+    return statements, unresolved
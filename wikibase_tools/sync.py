@@ -0,0 +1,71 @@
+"""
+Keep mirrored entities up to date with wikidata
+
+The journal records the wikidata revision (lastrevid) each local entity was made from. A sync fetches only
+revision metadata for the mirrored IDs (wbgetentities props=info, 50 per request), and re-fetches and
+updates just the entities whose revision changed: label, description and equivalent property / class
+statements. Entities mirrored before revisions were recorded are compared by modification time against
+when they were created.
+
+Usage:
+
+m = EntityMaker(...)
+updated, failures = m.sync()  # everything in the journal
+updated, failures = m.sync(["Q42", "P31"])
+
+"""
+from datetime import datetime, timezone
+
+from wikibase_tools.catalog import WD_ENTITY_PREFIX
+from wikibase_tools.fast_create import url_statement
+
+
+def parse_modified(modified):
+    # wikidata's "2019-01-01T00:00:00Z" -> unix time
+    return datetime.strptime(modified, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+
+def is_changed(info, created, lastrevid):
+    """
+    :param info: wbgetentities props=info json of the source entity
+    :param created: unix time the local entity was created (from the journal)
+    :param lastrevid: source revision recorded in the journal, or None
+    """
+    if lastrevid is not None:
+        return info['lastrevid'] != lastrevid
+    return parse_modified(info['modified']) > created
+
+
+def get_equiv_uris(info):
+    # the equivalent uris a local entity should have, from a dump.get_entity_info dict
+    if info['type'] == 'property':
+        return info['equivs']
+    return info['equiv_classes'] + [WD_ENTITY_PREFIX + info['id']]
+
+
+def get_update(info, local_entity, equiv_pid, language="en"):
+    """
+    wbeditentity data that brings a local entity in line with its source
+    :param info: dump.get_entity_info of the source entity
+    :param local_entity: json of the local entity (labels, descriptions, claims)
+    :param equiv_pid: local PID of equivalent property (for properties) or equivalent class (for items)
+    :return: dict, or None if nothing changed
+    """
+    data = dict()
+    for key, value in (('labels', info['label']), ('descriptions', info['description'])):
+        current = local_entity.get(key, dict()).get(language, dict()).get('value', "")
+        if value != current:
+            data[key] = {language: {'language': language, 'value': value} if value else
+                         {'language': language, 'remove': ""}}
+
+    current = dict()
+    for claim in local_entity.get('claims', dict()).get(equiv_pid, []):
+        snak = claim['mainsnak']
+        if snak.get('snaktype') == 'value':
+            current[snak['datavalue']['value']] = claim['id']
+    uris = get_equiv_uris(info)
+    claims = [url_statement(equiv_pid, uri) for uri in uris if uri not in current]
+    claims += [{'id': guid, 'remove': ""} for uri, guid in current.items() if uri not in uris]
+    if claims:
+        data['claims'] = claims
+    return data if data else None
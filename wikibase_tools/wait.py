@@ -0,0 +1,57 @@
+"""
+Wait for the query service to catch up with writes to the wikibase
+
+The wdqs updater copies edits into blazegraph some time after they are made. Instead of sleeping for
+a fixed time, poll the query service (with exponential backoff) until the entity or revision shows up.
+
+Usage:
+
+item.write(login)
+wait_until_visible(sparql_endpoint_url, item.wd_item_id, revision=item.lastrevid)
+
+"""
+import time
+
+from wikibase_tools.api import sparql_query
+
+
+def poll_until(check, timeout=600, initial_delay=0.5, max_delay=15, factor=2):
+    """
+    Call check() until it returns something truthy, sleeping initial_delay, initial_delay * factor, ...
+    (at most max_delay) in between
+    :param timeout: seconds. raise TimeoutError once this has passed
+    :return: the value returned by check
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        result = check()
+        if result:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError()
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
+
+
+def is_visible(sparql_endpoint_url, entity_id, revision=None, session=None):
+    # is the entity (at least at `revision`) in the query service
+    if revision:
+        query = "ASK {{ wd:{} schema:version ?v . FILTER (?v >= {}) }}".format(entity_id, revision)
+    else:
+        query = "ASK {{ wd:{} ?p ?o }}".format(entity_id)
+    return sparql_query(sparql_endpoint_url, query, session=session)['boolean']
+
+
+def wait_until_visible(sparql_endpoint_url, entity_id, revision=None, timeout=600, session=None, **kwargs):
+    """
+    Block until the query service has `entity_id` (at `revision` or newer, if given)
+    :param kwargs: passed to poll_until
+    """
+    try:
+        poll_until(lambda: is_visible(sparql_endpoint_url, entity_id, revision, session=session), timeout=timeout,
+                   **kwargs)
+    except TimeoutError:
+        raise TimeoutError("{} (revision {}) not visible in {} after {} seconds".format(
+            entity_id, revision, sparql_endpoint_url, timeout)) from None
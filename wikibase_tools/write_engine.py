@@ -0,0 +1,246 @@
+"""
+Throttled, concurrent execution of writes to a wikibase
+
+All writes go through WriteEngine.call, which spaces them out with a Throttle shared by every worker.
+Errors are classified (see classify):
+- throttle: maxlag or a rate limit error. The wikibase is overloaded for everyone, so the shared throttle
+  backs off (using the reported lag if there is one, plus some jitter) and the write is retried. As writes
+  succeed again, the delay shrinks back to zero
+- transient: server errors, timeouts, edit conflicts. Only the worker that hit it waits (exponential
+  backoff with full jitter) and retries; the other workers carry on
+- permanent: anything else. Not retried
+
+Some writes must not happen twice: creating an entity (wbeditentity new=...) or adding statements. After a
+transient error the request may well have been carried out (a timeout or 502 while the wiki was saving), and
+sending it again would make a duplicate. These go through WriteEngine.call_once, which only repeats them
+right away if the request never reached the server (a connection that couldn't be opened). Otherwise it
+first checks with a lookup function whether the write happened, and only retries if it didn't.
+
+WriteEngine.map runs a function over many entities with a bounded pool of worker threads. A failure only
+affects the entity it happened on: it is reported in one line and, if the engine has dead_letters, written
+to the dead-letter file (see deadletter.py) for a later replay.
+
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from tqdm import tqdm
+from urllib3.exceptions import NewConnectionError
+
+# api error codes that mean "slow down and try again"
+THROTTLE_CODES = {'maxlag', 'ratelimited', 'readonly'}
+# api error codes of failures that a later attempt usually doesn't run into
+TRANSIENT_CODES = {'editconflict', 'failed-save', 'internal_api_error_DBQueryError',
+                   'internal_api_error_DBConnectionError', 'internal_api_error_MWException'}
+TRANSIENT_STATUS = {500, 502, 503, 504}
+
+THROTTLE = "throttle"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+
+def get_api_error(e):
+    # the 'error' dict of the api response that caused an exception, if there is one
+    if hasattr(e, 'error') and isinstance(e.error, dict):
+        # wikibase_tools.api.MWApiError
+        return e.error
+    if hasattr(e, 'wd_error_msg') and isinstance(e.wd_error_msg, dict):
+        # wdi_core.WDApiError
+        return e.wd_error_msg.get('error', dict())
+    return dict()
+
+
+def get_error_code(e):
+    error = get_api_error(e)
+    if 'actionthrottledtext' in {x.get('name') for x in error.get('messages', [])}:
+        return 'ratelimited'
+    return error.get('code')
+
+
+def classify(e):
+    # THROTTLE, TRANSIENT or PERMANENT
+    code = get_error_code(e)
+    if code in THROTTLE_CODES:
+        return THROTTLE
+    if code in TRANSIENT_CODES or isinstance(e, (requests.Timeout, requests.ConnectionError)):
+        return TRANSIENT
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        if e.response.status_code == 429:
+            return THROTTLE
+        if e.response.status_code in TRANSIENT_STATUS:
+            return TRANSIENT
+    return PERMANENT
+
+
+def never_sent(e):
+    # did a request fail before it reached the server: a connect timeout, connection refused, dns failure, ...
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    if isinstance(e, requests.ConnectionError) and e.args:
+        reason = getattr(e.args[0], 'reason', e.args[0])
+        return isinstance(reason, NewConnectionError)
+    # throttle errors: the wiki refused the write
+    return classify(e) == THROTTLE
+
+
+def backoff_delay(attempt, base=1, cap=60):
+    # exponential backoff with full jitter, so workers that failed together don't retry together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Throttle:
+    def __init__(self, edits_per_minute=None, max_delay=300):
+        """
+        Shared by all workers of a WriteEngine
+        :param edits_per_minute: upper bound on the write rate (e.g. the bot rate limit of the wiki). None: no bound
+        :param max_delay: maximum number of seconds between two writes when backing off
+        """
+        self.min_interval = 60 / edits_per_minute if edits_per_minute else 0
+        self.max_delay = max_delay
+        self.delay = 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        # block until this worker may send its next write
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + max(self.min_interval, self.delay)
+        if slot > now:
+            time.sleep(slot - now)
+
+    def success(self):
+        with self.lock:
+            self.delay = self.delay / 2 if self.delay > 0.5 else 0
+
+    def backoff(self, seconds=None):
+        with self.lock:
+            self.delay = min(self.max_delay, max(self.delay * 2, 1, seconds or 0))
+            # jitter: processes writing to the same wikibase (see shard.py) don't all come back at once
+            self.next_slot = max(self.next_slot, time.monotonic() + self.delay * random.uniform(1, 1.5))
+
+
+class WriteEngine:
+    def __init__(self, concurrency=1, edits_per_minute=None, max_retries=10, max_transient_retries=3, metrics=None,
+                 dead_letters=None):
+        """
+
+        :param concurrency: number of worker threads used by `map`
+        :param edits_per_minute: see Throttle
+        :param max_retries: number of times a write is retried after maxlag / rate limit errors
+        :param max_transient_retries: number of times a write is retried after transient errors
+        :param metrics: a metrics.Metrics, counts retries and failures
+        :param dead_letters: a deadletter.DeadLetters, where map records the entities that failed
+        """
+        self.concurrency = concurrency
+        # show progress bars. off when several processes write at once (see shard.py)
+        self.progress = True
+        self.max_retries = max_retries
+        self.max_transient_retries = max_transient_retries
+        self.metrics = metrics
+        self.dead_letters = dead_letters
+        self.throttle = Throttle(edits_per_minute)
+        self.print_lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        # call func (which does one write), retrying throttle and transient errors. see the module docstring
+        return self._call(func, args, kwargs)
+
+    def call_once(self, func, *args, lookup=None, **kwargs):
+        """
+        call, for a write that must not be done twice (see the module docstring)
+        :param lookup: function that checks whether the write was done after all, returning what func would have
+            returned if it was, and None otherwise. None: the write is only retried if it never reached the server
+        """
+        return self._call(func, args, kwargs, once=True, lookup=lookup)
+
+    def _call(self, func, args, kwargs, once=False, lookup=None):
+        throttled = 0
+        transient = 0
+        while True:
+            self.throttle.wait()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                if kind == THROTTLE and throttled < self.max_retries:
+                    throttled += 1
+                    self.throttle.backoff(get_api_error(e).get('lag'))
+                elif kind == TRANSIENT and transient < self.max_transient_retries:
+                    if once and not never_sent(e):
+                        if lookup is None:
+                            raise
+                        # give a request that is still being processed time to finish
+                        time.sleep(backoff_delay(transient))
+                        done = lookup()
+                        if done is not None:
+                            if self.metrics:
+                                self.metrics.incr("found_after_error")
+                            self.throttle.success()
+                            return done
+                    else:
+                        time.sleep(backoff_delay(transient))
+                    transient += 1
+                else:
+                    raise
+                if self.metrics:
+                    self.metrics.incr("retry")
+                    self.metrics.incr(get_error_code(e) or kind)
+                continue
+            self.throttle.success()
+            return result
+
+    def map(self, func, items, key=str, total=None, desc=None, payload=None):
+        """
+        Run func on each item. At most `concurrency` items are in progress at a time
+        :param func: function of one item
+        :param items: iterable. Consumed lazily
+        :param key: gives the id of an item, used in the results and in error messages
+        :param payload: gives what is stored in the dead-letter file for a failed item (json). default: nothing
+        :return: (results, failures). dicts, key: key(item). values: func's return value or the exception raised
+        """
+        results = dict()
+        failures = dict()
+
+        def handle(item, future_result):
+            try:
+                results[key(item)] = future_result()
+                if self.metrics:
+                    self.metrics.incr("succeeded")
+            except Exception as e:
+                failures[key(item)] = e
+                if self.metrics:
+                    self.metrics.incr("failed")
+                with self.print_lock:
+                    print("Failed: {}: {}: {}".format(key(item), type(e).__name__, e))
+                if self.dead_letters:
+                    self.dead_letters.add(key(item), e, operation=getattr(func, '__name__', None),
+                                          payload=payload(item) if payload else None)
+
+        total = total if total is not None else (len(items) if hasattr(items, '__len__') else None)
+        progress = tqdm(total=total, desc=desc, disable=not self.progress)
+        if self.concurrency <= 1:
+            for item in items:
+                handle(item, lambda: func(item))
+                progress.update()
+            progress.close()
+            return results, failures
+
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            pending = dict()
+            for item in items:
+                if len(pending) >= 2 * self.concurrency:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        handle(pending.pop(future), future.result)
+                        progress.update()
+                pending[pool.submit(func, item)] = item
+            for future in list(pending):
+                handle(pending.pop(future), future.result)
+                progress.update()
+        progress.close()
+        return results, failures